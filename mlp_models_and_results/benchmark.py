@@ -0,0 +1,134 @@
+import argparse, datetime, json, os, platform, subprocess, sys, tempfile, time
+import numpy as np
+from ase import units
+from ase.md.npt import NPT
+from ase.md.velocitydistribution import MaxwellBoltzmannDistribution, Stationary
+
+from calculators import BACKENDS, get_calculator
+from md_driver import load_system, setup_production
+from profiling import Timers, instrument
+
+
+# MD throughput benchmark: ns/day and where a production step's time goes.
+#
+# For each backend and system size, the box from generate_system.py is tiled
+# (TILES copies, doubling x, y, z in turn), given velocities, run WARMUP steps
+# untimed (first calls, compilation, allocator warm-up), then STEPS steps with
+# exactly the production setup of md_driver.py (NVT, .bin trajectory through
+# AsyncObservers, thermo log, checkpoints) in a temporary directory. The time
+# per step is split into forces, each observer, the integrator (the rest) and
+# the final flush/close. 'io' is the frame writing itself: on the background
+# thread with async I/O (overlapping the steps), inline with --sync-io.
+#
+# Every (backend, size) result is appended as one JSON line to RESULTS_FILE
+# with the date, host, git commit and settings, so runs can be compared over
+# time. The mock backend runs on a CPU-only machine.
+#
+#   python benchmark.py mock --tiles 1 2 --steps 100
+#   python benchmark.py orb mace aimnet2 sevennet --tiles 1 2 4 8
+INPUT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'water_acetic_imidazole_mix.xyz')
+BOX_LENGTH = 37.2
+TILES = [1, 2, 4, 8]
+STEPS = 200
+WARMUP = 20
+INTERVAL = 10
+TEMP = 330
+RESULTS_FILE = 'benchmark_results.jsonl'
+
+
+def tile(atoms, n):
+    """n copies of the box (n a power of two), doubling along x, y, z in turn."""
+    reps = [1, 1, 1]
+    k = 0
+    while np.prod(reps) < n:
+        reps[k % 3] *= 2
+        k += 1
+    if np.prod(reps) != n:
+        raise ValueError(f'Tile count must be a power of two, got {n}.')
+    return atoms.repeat(reps)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_segment(backend, atoms, steps=STEPS, warmup=WARMUP, interval=INTERVAL, async_io=True, device=None, temp=TEMP):
+    """Time one production segment. Returns a result dict (per-step times in ms)."""
+    atoms.calc = get_calculator(backend, device)
+    MaxwellBoltzmannDistribution(atoms, temperature_K=temp, rng=np.random.default_rng(0))
+    Stationary(atoms)
+    NPT(atoms, timestep=1.0*units.fs, temperature_K=temp, externalstress=0, pfactor=None, ttime=100*units.fs).run(warmup)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dyn, _, writers = setup_production(atoms, os.path.join(tmp, backend), temp_target=temp, version='bench',
+                                           interval=interval, async_io=async_io)
+        timers = instrument(dyn, Timers())
+        t0 = time.perf_counter()
+        dyn.run(steps)
+        wall = time.perf_counter() - t0
+        t1 = time.perf_counter()
+        for w in writers:
+            w.close()
+        close = time.perf_counter() - t1
+
+    ms = lambda s: s / steps * 1e3
+    observers = {name[len('observer: '):]: ms(s[1]) for name, s in timers.stats.items() if name.startswith('observer: ')}
+    io = {name[len('io: '):]: ms(s[1]) for name, s in timers.stats.items() if name.startswith('io: ')}
+    forces = timers.stats.get('forces', [0, 0.0])
+    return {
+        'backend': backend, 'atoms': len(atoms), 'steps': steps, 'interval': interval, 'async_io': async_io,
+        'ms_per_step': ms(wall + close), 'ns_per_day': steps * 1e-6 / (wall + close) * 86400,
+        'forces_ms': ms(forces[1]), 'force_calls': forces[0],
+        'integrator_ms': ms(wall - forces[1] - timers.total('observer: ')),
+        'observers_ms': observers, 'io_ms': io, 'close_ms': ms(close),
+    }
+
+
+def print_result(r):
+    obs = ', '.join(f'{k} {v:.2f}' for k, v in r['observers_ms'].items())
+    io = ', '.join(f'{k} {v:.2f}' for k, v in r['io_ms'].items())
+    print(f'{r["backend"]:>9} {r["atoms"]:>7} atoms: {r["ms_per_step"]:8.2f} ms/step {r["ns_per_day"]:8.3f} ns/day | '
+          f'forces {r["forces_ms"]:.2f}, integrator {r["integrator_ms"]:.2f}, observers [{obs}], '
+          f'io{" (background)" if r["async_io"] else ""} [{io}], close {r["close_ms"]:.2f} ms/step')
+
+
+def benchmark(backends, input_file=INPUT_FILE, tiles=TILES, steps=STEPS, warmup=WARMUP, interval=INTERVAL,
+              async_io=True, device=None, results_file=RESULTS_FILE):
+    base = load_system(input_file, box_length=BOX_LENGTH)
+    meta = {'date': datetime.datetime.now().isoformat(timespec='seconds'), 'host': platform.node(),
+            'commit': git_commit(), 'python': platform.python_version(), 'input': os.path.basename(input_file)}
+    results = []
+    for backend in backends:
+        for n in tiles:
+            r = run_segment(backend, tile(base, n), steps=steps, warmup=warmup, interval=interval,
+                            async_io=async_io, device=device)
+            if 'torch' in sys.modules:
+                r['torch'] = sys.modules['torch'].__version__
+            r.update(meta, tiles=n)
+            print_result(r)
+            results.append(r)
+            if results_file:
+                with open(results_file, 'a') as f:
+                    f.write(json.dumps(r) + '\n')
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ns/day and per-phase step timing for MD backends.')
+    parser.add_argument('backends', nargs='+', choices=sorted(BACKENDS))
+    parser.add_argument('--input', default=INPUT_FILE)
+    parser.add_argument('--tiles', type=int, nargs='+', default=TILES, help='Box copies per run (powers of two).')
+    parser.add_argument('--steps', type=int, default=STEPS)
+    parser.add_argument('--warmup', type=int, default=WARMUP)
+    parser.add_argument('--interval', type=int, default=INTERVAL)
+    parser.add_argument('--sync-io', action='store_true')
+    parser.add_argument('--device', default=None)
+    parser.add_argument('--results', default=RESULTS_FILE, help='JSON-lines file results are appended to.')
+    args = parser.parse_args()
+
+    benchmark(args.backends, input_file=args.input, tiles=args.tiles, steps=args.steps, warmup=args.warmup,
+              interval=args.interval, async_io=not args.sync_io, device=args.device, results_file=args.results)
@@ -0,0 +1,175 @@
+import json, os, sys
+import numpy as np
+from ase import Atoms
+from ase.io import write
+
+
+# Binary trajectory container used by the production scripts instead of
+# appending extxyz text every INTERVAL steps.
+#
+# Layout:
+#   8 bytes   magic (b'MDTRAJ01')
+#   4 bytes   little-endian uint32 length of the JSON header
+#   n bytes   JSON header (natoms, atomic numbers, pbc)
+#   frames    fixed-size records: step (int64), cell (3x3 float32),
+#             positions (N x 3 float32), velocities (N x 3 float32)
+#
+# Every frame has the same size, so frame k lives at header_size + k * frame_size
+# and a half-written record at the end of the file is simply ignored on read.
+MAGIC = b'MDTRAJ01'
+BUFFER_FRAMES = 100   # NOTE: Frames kept in memory before one bulk write (~9 MB for 3,700 atoms).
+
+
+def frame_dtype(natoms):
+    """Numpy record type of one frame."""
+    return np.dtype([
+        ('step', '<i8'),
+        ('cell', '<f4', (3, 3)),
+        ('positions', '<f4', (natoms, 3)),
+        ('velocities', '<f4', (natoms, 3)),
+    ])
+
+
+def _read_header(f):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f'{f.name} is not a binary trajectory (bad magic).')
+    n = int(np.frombuffer(f.read(4), dtype='<u4')[0])
+    header = json.loads(f.read(n).decode('utf-8'))
+    return header, len(MAGIC) + 4 + n
+
+
+class BinaryTrajectoryWriter:
+    """Keeps the trajectory file open and writes frames in buffered blocks.
+
+    Appends to an existing file if its header matches the atoms (restarts).
+    """
+
+    def __init__(self, filename, atoms, buffer_frames=BUFFER_FRAMES):
+        self.filename = filename
+        self.atoms = atoms
+        self.natoms = len(atoms)
+        self.dtype = frame_dtype(self.natoms)
+        self.buffer = np.zeros(buffer_frames, dtype=self.dtype)
+        self.n_buffered = 0
+        self.frames_written = 0
+
+        numbers = atoms.get_atomic_numbers()
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:
+            with open(filename, 'rb') as f:
+                header, offset = _read_header(f)
+            if header['natoms'] != self.natoms or header['numbers'] != numbers.tolist():
+                raise ValueError(f'{filename} holds a different system, refusing to append.')
+            # Drop any half-written record left by a killed job before appending.
+            n_complete = (os.path.getsize(filename) - offset) // self.dtype.itemsize
+            with open(filename, 'r+b') as f:
+                f.truncate(offset + n_complete * self.dtype.itemsize)
+            self.frames_written = n_complete
+            self.f = open(filename, 'ab')
+        else:
+            header = json.dumps({'natoms': self.natoms,
+                                 'numbers': numbers.tolist(),
+                                 'pbc': atoms.get_pbc().tolist()}).encode('utf-8')
+            self.f = open(filename, 'wb')
+            self.f.write(MAGIC)
+            self.f.write(np.array([len(header)], dtype='<u4').tobytes())
+            self.f.write(header)
+
+    def write(self, atoms=None, step=0):
+        """Copy the current frame into the buffer (flushes when full)."""
+        if atoms is None:
+            atoms = self.atoms
+        self.write_arrays(step, atoms.cell.array, atoms.positions, atoms.get_velocities())
+
+    def write_arrays(self, step, cell, positions, velocities):
+        """Same as write(), from plain arrays (e.g. snapshots from a background thread)."""
+        rec = self.buffer[self.n_buffered]
+        rec['step'] = step
+        rec['cell'] = cell
+        rec['positions'] = positions
+        rec['velocities'] = velocities
+        self.n_buffered += 1
+        if self.n_buffered == len(self.buffer):
+            self.flush()
+
+    def write_block(self, records):
+        """Write an array of frame records (frame_dtype) straight to disk."""
+        self.flush()
+        self.f.write(np.asarray(records, dtype=self.dtype).tobytes())
+        self.frames_written += len(records)
+
+    def flush(self):
+        if self.n_buffered == 0:
+            return
+        self.f.write(self.buffer[:self.n_buffered].tobytes())
+        self.f.flush()
+        self.frames_written += self.n_buffered
+        self.n_buffered = 0
+
+    def close(self):
+        if not self.f.closed:
+            self.flush()
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BinaryTrajectoryReader:
+    """Memory-mapped, random-access reader for binary trajectories."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.header, self.offset = _read_header(f)
+        self.natoms = self.header['natoms']
+        self.numbers = np.array(self.header['numbers'])
+        self.pbc = self.header['pbc']
+        self.dtype = frame_dtype(self.natoms)
+        # Only complete records are mapped (a truncated tail is ignored).
+        n = (os.path.getsize(filename) - self.offset) // self.dtype.itemsize
+        self.frames = np.memmap(filename, dtype=self.dtype, mode='r',
+                                offset=self.offset, shape=(n,)) if n else np.zeros(0, self.dtype)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, i):
+        return self.frames[i]
+
+    def get_atoms(self, i):
+        """Return frame i as an ASE Atoms object (float64, velocities set)."""
+        rec = self.frames[i]
+        atoms = Atoms(numbers=self.numbers,
+                      positions=rec['positions'].astype(np.float64),
+                      cell=rec['cell'].astype(np.float64),
+                      pbc=self.pbc)
+        atoms.set_velocities(rec['velocities'].astype(np.float64))
+        atoms.info['step'] = int(rec['step'])
+        return atoms
+
+    def iter_atoms(self, start=0, stop=None, stride=1):
+        for i in range(*slice(start, stop, stride).indices(len(self))):
+            yield self.get_atoms(i)
+
+
+def export_extxyz(bin_file, xyz_file, stride=1):
+    """Compatibility export of a binary trajectory to extxyz."""
+    reader = BinaryTrajectoryReader(bin_file)
+    n = 0
+    with open(xyz_file, 'w') as f:
+        for atoms in reader.iter_atoms(stride=stride):
+            write(f, atoms, format='extxyz')
+            n += 1
+            if n % 1000 == 0:
+                print(f'Exported {n} frames...', end='\r')
+    print(f'\nExported {n} frames to {xyz_file}')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print('Usage: python binary_traj.py traj.bin out.xyz [stride]')
+        exit(1)
+    export_extxyz(sys.argv[1], sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 1)
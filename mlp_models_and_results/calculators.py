@@ -0,0 +1,162 @@
+import importlib, os, resource, sys, time
+
+
+# Backend registry for the MD drivers.
+#
+# Each backend is a loader that imports its package only when called, so the
+# driver pays for torch + one model package instead of whatever is imported at
+# the top of a script. get_calculator() keeps the loaded calculator, so the same
+# model object serves minimisation, heating, equilibration and production.
+# `precision` (float32/float64) is passed to backends that have a switch; None
+# keeps each backend's default.
+BACKENDS = {}
+_loaded = {}
+
+
+def backend(name):
+    """Register a loader: fn(device, precision) -> ASE calculator."""
+    def register(fn):
+        BACKENDS[name] = fn
+        return fn
+    return register
+
+
+def default_device():
+    """'cuda' if torch sees a GPU, else 'cpu' (torch is imported here, not at module level)."""
+    import torch
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+def _no_precision_switch(name, precision):
+    if precision is not None:
+        raise ValueError(f'Backend {name!r} has no precision switch (got {precision!r}).')
+
+
+@backend('orb')
+def _orb(device, precision=None):
+    from orb_models.forcefield import pretrained
+    from orb_models.forcefield.calculator import ORBCalculator
+    kwargs = {'precision': {'float32': 'float32-high', 'float64': 'float64'}[precision]} if precision else {}
+    orb_model = pretrained.orb_v3_conservative_inf_mpa(device=device, **kwargs)
+    return ORBCalculator(orb_model, device=device)
+
+
+@backend('mace')
+def _mace(device, precision=None):
+    # Workarounds from the original MACE script (duplicate OpenMP runtime, model download behind the proxy).
+    os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
+    import ssl
+    ssl._create_default_https_context = ssl._create_unverified_context
+    from mace.calculators import mace_mp
+    return mace_mp(model='small', device=device, default_dtype=precision or 'float32')
+
+
+@backend('aimnet2')
+def _aimnet2(device, precision=None):
+    _no_precision_switch('aimnet2', precision)
+    from aimnet.calculators import AIMNet2ASE
+    return AIMNet2ASE('aimnet2')
+
+
+@backend('sevennet')
+def _sevennet(device, precision=None):
+    _no_precision_switch('sevennet', precision)
+    from sevenn.calculator import SevenNetCalculator
+    return SevenNetCalculator(model='sevennet-0', device=device)
+
+
+@backend('mock')
+def _mock(device, precision=None):
+    _no_precision_switch('mock', precision)
+    from mock_calculator import MockCalculator
+    return MockCalculator()
+
+
+def get_calculator(name, device=None, precision=None):
+    """Loaded calculator for a backend (loaded once per process and precision, then reused)."""
+    if name not in BACKENDS:
+        raise ValueError(f'Unknown backend {name!r}, choose from {sorted(BACKENDS)}.')
+    if precision not in (None, 'float32', 'float64'):
+        raise ValueError(f'Unknown precision {precision!r}, choose float32 or float64.')
+    if (name, precision) not in _loaded:
+        if device is None:
+            device = 'cpu' if name == 'mock' else default_device()
+        _loaded[name, precision] = BACKENDS[name](device, precision)
+    return _loaded[name, precision]
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB (Linux reports KB)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure_startup(name, atoms, device=None):
+    """Load a backend and time it: import, model load, first call. Returns (calc, stats dict)."""
+    t0 = time.perf_counter()
+    modules = set(sys.modules)
+    if name != 'mock':
+        importlib.import_module('torch')
+    t_import = time.perf_counter() - t0
+    calc = get_calculator(name, device)
+    t_load = time.perf_counter() - t0 - t_import
+    atoms.calc = calc
+    t1 = time.perf_counter()
+    atoms.get_forces()
+    t_first = time.perf_counter() - t1
+    t2 = time.perf_counter()
+    atoms.calc.results.clear()
+    atoms.get_forces()
+    t_second = time.perf_counter() - t2
+    stats = {'backend': name, 'torch_import_s': t_import, 'model_load_s': t_load,
+             'first_call_s': t_first, 'second_call_s': t_second,
+             'peak_rss_mb': peak_rss_mb(), 'modules_imported': len(set(sys.modules) - modules)}
+    if 'torch' in sys.modules and sys.modules['torch'].cuda.is_available():
+        stats['peak_gpu_mb'] = sys.modules['torch'].cuda.max_memory_allocated() / 2**20
+    print(f'Backend {name}: torch import {t_import:.2f} s, model load {t_load:.2f} s, '
+          f'first call {t_first:.2f} s, next call {t_second:.3f} s, peak RSS {stats["peak_rss_mb"]:.0f} MB'
+          + (f', peak GPU {stats["peak_gpu_mb"]:.0f} MB' if 'peak_gpu_mb' in stats else ''))
+    return calc, stats
+
+
+# Batched backends: compute(list of Atoms) -> list of result dicts (energy,
+# free_energy, forces, stress), one model call for all replicas. Backends
+# without a native batched path fall back to SerialBatch, which loops over the
+# replicas with the normal calculator (same interface, no speed-up).
+BATCHED_BACKENDS = {}
+
+
+def batched_backend(name):
+    """Register a batched loader: fn(device) -> object with compute(atoms_list)."""
+    def register(fn):
+        BATCHED_BACKENDS[name] = fn
+        return fn
+    return register
+
+
+class SerialBatch:
+    """Batched interface over a plain ASE calculator (one call per system)."""
+
+    def __init__(self, calc):
+        self.calc = calc
+
+    def compute(self, atoms_list):
+        results = []
+        for atoms in atoms_list:
+            atoms = atoms.copy()
+            atoms.calc = self.calc
+            self.calc.calculate(atoms, ['energy', 'forces', 'stress'], ['positions', 'numbers', 'cell', 'pbc'])
+            results.append(dict(self.calc.results))
+        return results
+
+
+@batched_backend('mock')
+def _mock_batched(device):
+    from mock_calculator import MockBatchedCalculator
+    return MockBatchedCalculator()
+
+
+def get_batched_calculator(name, device=None):
+    """Batched calculator for a backend (SerialBatch over get_calculator() if it has no batched loader)."""
+    if name in BATCHED_BACKENDS:
+        return BATCHED_BACKENDS[name](device)
+    return SerialBatch(get_calculator(name, device))
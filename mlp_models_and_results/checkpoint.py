@@ -0,0 +1,149 @@
+import glob, os
+import numpy as np
+from ase import Atoms
+
+
+# Full-state checkpoints for the NVT production runs (ASE NPT or integrators.py).
+#
+# A checkpoint holds everything needed to continue a run bit-for-bit:
+# positions, momenta, masses, cell, the integrator state (NPT: q, q_past,
+# q_future, eta, zeta, ...; integrators.py: the thermostat chain or the
+# Langevin RNG), the step counter, numpy's global RNG state and the sizes of
+# the output files (trajectory, thermo log) at that step, so
+# anything written after the checkpoint can be cut off on restart.
+#
+# Files are '<prefix>_<step>.ckpt.npz', written to a temporary file, fsynced and
+# renamed into place (a walltime kill never leaves a half-written checkpoint).
+# Only the newest KEEP_LAST are kept.
+KEEP_LAST = 3              # NOTE: Checkpoints kept on disk.
+CHECKPOINT_EVERY = 10000   # NOTE: Steps between checkpoints (10 ps at 1 fs).
+
+NPT_STATE = ('q', 'q_past', 'q_future', 'eta', 'eta_past', 'zeta', 'zeta_past',
+             'zeta_integrated', 'h', 'h_past', 'timeelapsed')
+
+
+def checkpoint_name(prefix, step):
+    return f'{prefix}_{step:010d}.ckpt.npz'
+
+
+def list_checkpoints(prefix):
+    """Checkpoint files for prefix, oldest first."""
+    return sorted(glob.glob(f'{glob.escape(prefix)}_' + '[0-9]' * 10 + '.ckpt.npz'))
+
+
+def latest_checkpoint(prefix):
+    files = list_checkpoints(prefix)
+    return files[-1] if files else None
+
+
+def save_checkpoint(prefix, atoms, dyn, step, keep=KEEP_LAST, track_files=()):
+    """Atomically write a checkpoint and rotate old ones. Returns the file name."""
+    rng = np.random.get_state()
+    state = {
+        'step': step,
+        'nsteps': dyn.nsteps,
+        'numbers': atoms.get_atomic_numbers(),
+        'masses': atoms.get_masses(),
+        'pbc': atoms.get_pbc(),
+        'cell': atoms.cell.array,
+        'positions': atoms.positions,
+        'momenta': atoms.get_momenta(),
+        'rng_keys': rng[1], 'rng_pos': rng[2], 'rng_has_gauss': rng[3], 'rng_cached_gaussian': rng[4],
+        'tracked_files': np.array([os.path.abspath(f) for f in track_files], dtype=str),
+        'tracked_bytes': np.array([os.path.getsize(f) if os.path.exists(f) else 0 for f in track_files], dtype=np.int64),
+    }
+    if hasattr(dyn, 'get_state'):
+        # Integrators from integrators.py carry their own (small) state.
+        state.update({f'dyn_{key}': value for key, value in dyn.get_state().items()})
+    else:
+        if not dyn.initialized:
+            dyn.initialize()
+        for key in NPT_STATE:
+            state[f'npt_{key}'] = getattr(dyn, key)
+
+    filename = checkpoint_name(prefix, step)
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, **state)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filename)
+
+    for old in list_checkpoints(prefix)[:-keep]:
+        os.remove(old)
+    return filename
+
+
+def load_checkpoint(filename):
+    with np.load(filename) as data:
+        return {key: data[key] for key in data.files}
+
+
+def atoms_from_checkpoint(state):
+    atoms = Atoms(numbers=state['numbers'], positions=state['positions'],
+                  cell=state['cell'], pbc=state['pbc'])
+    atoms.set_masses(state['masses'])
+    atoms.set_momenta(state['momenta'])
+    return atoms
+
+
+def restore_dynamics(dyn, state, restore_rng=True):
+    """Put a freshly built NPT or integrators.py NVT (same settings as the saved run) back into the saved state.
+
+    dyn.nsteps is restored too, so observers keep firing on the same global steps.
+    """
+    # NPT.__init__ re-zeroes the centre-of-mass momentum, which is not bit-exact.
+    dyn.atoms.set_momenta(state['momenta'])
+    if hasattr(dyn, 'set_state'):
+        dyn.set_state({key[len('dyn_'):]: value for key, value in state.items() if key.startswith('dyn_')})
+    else:
+        for key in NPT_STATE:
+            value = state[f'npt_{key}']
+            setattr(dyn, key, value.item() if value.ndim == 0 else value.copy())
+        dyn.inv_h = np.linalg.inv(dyn.h)
+        dyn.initialized = 1
+    dyn.nsteps = int(state['nsteps'])
+    if restore_rng:
+        np.random.set_state(('MT19937', state['rng_keys'], int(state['rng_pos']),
+                             int(state['rng_has_gauss']), float(state['rng_cached_gaussian'])))
+
+
+def truncate_outputs(state):
+    """Cut everything written after the checkpoint off the tracked output files."""
+    for filename, size in zip(state['tracked_files'], state['tracked_bytes']):
+        if os.path.exists(filename) and os.path.getsize(filename) > size:
+            print(f'Truncating {filename} to checkpoint ({os.path.getsize(filename) - size} bytes dropped).')
+            with open(filename, 'r+b') as f:
+                f.truncate(size)
+
+
+class Checkpointer:
+    """Observer writing a checkpoint every `interval` steps.
+
+    `flush` holds objects with a flush() method (async observers, trajectory
+    writers, thermo logs) that are drained first, so the sizes recorded for
+    `track_files` match the step.
+    """
+
+    def __init__(self, prefix, atoms, dyn, keep=KEEP_LAST, track_files=(), flush=(), step_offset=0):
+        self.prefix = prefix
+        self.atoms = atoms
+        self.dyn = dyn
+        self.keep = keep
+        self.track_files = track_files
+        self.flush = flush
+        self.step_offset = step_offset
+
+    def attach(self, interval=CHECKPOINT_EVERY):
+        self.dyn.attach(self.save, interval)
+
+    def save(self):
+        step = self.step_offset + self.dyn.nsteps
+        if step == 0:
+            return  # Nothing to restart from yet.
+        for obj in self.flush:
+            obj.flush()
+        filename = save_checkpoint(self.prefix, self.atoms, self.dyn, step,
+                                   keep=self.keep, track_files=self.track_files)
+        print(f'Checkpoint: {filename}', flush=True)
+        return filename
@@ -0,0 +1,392 @@
+import json, os, shutil, sys, tempfile, zlib
+import numpy as np
+from ase import Atoms
+from ase.io import write
+
+
+# Compressed fixed-point trajectory format ('.zbin') for archiving.
+#
+# Positions are quantised to PRECISION (1e-4 A) and velocities to
+# VELOCITY_PRECISION, stored as int32 deltas from the previous frame (the first
+# frame of a block is absolute, so every block decodes on its own). The delta
+# bytes are shuffled (all first bytes, then all second bytes, ...) and each block
+# of frames is zlib-compressed. Steps and cells are kept exactly (int64/float64).
+#
+# Layout:
+#   8 bytes   magic (b'MDTRAJZ1')
+#   4 bytes   little-endian uint32 length of the JSON header
+#   n bytes   JSON header (natoms, atomic numbers, pbc, precisions)
+#   blocks    BLOCK_HEADER (n_frames, payload bytes, crc32), the n_frames steps
+#             (int64, uncompressed) and the zlib payload (cells, positions, velocities)
+#
+# The reader builds its block index (offset, first frame, steps) by hopping from
+# block header to block header, i.e. one small read per block, then decodes only the
+# block holding the requested frame. A half-written block at the end of the file
+# fails its size/crc check and is ignored (and dropped when appending).
+MAGIC = b'MDTRAJZ1'
+PRECISION = 1e-4            # NOTE: Position quantum in A (max error PRECISION / 2).
+VELOCITY_PRECISION = 1e-6   # NOTE: Velocity quantum in ASE units (thermal velocities are ~1e-2 to 1e-1).
+BLOCK_FRAMES = 100          # NOTE: Frames per compressed block (~1 MB raw for 3,700 atoms).
+ZLIB_LEVEL = 6              # NOTE: 1 is ~2x faster to write and ~10% larger.
+BLOCK_HEADER = np.dtype([('n_frames', '<u4'), ('nbytes', '<u8'), ('crc', '<u4')])
+
+
+def _shuffle(a):
+    """int32 array -> bytes grouped by byte significance (compresses much better)."""
+    return np.ascontiguousarray(a.astype('<i4').view(np.uint8).reshape(-1, 4).T).tobytes()
+
+
+def _unshuffle(buf, shape):
+    return np.frombuffer(buf, np.uint8).reshape(4, -1).T.copy().view('<i4').reshape(shape)
+
+
+def _delta_encode(values, precision):
+    q = np.rint(values / precision).astype(np.int64)
+    d = np.diff(q, axis=0, prepend=np.zeros_like(q[:1]))
+    if np.abs(d).max(initial=0) >= 2**31:
+        raise ValueError('Values do not fit the fixed-point format (lower the precision).')
+    return _shuffle(d)
+
+
+def _delta_decode(buf, shape, precision):
+    return np.cumsum(_unshuffle(buf, shape), axis=0, dtype=np.int64) * precision
+
+
+def _read_header(f):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f'{f.name} is not a compressed trajectory (bad magic).')
+    n = int(np.frombuffer(f.read(4), dtype='<u4')[0])
+    header = json.loads(f.read(n).decode('utf-8'))
+    return header, len(MAGIC) + 4 + n
+
+
+def scan_blocks(f, offset, size):
+    """Block index of every complete block from offset on.
+
+    Returns (block offsets, first frame of each block, frames per block, steps of
+    all frames, end of the last complete block).
+    """
+    offsets, counts, steps = [], [], []
+    while offset + BLOCK_HEADER.itemsize <= size:
+        f.seek(offset)
+        head = np.frombuffer(f.read(BLOCK_HEADER.itemsize), BLOCK_HEADER)[0]
+        n = int(head['n_frames'])
+        end = offset + BLOCK_HEADER.itemsize + 8 * n + int(head['nbytes'])
+        if n == 0 or end > size:
+            break
+        offsets.append(offset)
+        counts.append(n)
+        steps.append(np.frombuffer(f.read(8 * n), '<i8'))
+        offset = end
+    counts = np.array(counts, dtype=np.int64)
+    steps = np.concatenate(steps) if steps else np.zeros(0, np.int64)
+    return np.array(offsets, dtype=np.int64), np.cumsum(counts) - counts, counts, steps, offset
+
+
+class CompressedTrajectoryWriter:
+    """Same interface as binary_traj.BinaryTrajectoryWriter, writing compressed blocks.
+
+    Appends to an existing file if its header matches the atoms (restarts).
+    """
+
+    def __init__(self, filename, atoms, block_frames=BLOCK_FRAMES, precision=PRECISION,
+                 velocity_precision=VELOCITY_PRECISION):
+        self.filename = filename
+        self.atoms = atoms
+        self.natoms = len(atoms)
+        self.block_frames = block_frames
+        self.steps, self.cells, self.positions, self.velocities = [], [], [], []
+        self.frames_written = 0
+
+        numbers = atoms.get_atomic_numbers()
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:
+            with open(filename, 'rb') as f:
+                header, offset = _read_header(f)
+                if header['natoms'] != self.natoms or header['numbers'] != numbers.tolist():
+                    raise ValueError(f'{filename} holds a different system, refusing to append.')
+                _, _, counts, _, end = scan_blocks(f, offset, os.path.getsize(filename))
+            # Drop any half-written block left by a killed job before appending.
+            with open(filename, 'r+b') as f:
+                f.truncate(end)
+            self.precision, self.velocity_precision = header['precision'], header['velocity_precision']
+            self.frames_written = int(counts.sum())
+            self.f = open(filename, 'ab')
+        else:
+            self.precision, self.velocity_precision = precision, velocity_precision
+            header = json.dumps({'natoms': self.natoms,
+                                 'numbers': numbers.tolist(),
+                                 'pbc': atoms.get_pbc().tolist(),
+                                 'precision': precision,
+                                 'velocity_precision': velocity_precision}).encode('utf-8')
+            self.f = open(filename, 'wb')
+            self.f.write(MAGIC)
+            self.f.write(np.array([len(header)], dtype='<u4').tobytes())
+            self.f.write(header)
+
+    def write(self, atoms=None, step=0):
+        """Add the current frame to the block (compressed and written when full)."""
+        if atoms is None:
+            atoms = self.atoms
+        self.write_arrays(step, atoms.cell.array, atoms.positions, atoms.get_velocities())
+
+    def write_arrays(self, step, cell, positions, velocities):
+        """Same as write(), from plain arrays (e.g. snapshots from a background thread)."""
+        self.steps.append(step)
+        self.cells.append(np.array(cell, dtype=np.float64))
+        self.positions.append(np.array(positions, dtype=np.float64))
+        self.velocities.append(np.zeros((self.natoms, 3)) if velocities is None else np.array(velocities, dtype=np.float64))
+        if len(self.steps) == self.block_frames:
+            self.flush()
+
+    def flush(self):
+        """Compress and write the frames collected so far as one block."""
+        n = len(self.steps)
+        if n == 0:
+            return
+        payload = zlib.compress(b''.join([
+            np.array(self.cells, dtype='<f8').tobytes(),
+            _delta_encode(np.array(self.positions), self.precision),
+            _delta_encode(np.array(self.velocities), self.velocity_precision),
+        ]), ZLIB_LEVEL)
+        head = np.array([(n, len(payload), zlib.crc32(payload))], dtype=BLOCK_HEADER)
+        self.f.write(head.tobytes() + np.array(self.steps, dtype='<i8').tobytes() + payload)
+        self.f.flush()
+        self.frames_written += n
+        self.steps, self.cells, self.positions, self.velocities = [], [], [], []
+
+    def close(self):
+        if not self.f.closed:
+            self.flush()
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CompressedTrajectoryReader:
+    """Random-access reader: seeks to the block holding a frame and decodes that block only."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.f = open(filename, 'rb')
+        self.header, offset = _read_header(self.f)
+        self.natoms = self.header['natoms']
+        self.numbers = np.array(self.header['numbers'])
+        self.pbc = self.header['pbc']
+        self.offsets, self.first_frames, self.counts, self.steps, _ = scan_blocks(self.f, offset, os.path.getsize(filename))
+        self._block = None   # (block number, decoded arrays) of the last block read.
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['f'], state['_block'] = None, None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.f = open(self.filename, 'rb')
+
+    def read_block(self, b):
+        """Decoded block b: dict of cells, positions, velocities (float64 arrays)."""
+        if self._block is not None and self._block[0] == b:
+            return self._block[1]
+        n, N = int(self.counts[b]), self.natoms
+        self.f.seek(self.offsets[b])
+        head = np.frombuffer(self.f.read(BLOCK_HEADER.itemsize), BLOCK_HEADER)[0]
+        self.f.seek(8 * n, os.SEEK_CUR)
+        payload = self.f.read(int(head['nbytes']))
+        if zlib.crc32(payload) != head['crc']:
+            raise ValueError(f'{self.filename}: block {b} is corrupt (crc mismatch).')
+        raw = zlib.decompress(payload)
+        cells = np.frombuffer(raw, '<f8', 9 * n).reshape(n, 3, 3)
+        pos = 72 * n
+        size = 4 * n * N * 3
+        positions = _delta_decode(raw[pos:pos + size], (n, N, 3), self.header['precision'])
+        velocities = _delta_decode(raw[pos + size:pos + 2 * size], (n, N, 3), self.header['velocity_precision'])
+        block = {'cells': cells, 'positions': positions, 'velocities': velocities}
+        self._block = (b, block)
+        return block
+
+    def get_arrays(self, i):
+        """Frame i as (step, cell, positions, velocities)."""
+        i = range(len(self))[i]
+        b = int(np.searchsorted(self.first_frames, i, side='right') - 1)
+        block, k = self.read_block(b), i - int(self.first_frames[b])
+        return int(self.steps[i]), block['cells'][k], block['positions'][k], block['velocities'][k]
+
+    def get_atoms(self, i):
+        """Return frame i as an ASE Atoms object (velocities set)."""
+        step, cell, positions, velocities = self.get_arrays(i)
+        atoms = Atoms(numbers=self.numbers, positions=positions, cell=cell, pbc=self.pbc)
+        atoms.set_velocities(velocities)
+        atoms.info['step'] = step
+        return atoms
+
+    def iter_arrays(self, start=0, stop=None, stride=1):
+        for i in range(*slice(start, stop, stride).indices(len(self))):
+            yield self.get_arrays(i)
+
+    def iter_atoms(self, start=0, stop=None, stride=1):
+        for i in range(*slice(start, stop, stride).indices(len(self))):
+            yield self.get_atoms(i)
+
+    def close(self):
+        self.f.close()
+
+
+def export_extxyz(zbin_file, xyz_file, stride=1):
+    """Compatibility export of a compressed trajectory to extxyz."""
+    reader = CompressedTrajectoryReader(zbin_file)
+    n = 0
+    with open(xyz_file, 'w') as f:
+        for atoms in reader.iter_atoms(stride=stride):
+            write(f, atoms, format='extxyz')
+            n += 1
+            if n % 1000 == 0:
+                print(f'Exported {n} frames...', end='\r')
+    print(f'\nExported {n} frames to {xyz_file}')
+
+
+def verify(source_file, zbin_file):
+    """Compare a .zbin against the trajectory it was made from (.xyz or .bin). Returns the max errors."""
+    from traj_readers import open_frames
+
+    frames = open_frames(source_file)
+    reader = CompressedTrajectoryReader(zbin_file)
+    if len(frames) != len(reader):
+        raise ValueError(f'{source_file} has {len(frames)} frames, {zbin_file} has {len(reader)}.')
+    max_pos = max_vel = 0.0
+    for k in range(len(frames)):
+        src = frames.read(k)
+        step, cell, positions, velocities = reader.get_arrays(k)
+        if not np.array_equal(cell, src['cell']) or (frames.steps[k] >= 0 and step != frames.steps[k]):
+            raise ValueError(f'Frame {k}: step or cell differ.')
+        max_pos = max(max_pos, np.abs(positions - src['positions']).max())
+        if src['velocities'] is not None:
+            max_vel = max(max_vel, np.abs(velocities - src['velocities']).max())
+    pos_ok = max_pos <= reader.header['precision'] / 2 * (1 + 1e-6)
+    vel_ok = max_vel <= reader.header['velocity_precision'] / 2 * (1 + 1e-6)
+    print(f'{len(reader)} frames, max position error {max_pos:.2e} A, max velocity error {max_vel:.2e} '
+          f'({"OK" if pos_ok and vel_ok else "FAILED"}; {os.path.getsize(source_file) / os.path.getsize(zbin_file):.1f}x smaller)')
+    reader.close()
+    if not pos_ok:
+        raise ValueError(f'{zbin_file}: position error {max_pos} exceeds half the precision.')
+    if not vel_ok:
+        raise ValueError(f'{zbin_file}: velocity error {max_vel} exceeds half the velocity precision.')
+    return max_pos, max_vel
+
+
+def selftest(n_frames=2 * BLOCK_FRAMES + BLOCK_FRAMES // 2):
+    """Round trip of a synthetic extxyz trajectory (3 waters, random walk with velocities) through .zbin:
+    traj_convert, verify, get_arrays/get_atoms against ASE's reading of the extxyz, an append after a
+    truncated last block, and a velocity error that verify must catch. Returns True if every check passes."""
+    from ase.build import molecule
+    from ase.io import read
+    from traj_convert import CompressedSink, convert
+
+    rng = np.random.default_rng(0)
+    atoms = molecule('H2O')
+    for shift in ([3, 0, 0], [0, 3, 0]):
+        other = molecule('H2O')
+        other.translate(shift)
+        atoms += other
+    atoms.set_cell([9, 9, 9])
+    atoms.set_pbc(True)
+    results = []
+
+    def check(name, passed, detail=''):
+        print(f'  {"ok" if passed else "FAILED":<7} {name}{f" ({detail})" if detail else ""}')
+        results.append(bool(passed))
+
+    tmp = tempfile.mkdtemp()
+    try:
+        xyz, zbin = os.path.join(tmp, 'traj.xyz'), os.path.join(tmp, 'traj.zbin')
+        for k in range(n_frames):
+            atoms.positions += rng.normal(scale=0.05, size=atoms.positions.shape)
+            atoms.set_momenta(rng.normal(scale=0.5, size=(len(atoms), 3)))
+            atoms.info['step'] = 10 * k
+            write(xyz, atoms, format='extxyz', append=k > 0)
+        ref = read(xyz, index=':')
+        print(f'.zbin self-test ({n_frames} frames of {len(atoms)} atoms, {BLOCK_FRAMES} frames per block):')
+
+        convert(xyz, [CompressedSink(zbin)], workers=1)
+        try:
+            max_pos, max_vel = verify(xyz, zbin)
+            check('traj_convert + verify', True, f'max errors {max_pos:.1e} A, {max_vel:.1e}')
+        except ValueError as e:
+            check('traj_convert + verify', False, str(e))
+
+        def compare(reader):
+            """Largest position/velocity errors over all frames against ref, or None if steps/cells differ."""
+            err_pos = err_vel = 0.0
+            for k, a in enumerate(ref):
+                step, cell, positions, velocities = reader.get_arrays(k)
+                got = reader.get_atoms(k)
+                if (step != 10 * k or got.info['step'] != step or not np.array_equal(cell, a.cell.array)
+                        or not np.array_equal(got.numbers, a.numbers)):
+                    return None
+                err_pos = max(err_pos, np.abs(positions - a.positions).max(), np.abs(got.positions - a.positions).max())
+                err_vel = max(err_vel, np.abs(velocities - a.get_velocities()).max(),
+                              np.abs(got.get_velocities() - a.get_velocities()).max())
+            return err_pos, err_vel
+
+        def within(errors, header):
+            return (errors is not None and errors[0] <= header['precision'] / 2 * (1 + 1e-6)
+                    and errors[1] <= header['velocity_precision'] / 2 * (1 + 1e-6))
+
+        reader = CompressedTrajectoryReader(zbin)
+        errors = compare(reader)
+        check('get_arrays/get_atoms vs ASE read', within(errors, reader.header) and len(reader) == n_frames,
+              f'{len(reader)} frames in {len(reader.offsets)} blocks')
+        n_kept, last_block = int(reader.first_frames[-1]), int(reader.offsets[-1])
+        reader.close()
+
+        # Killed job: half of the last block written. The writer drops it and the rest is appended.
+        size = os.path.getsize(zbin)
+        with open(zbin, 'r+b') as f:
+            f.truncate(last_block + (size - last_block) // 2)
+        writer = CompressedTrajectoryWriter(zbin, atoms)
+        kept = writer.frames_written
+        for a in ref[kept:]:
+            writer.write_arrays(a.info['step'], a.cell.array, a.positions, a.get_velocities())
+        writer.close()
+        reader = CompressedTrajectoryReader(zbin)
+        errors = compare(reader)
+        check('append after a truncated block', kept == n_kept and within(errors, reader.header) and len(reader) == n_frames,
+              f'{kept} frames kept, {len(reader)} after the append')
+        reader.close()
+
+        # Negative control: velocities off by more than half the quantum must fail verify.
+        with CompressedTrajectoryWriter(zbin + '.bad', atoms) as writer:
+            for a in ref:
+                writer.write_arrays(a.info['step'], a.cell.array, a.positions, a.get_velocities() + 3 * VELOCITY_PRECISION)
+        try:
+            verify(xyz, zbin + '.bad')
+            check('verify catches a velocity error', False, 'passed a 3-quantum velocity offset')
+        except ValueError:
+            check('verify catches a velocity error', True)
+    finally:
+        shutil.rmtree(tmp)
+    ok = all(results)
+    print('All passed.' if ok else 'Some checks FAILED.')
+    return ok
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 2 and sys.argv[1] == '--selftest':
+        exit(0 if selftest() else 1)
+    if len(sys.argv) < 3:
+        print('Usage: python compressed_traj.py traj.zbin out.xyz [stride]   (export)\n'
+              '       python compressed_traj.py --verify traj.xyz traj.zbin   (round-trip check)\n'
+              '       python compressed_traj.py --selftest   (synthetic round trip, append and error checks)\n'
+              'Create .zbin files with: python traj_convert.py traj.xyz --zbin traj.zbin')
+        exit(1)
+    if sys.argv[1] == '--verify':
+        verify(sys.argv[2], sys.argv[3])
+    else:
+        export_extxyz(sys.argv[1], sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 1)
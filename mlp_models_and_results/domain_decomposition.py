@@ -0,0 +1,279 @@
+import argparse, itertools, multiprocessing, os, sys, time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from ase import Atoms
+from ase.calculators.calculator import Calculator, PropertyNotImplementedError, all_changes
+from ase.io import read
+
+
+# Spatial domain decomposition for local (cutoff-based) models.
+#
+# The periodic box is split into a grid of domains in fractional coordinates.
+# Each atom is owned by the domain its wrapped position falls in, and every
+# domain is evaluated as a cluster: its owned atoms plus ghost copies (periodic
+# images included) of all atoms within HALO of the domain. Axes the grid does
+# not divide stay periodic in the cluster (orthorhombic boxes) and need no
+# halo. Ownership is recomputed from the current positions on every call, so
+# atoms migrating between domains (or across the periodic boundary) need no
+# extra bookkeeping; the number that changed owner since the last call is counted.
+#
+# Each domain contributes the atomic energies, forces and per-atom stresses of
+# its owned atoms only; the totals are their sums. That is exact when the halo
+# covers everything an owned atom's force depends on: the cutoff for a pair
+# potential, and twice the receptive field (layers x cutoff) for a message-
+# passing model, since the energies of atoms up to one receptive field away
+# depend on the atom and themselves need their full environment. Backends must
+# report atomic energies ('energies', or MACE's 'node_energy'); stress needs
+# per-atom 'stresses'.
+#
+# Domains are evaluated by a pool of worker processes that each load the model
+# once (spawned, so no CUDA/OpenMP state is forked); workers=0 evaluates them
+# in this process.
+#
+#   python domain_decomposition.py box.xyz --repeat 2 2 2 --validate
+#   python domain_decomposition.py box.xyz --strong 1 2 4 8 --repeat 4 4 4
+#   python domain_decomposition.py box.xyz --weak 1 2 4 8
+HALO = {
+    'mock': 4.0,        # NOTE: Pair potential: the cutoff.
+    'mace': 24.0,       # NOTE: MACE-MP small: 2 interactions x 6 A, doubled.
+    'sevennet': 50.0,   # NOTE: SevenNet-0: 5 layers x 5 A, doubled (only pays for very large boxes).
+}
+WORKERS = 4
+THREADS = 1             # NOTE: Torch/OpenMP threads per worker (workers x threads <= cores).
+REPEATS = 3             # NOTE: Timed calls per scaling point.
+
+
+def choose_grid(cell, n_domains, halo):
+    """Domain grid (nx, ny, nz) with nx*ny*nz = n_domains that minimises the largest cluster (domain + halo) volume."""
+    heights = cell.volume / np.linalg.norm(np.cross(cell[[1, 2, 0]], cell[[2, 0, 1]]), axis=1)
+    best = None
+    for nx in range(1, n_domains + 1):
+        for ny in range(1, n_domains // nx + 1):
+            if n_domains % (nx * ny):
+                continue
+            grid = (nx, ny, n_domains // (nx * ny))
+            volume = np.prod(heights / grid + 2 * halo * ~periodic_axes(cell, grid))
+            if best is None or volume < best[0]:
+                best = (volume, grid)
+    return best[1]
+
+
+def periodic_axes(cell, grid):
+    """Axes left periodic in every cluster (no halo): undivided axes of an orthorhombic cell."""
+    return (np.array(grid) == 1) & cell.orthorhombic
+
+
+def decompose(atoms, grid, halo):
+    """Wrapped fractional positions, the owner domain of every atom and, per domain, (atom indices, image
+    shifts, number owned). Owned atoms come first in each domain (shift 0), followed by the ghosts.
+    """
+    cell = atoms.cell.complete()
+    grid = np.array(grid)
+    scaled = atoms.get_scaled_positions(wrap=True)
+    owner3 = np.minimum((scaled * grid).astype(int), grid - 1)
+    owner = np.ravel_multi_index(owner3.T, grid)
+    heights = cell.volume / np.linalg.norm(np.cross(cell[[1, 2, 0]], cell[[2, 0, 1]]), axis=1)
+    margin = halo / heights * ~periodic_axes(cell, grid)    # Halo in fractional units per axis.
+    reach = np.ceil(margin).astype(int)
+
+    domains = []
+    for d3 in itertools.product(*(range(g) for g in grid)):
+        lo = np.array(d3) / grid
+        hi = (np.array(d3) + 1) / grid
+        # Per axis, the image shifts n that put atoms inside the haloed slab.
+        valid = [{n: (scaled[:, k] + n >= lo[k] - margin[k]) & (scaled[:, k] + n < hi[k] + margin[k])
+                  for n in range(-reach[k], reach[k] + 1)} for k in range(3)]
+        own = np.flatnonzero(owner == np.ravel_multi_index(d3, grid))
+        ghosts, shifts = [], []
+        for shift in itertools.product(*(sorted(v) for v in valid)):
+            mask = valid[0][shift[0]] & valid[1][shift[1]] & valid[2][shift[2]]
+            if shift == (0, 0, 0):
+                mask &= owner != np.ravel_multi_index(d3, grid)
+            idx = np.flatnonzero(mask)
+            ghosts.append(idx)
+            shifts.append(np.tile(shift, (len(idx), 1)))
+        domains.append((np.concatenate([own] + ghosts), np.concatenate([np.zeros((len(own), 3), int)] + shifts), len(own)))
+    return scaled, owner, domains
+
+
+# Worker side: one calculator per process, loaded by the pool initializer.
+_worker_calc = None
+
+
+def _init_worker(backend, device, threads):
+    global _worker_calc
+    if threads:
+        os.environ['OMP_NUM_THREADS'] = str(threads)   # Before torch is imported by the loader.
+    from calculators import get_calculator
+    _worker_calc = get_calculator(backend, device)
+    if threads and 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(threads)
+
+
+def _atom_energies(results):
+    for key in ('energies', 'node_energy'):
+        if key in results:
+            return np.asarray(results[key]).reshape(-1)
+    raise PropertyNotImplementedError('Domain decomposition needs atomic energies from the backend.')
+
+
+def _evaluate(task):
+    """(energy, forces, stress or None, CPU seconds, cluster size) of the owned atoms of one domain."""
+    numbers, positions, volume, periodic, lengths, n_owned, stress = task
+    t0 = time.process_time()
+    # In its own bounding box along the haloed axes (neighbour searches bin over the cell, so not the full
+    # box), periodic with the box length along the others.
+    lo = np.where(periodic, 0.0, positions.min(axis=0))
+    size = np.where(periodic, lengths, positions.max(axis=0) - lo + 1.0)
+    cluster = Atoms(numbers, positions - lo, cell=np.diag(size), pbc=periodic)
+    _worker_calc.calculate(cluster, ['energy', 'forces'] + (['stresses'] if stress else []), all_changes)
+    results = _worker_calc.results
+    energy = _atom_energies(results)[:n_owned].sum()
+    forces = np.array(results['forces'][:n_owned])
+    stresses = results.get('stresses') if stress else None
+    # Per-atom stresses are per volume of the cluster cell: rescale to the full box.
+    stress_sum = (np.asarray(stresses)[:n_owned].reshape(n_owned, -1).sum(axis=0) * cluster.get_volume() / volume
+                  if stresses is not None else None)
+    return energy, forces, stress_sum, time.process_time() - t0, len(numbers)
+
+
+class DomainCalculator(Calculator):
+    """ASE calculator that evaluates a backend domain by domain (with halos) on a worker pool and sums the results."""
+
+    implemented_properties = ['energy', 'free_energy', 'forces', 'stress']
+
+    def __init__(self, backend, workers=WORKERS, grid=None, halo=None, device=None, threads=THREADS, **kwargs):
+        super().__init__(**kwargs)
+        if halo is None and backend not in HALO:
+            raise ValueError(f'No default halo for backend {backend!r}, pass halo= (twice its receptive field).')
+        self.backend = backend
+        self.halo = HALO[backend] if halo is None else halo
+        self.workers = workers
+        self.grid = grid
+        self.owner = None
+        self.migrations = 0
+        self.timings = {}
+        if workers:
+            # A worker that dies (e.g. out of memory) raises BrokenProcessPool here instead of hanging the run.
+            self.pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_worker, initargs=(backend, device, threads))
+        else:
+            self.pool = None
+            _init_worker(backend, device, None)
+
+    def calculate(self, atoms=None, properties=('energy',), system_changes=all_changes):
+        super().calculate(atoms, properties, system_changes)
+        atoms = self.atoms
+        t0 = time.perf_counter()
+        grid = self.grid or choose_grid(atoms.cell, max(self.workers, 1), self.halo)
+        scaled, owner, domains = decompose(atoms, grid, self.halo)
+        if self.owner is not None and len(self.owner) == len(owner):
+            self.migrations += int((self.owner != owner).sum())
+        self.owner = owner
+
+        stress = 'stress' in properties
+        cell = np.array(atoms.cell)
+        volume = atoms.get_volume()
+        periodic = periodic_axes(atoms.cell, grid)
+        lengths = atoms.cell.lengths()
+        tasks = [(atoms.numbers[idx], (scaled[idx] + shifts) @ cell, volume, periodic, lengths, n_owned, stress)
+                 for idx, shifts, n_owned in domains]
+        t1 = time.perf_counter()
+        out = list(self.pool.map(_evaluate, tasks)) if self.pool else [_evaluate(t) for t in tasks]
+        t2 = time.perf_counter()
+
+        forces = np.zeros((len(atoms), 3))
+        energy = 0.0
+        for (idx, shifts, n_owned), (e, f, s, seconds, size) in zip(domains, out):
+            energy += e
+            forces[idx[:n_owned]] = f
+        self.results = {'energy': energy, 'free_energy': energy, 'forces': forces}
+        if stress and all(o[2] is not None for o in out):
+            self.results['stress'] = np.sum([o[2] for o in out], axis=0)
+        owned = sum(d[2] for d in domains)
+        self.timings = {'grid': tuple(int(g) for g in grid), 'decompose_s': t1 - t0, 'evaluate_s': t2 - t1,
+                        'domain_cpu_s': [o[3] for o in out], 'cluster_atoms': [o[4] for o in out],
+                        'halo_overhead': sum(o[4] for o in out) / owned}
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+
+def validate(atoms, workers=2, grid=None, backend='mock', steps=20):
+    """Domain-decomposed vs direct energy/forces/stress, then a few MD steps counting migrations."""
+    from ase import units
+    from ase.md.velocitydistribution import MaxwellBoltzmannDistribution
+    from calculators import get_calculator
+    from integrators import NoseHooverChainNVT
+
+    ref = atoms.copy()
+    ref.calc = get_calculator(backend)
+    e_ref, f_ref, s_ref = ref.get_potential_energy(), ref.get_forces(), ref.get_stress()
+    run = atoms.copy()
+    run.calc = DomainCalculator(backend, workers=workers, grid=grid)
+    e, f, s = run.get_potential_energy(), run.get_forces(), run.get_stress()
+    t = run.calc.timings
+    print(f'{len(atoms)} atoms, grid {t["grid"]}, halo {run.calc.halo} A (clusters hold {t["halo_overhead"]:.2f}x the atoms): '
+          f'|dE| {abs(e - e_ref):.2e} eV, max |dF| {np.abs(f - f_ref).max():.2e} eV/A, max |dstress| {np.abs(s - s_ref).max():.2e} eV/A3')
+    MaxwellBoltzmannDistribution(run, temperature_K=330, rng=np.random.default_rng(0))
+    NoseHooverChainNVT(run, 1.0 * units.fs, 330).run(steps)
+    ref.positions, ref.cell = run.positions, run.cell
+    print(f'After {steps} MD steps ({run.calc.migrations} owner changes): max |dF| {np.abs(run.get_forces() - ref.get_forces()).max():.2e} eV/A')
+    run.calc.close()
+
+
+def scaling(atoms, workers_list, mode, backend='mock', repeats=REPEATS, threads=THREADS):
+    """Strong (fixed atoms) or weak (atoms proportional to workers, by tiling) scaling of one force call."""
+    from benchmark import tile
+
+    rows = []
+    for workers in workers_list:
+        system = tile(atoms, workers) if mode == 'weak' else atoms.copy()
+        system.calc = DomainCalculator(backend, workers=workers, threads=threads)
+        system.get_forces()                         # Workers load the model on the first call.
+        times = []
+        for _ in range(repeats):
+            system.positions += 1e-3
+            t0 = time.perf_counter()
+            system.get_forces()
+            times.append(time.perf_counter() - t0)
+        t = system.calc.timings
+        system.calc.close()
+        rows.append({'workers': workers, 'atoms': len(system), 'grid': t['grid'], 'seconds': min(times),
+                     'critical_path_s': max(t['domain_cpu_s']) + t['decompose_s'], 'halo_overhead': t['halo_overhead']})
+    base = rows[0]
+    print(f'{mode} scaling ({backend}, {os.cpu_count()} cores):')
+    for r in rows:
+        work = (r['atoms'] / base['atoms']) / (r['workers'] / base['workers'])
+        # Measured wall time, and the critical path (what the wall time is with a free core per worker).
+        print(f'  {r["workers"]:>3} workers {r["atoms"]:>8} atoms grid {r["grid"]}: {r["seconds"]:.3f} s/call '
+              f'(efficiency {base["seconds"] * work / r["seconds"]:.0%}), decomposition + slowest domain (CPU) '
+              f'{r["critical_path_s"]:.3f} s (efficiency {base["critical_path_s"] * work / r["critical_path_s"]:.0%}), '
+              f'halo overhead {r["halo_overhead"]:.2f}x')
+    return rows
+
+
+if __name__ == '__main__':
+    from calculators import BACKENDS
+
+    parser = argparse.ArgumentParser(description='Validate and measure the domain-decomposed calculator.')
+    parser.add_argument('input', help='Periodic structure (.xyz with a cell).')
+    parser.add_argument('--backend', default='mock', choices=sorted(BACKENDS))
+    parser.add_argument('--repeat', type=int, nargs=3, default=[1, 1, 1], help='Tile the box first (e.g. 4 4 4).')
+    parser.add_argument('--validate', action='store_true', help='Compare against the direct calculator.')
+    parser.add_argument('--workers', type=int, default=2, help='Workers for --validate.')
+    parser.add_argument('--strong', type=int, nargs='+', help='Worker counts for strong scaling.')
+    parser.add_argument('--weak', type=int, nargs='+', help='Worker counts (powers of two) for weak scaling.')
+    parser.add_argument('--threads', type=int, default=THREADS)
+    args = parser.parse_args()
+
+    atoms = read(args.input).repeat(args.repeat)
+    atoms.set_pbc(True)
+    if args.validate:
+        validate(atoms, workers=args.workers, backend=args.backend)
+    if args.strong:
+        scaling(atoms, args.strong, 'strong', args.backend, threads=args.threads)
+    if args.weak:
+        scaling(atoms, args.weak, 'weak', args.backend, threads=args.threads)
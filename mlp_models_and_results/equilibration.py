@@ -0,0 +1,96 @@
+import json
+import numpy as np
+from ase import units
+
+
+# Convergence-driven NVT equilibration (instead of a fixed STEPS_EQUIL).
+#
+# The dynamics run in chunks of CHECK_EVERY steps. After MIN_STEPS, the last
+# WINDOW_STEPS of the thermo log (ThermoRecorder's in-memory window) are split
+# into N_BLOCKS blocks and, for temperature and potential energy per atom:
+#   - drift: the linear trend of the block means across the window must not be
+#     significant, i.e. within drift_sigma standard errors of zero (the error
+#     from the scatter of the block means about the fitted line);
+#   - block variance: the std of the block means must be below an absolute
+#     tolerance (fluctuations have settled, not just stopped trending);
+#   - the mean temperature must be within temp_tol of the target.
+# (Tolerances in CRITERIA.)
+# Equilibration stops at the first check that passes, or at MAX_STEPS. Every
+# check, the decision, and the steps saved against MAX_STEPS are printed and
+# written to a JSON log.
+MIN_STEPS = 10000
+MAX_STEPS = 100000
+CHECK_EVERY = 1000
+WINDOW_STEPS = 10000     # NOTE: Must fit ThermoRecorder's window: WINDOW_STEPS / interval <= block_size.
+N_BLOCKS = 10
+CRITERIA = {
+    'drift_sigma': 2.5,          # Drift over the window / its standard error (~95% for 8 degrees of freedom).
+    'temp_block_std': 2.0,       # K.
+    'pe_block_std': 1e-3,        # eV/atom.
+    'temp_tol': 5.0,             # K from the target.
+}
+
+
+def block_stats(time_ps, x, n_blocks=N_BLOCKS):
+    """Mean and std of the block means, and the drift (linear trend over the window) of x with its standard error."""
+    blocks = np.array_split(np.arange(len(x)), n_blocks)
+    means = np.array([x[b].mean() for b in blocks])
+    centres = np.array([time_ps[b].mean() for b in blocks])
+    slope, intercept = np.polyfit(centres, means, 1)
+    resid = means - (slope * centres + intercept)
+    slope_err = np.sqrt(resid @ resid / (n_blocks - 2) / ((centres - centres.mean()) ** 2).sum())
+    span = time_ps[-1] - time_ps[0]
+    return {'mean': float(means.mean()), 'block_std': float(means.std(ddof=1)),
+            'drift': float(slope * span), 'drift_err': float(slope_err * span)}
+
+
+def check_convergence(records, temp_target, natoms, timestep_fs=1.0, n_blocks=N_BLOCKS, criteria=CRITERIA):
+    """(converged, stats) for thermo records (rows of step, T, PE, KE, Econs)."""
+    time_ps = records[:, 0] * timestep_fs * 1e-3
+    temp = block_stats(time_ps, records[:, 1], n_blocks)
+    pe = block_stats(time_ps, records[:, 2] / natoms, n_blocks)
+    checks = {
+        'temp_drift': bool(abs(temp['drift']) <= criteria['drift_sigma'] * temp['drift_err']),
+        'pe_drift': bool(abs(pe['drift']) <= criteria['drift_sigma'] * pe['drift_err']),
+        'temp_block_std': temp['block_std'] <= criteria['temp_block_std'],
+        'pe_block_std': pe['block_std'] <= criteria['pe_block_std'],
+        'temp_mean': abs(temp['mean'] - temp_target) <= criteria['temp_tol'],
+    }
+    return all(checks.values()), {'T': temp, 'PE_per_atom': pe, 'checks': checks}
+
+
+def run_until_converged(dyn, thermo, temp_target, interval, min_steps=MIN_STEPS, max_steps=MAX_STEPS,
+                        check_every=CHECK_EVERY, window_steps=WINDOW_STEPS, criteria=CRITERIA, log_file=None):
+    """Run dyn (with thermo attached every `interval` steps) until converged or max_steps. Returns steps run."""
+    window = window_steps // interval
+    if window > len(thermo.buffer):
+        raise ValueError(f'WINDOW_STEPS/interval = {window} records does not fit the thermo window ({len(thermo.buffer)}).')
+    natoms = len(thermo.atoms)
+    timestep_fs = dyn.dt / units.fs
+    history = []
+    steps, converged = 0, False
+    while steps < max_steps:
+        n = min(check_every, max_steps - steps)
+        dyn.run(n)
+        steps += n
+        if steps < min_steps or thermo.n_records < N_BLOCKS * 2:
+            continue
+        converged, stats = check_convergence(thermo.window(window), temp_target, natoms, timestep_fs, criteria=criteria)
+        stats['step'] = steps
+        history.append(stats)
+        failed = [k for k, ok in stats['checks'].items() if not ok]
+        print(f'Equil check at step {steps}: T {stats["T"]["mean"]:.1f} K (block std {stats["T"]["block_std"]:.2f}, '
+              f'drift {stats["T"]["drift"]:+.2f}), PE {stats["PE_per_atom"]["mean"]:.4f} eV/atom '
+              f'(block std {stats["PE_per_atom"]["block_std"]:.1e}, drift {stats["PE_per_atom"]["drift"]:+.1e}) -> '
+              + ('converged' if converged else f'not yet ({", ".join(failed)})'), flush=True)
+        if converged:
+            break
+
+    saved = max_steps - steps
+    print(f'Equilibration {"converged" if converged else "hit MAX_STEPS"} after {steps} steps '
+          f'({saved} of {max_steps} steps saved, {saved / max_steps:.0%}).')
+    if log_file:
+        with open(log_file, 'w') as f:
+            json.dump({'converged': converged, 'steps': steps, 'min_steps': min_steps, 'max_steps': max_steps,
+                       'steps_saved': saved, 'window_steps': window_steps, 'criteria': criteria, 'checks': history}, f, indent=1)
+    return steps
@@ -0,0 +1,356 @@
+import io, mmap, os, re, shutil, sys, tempfile
+import numpy as np
+from ase.io import read, write
+
+
+# Byte-offset index sidecar for extxyz trajectories.
+#
+# '<traj>.xyz.idx' holds one (byte offset, step) pair per frame as raw
+# little-endian int64 (step is -1 for legacy frames without 'step=' in the
+# comment line). The writer appends to it as frames are written, and
+# build_index() can rebuild it from the trajectory with a vectorised newline
+# scan. With the index, counting frames, reading the last frame and random
+# access are a seek instead of a pass over a multi-GB file.
+#
+# The index is only ever behind the trajectory (the frame is flushed before
+# its index entry), so load_index() checks the last indexed frame ends at EOF
+# and scans only the un-indexed tail otherwise.
+#
+# repair_tail() fixes half-written frames left by walltime kills by walking
+# backwards from EOF to the last complete, valid frame and truncating in place.
+# It only touches the last few frames, so it takes milliseconds at any file size.
+#
+#   python extxyz_index.py traj.xyz      (rebuilds traj.xyz.idx)
+#   python extxyz_index.py --selftest    (repair/index checks on synthetic truncated files)
+CHUNK_SIZE = 64 * 1024 * 1024   # NOTE: Bytes per chunk of the newline scan.
+MAX_TAIL_SCAN = 256 * 1024 * 1024  # NOTE: Give up repairing if no valid frame is found this far from EOF.
+STEP_RE = re.compile(rb'\bstep=(-?\d+)')
+PROPERTIES_RE = re.compile(rb'Properties=(\S+)')
+
+
+def index_name(filename):
+    return filename + '.idx'
+
+
+def _frame_step(mm, offset):
+    """Step from the comment line of the frame at offset (-1 if absent)."""
+    start = mm.find(b'\n', offset) + 1
+    m = STEP_RE.search(mm, start, mm.find(b'\n', start))
+    return int(m.group(1)) if m else -1
+
+
+def scan_frames(filename, start=0, first_frame=0):
+    """Offsets and steps of every complete frame from byte `start` on.
+
+    Assumes a constant atom count (true for our MD runs) and checks each
+    frame's atom-count line. An incomplete frame at EOF is left out.
+    """
+    size = os.path.getsize(filename)
+    if size <= start:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        natoms = int(mm[start:mm.find(b'\n', start)])
+        lines_per_frame = natoms + 2
+
+        # Newlines ending a frame (every lines_per_frame-th), chunk by chunk (vectorised).
+        # A frame is complete once its last newline exists.
+        frame_ends = []
+        n_lines = 0
+        for pos in range(start, size, CHUNK_SIZE):
+            chunk = np.frombuffer(mm[pos:pos + CHUNK_SIZE], dtype=np.uint8)
+            newlines = np.flatnonzero(chunk == 10)
+            first = (lines_per_frame - 1 - n_lines) % lines_per_frame
+            frame_ends.append(newlines[first::lines_per_frame] + pos + 1)
+            n_lines += len(newlines)
+        frame_ends = np.concatenate(frame_ends)
+
+        n_frames = len(frame_ends)
+        offsets = np.empty(n_frames, np.int64)
+        if n_frames:
+            offsets[0] = start
+            offsets[1:] = frame_ends[:-1]
+
+        steps = np.empty(n_frames, np.int64)
+        for k, off in enumerate(offsets):
+            if int(mm[off:mm.find(b'\n', off)]) != natoms:
+                raise ValueError(f'{filename}: frame {first_frame + k} at byte {off} does not have {natoms} atoms.')
+            steps[k] = _frame_step(mm, off)
+    return offsets, steps
+
+
+def build_index(filename):
+    """Rebuild the sidecar from scratch."""
+    offsets, steps = scan_frames(filename)
+    _write_index(index_name(filename), offsets, steps)
+    return offsets, steps
+
+
+def _write_index(idx_file, offsets, steps, mode='wb'):
+    with open(idx_file, mode) as f:
+        f.write(np.stack([offsets, steps], axis=1).astype('<i8').tobytes())
+
+
+def _frame_end(mm, offset):
+    natoms = int(mm[offset:mm.find(b'\n', offset)])
+    pos = offset
+    for _ in range(natoms + 2):
+        pos = mm.find(b'\n', pos) + 1
+        if pos == 0:
+            return -1
+    return pos
+
+
+def load_index(filename):
+    """(offsets, steps) for every complete frame, catching up the sidecar if needed."""
+    idx_file = index_name(filename)
+    size = os.path.getsize(filename)
+    if not os.path.exists(idx_file):
+        return build_index(filename)
+    data = np.fromfile(idx_file, dtype='<i8')
+    data = data[:len(data) // 2 * 2].reshape(-1, 2)
+    offsets, steps = data[:, 0].copy(), data[:, 1].copy()
+    if len(offsets) == 0:
+        return build_index(filename)
+    if offsets[-1] >= size:
+        # Trajectory was truncated behind the index: drop entries past EOF.
+        keep = offsets < size
+        offsets, steps = offsets[keep], steps[keep]
+        if len(offsets) == 0:
+            return build_index(filename)
+    with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        end = _frame_end(mm, offsets[-1])
+    if end == -1:
+        # Last indexed frame is incomplete.
+        offsets, steps = offsets[:-1], steps[:-1]
+        _write_index(idx_file, offsets, steps)
+        return offsets, steps
+    if end < size:
+        # Frames appended without index entries (e.g. killed between frame and index write).
+        new_offsets, new_steps = scan_frames(filename, start=end, first_frame=len(offsets))
+        offsets, steps = np.concatenate([offsets, new_offsets]), np.concatenate([steps, new_steps])
+    if len(offsets) != len(data):
+        _write_index(idx_file, offsets, steps)
+    return offsets, steps
+
+
+def _columns(comment):
+    """Number of whitespace-separated columns per atom row from the Properties= key."""
+    m = PROPERTIES_RE.search(comment)
+    if m is None:
+        return 4  # Plain xyz: species x y z.
+    fields = m.group(1).strip(b'"').split(b':')
+    return sum(int(n) for n in fields[2::3])
+
+
+def _valid_frame(mm, start, end, natoms):
+    """Check the frame in mm[start:end] has natoms rows with the expected column count."""
+    lines = mm[start:end].split(b'\n')[:-1]
+    if len(lines) != natoms + 2:
+        return False
+    ncol = _columns(lines[1])
+    return all(len(row.split()) == ncol for row in lines[2:])
+
+
+def repair_tail(filename):
+    """Truncate a half-written frame (or garbage) after the last complete frame.
+
+    Walks backwards from EOF over whole lines, so the cost depends only on the
+    size of the last frames. A frame only counts if it has the atom count of the
+    first frame (as in scan_frames), so a mangled count line cannot pass off a
+    partial frame as complete. Returns the number of bytes removed.
+    """
+    size = os.path.getsize(filename)
+    if size == 0:
+        return 0
+    with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        first = mm[:mm.find(b'\n')].strip()
+        expected = int(first) if first.isdigit() else None
+        # End of the last complete line (a partial last line is never part of a valid frame).
+        end = mm.rfind(b'\n') + 1
+        n_lines_after = 0   # Complete lines between the current line and `end`.
+        line_end = end
+        good_end = None
+        while line_end > 0 and end - line_end < MAX_TAIL_SCAN:
+            line_start = mm.rfind(b'\n', 0, line_end - 1) + 1
+            line = mm[line_start:line_end].strip()
+            if line.isdigit():
+                natoms = int(line)
+                if n_lines_after >= natoms + 1 and expected in (None, natoms):
+                    # Candidate frame start with enough lines after it: find its end and validate.
+                    frame_end = line_start
+                    for _ in range(natoms + 2):
+                        frame_end = mm.find(b'\n', frame_end) + 1
+                    if _valid_frame(mm, line_start, frame_end, natoms):
+                        good_end = frame_end
+                        break
+            n_lines_after += 1
+            line_end = line_start
+    if good_end is None:
+        raise ValueError(f'{filename}: no complete frame found in the last {MAX_TAIL_SCAN} bytes.')
+    if good_end < size:
+        with open(filename, 'r+b') as f:
+            f.truncate(good_end)
+        print(f'Repaired {filename}: removed {size - good_end} bytes after the last complete frame.')
+    return size - good_end
+
+
+def count_frames(filename):
+    return len(load_index(filename)[0])
+
+
+def read_frame(filename, k, index=None):
+    """Read frame k (negative counts from the end) with one seek."""
+    offsets, _ = load_index(filename) if index is None else index
+    k = range(len(offsets))[k]
+    end = offsets[k + 1] if k + 1 < len(offsets) else None
+    with open(filename, 'rb') as f:
+        f.seek(offsets[k])
+        text = f.read(None if end is None else end - offsets[k])
+    return read(io.StringIO(text.decode()), format='extxyz', index=0)
+
+
+class IndexedExtxyzWriter:
+    """Keeps an extxyz file open and appends an index entry per frame."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:
+            repair_tail(filename)  # Never append after a half-written frame.
+            load_index(filename)   # Bring the sidecar up to date before appending.
+        self.f = open(filename, 'ab')
+        self.idx = open(index_name(filename), 'ab')
+        self.text = io.TextIOWrapper(self.f, encoding='ascii', write_through=True)
+
+    def write(self, atoms, step=0):
+        atoms.info['step'] = step
+        offset = self.f.tell()
+        write(self.text, atoms, format='extxyz')
+        self.text.flush()
+        # Frame first, then its index entry (the index may lag, never lead).
+        self.idx.write(np.array([offset, step], dtype='<i8').tobytes())
+
+    def flush(self):
+        self.text.flush()
+        self.idx.flush()
+
+    def close(self):
+        if not self.f.closed:
+            self.flush()
+            self.idx.close()
+            self.text.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _selftest_frames(n_frames=4):
+    """Small trajectory (3 waters with momenta) written through IndexedExtxyzWriter: returns its bytes and frame ends."""
+    from ase.build import molecule
+    rng = np.random.default_rng(0)
+    atoms = molecule('H2O')
+    for shift in ([3, 0, 0], [0, 3, 0]):
+        other = molecule('H2O')
+        other.translate(shift)
+        atoms += other
+    atoms.set_cell([9, 9, 9])
+    atoms.set_pbc(True)
+    atoms.set_momenta(rng.normal(size=(len(atoms), 3)))
+    tmp = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmp, 'clean.xyz')
+        ends = []
+        with IndexedExtxyzWriter(filename) as w:
+            for k in range(n_frames):
+                atoms.positions += rng.normal(scale=0.05, size=atoms.positions.shape)
+                w.write(atoms, step=10 * k)
+                w.flush()
+                ends.append(os.path.getsize(filename))
+        with open(filename, 'rb') as f:
+            return f.read(), ends
+    finally:
+        shutil.rmtree(tmp)
+
+
+def selftest():
+    """Corrupt copies of a small trajectory the ways killed jobs do, then check repair_tail/load_index recover
+    exactly the complete frames. Returns True if every case passes."""
+    clean, ends = _selftest_frames()
+    frame = clean[ends[-2]:ends[-1]]           # Last frame, used to build the broken tails.
+    lines = frame.split(b'\n')
+    count, comment, rows = lines[0], lines[1], lines[2:-1]
+    full = len(ends)
+    cases = {
+        # name: (trajectory bytes, number of complete frames expected after the repair)
+        'partial atom row': (clean + count + b'\n' + comment + b'\n' + rows[0] + b'\n' + rows[1][:12], full),
+        'partial row, whole lines only': (clean[:ends[-1] - len(rows[-1]) - 1], full - 1),
+        'NUL-padded tail': (clean + b'\0' * 4096, full),
+        'NUL-padded half frame': (clean[:ends[-2] + len(frame) // 2] + b'\0' * 4096, full - 1),
+        'truncated comment line': (clean + count + b'\n' + comment[:len(comment) // 2], full),
+        'comment line without rows': (clean + count + b'\n' + comment + b'\n', full),
+        'mangled count line': (clean + b'9x\n' + b'\n'.join([comment] + rows) + b'\n', full),
+        'count line too small': (clean + str(len(rows) - 1).encode() + b'\n' + b'\n'.join([comment] + rows) + b'\n', full),
+        'count line too large': (clean + str(len(rows) + 5).encode() + b'\n' + b'\n'.join([comment] + rows) + b'\n', full),
+    }
+    ok = True
+    tmp = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmp, 'traj.xyz')
+
+        def check(name, data, n_expected, index=None):
+            with open(filename, 'wb') as f:
+                f.write(data)
+            if isinstance(index, bytes):
+                with open(index_name(filename), 'wb') as f:
+                    f.write(index)
+            elif index is not None:
+                _write_index(index_name(filename), *index)
+            elif os.path.exists(index_name(filename)):
+                os.remove(index_name(filename))
+            try:
+                repair_tail(filename)
+                with open(filename, 'rb') as f:
+                    repaired = f.read()
+                offsets, steps = load_index(filename)
+                rebuilt = scan_frames(filename)
+                last = read_frame(filename, -1, index=(offsets, steps))
+                expected = read(io.StringIO(clean[ends[n_expected - 2] if n_expected > 1 else 0:ends[n_expected - 1]].decode()),
+                                format='extxyz')
+                passed = (repaired == clean[:ends[n_expected - 1]] and len(offsets) == n_expected
+                          and np.array_equal(offsets, rebuilt[0]) and np.array_equal(steps, rebuilt[1])
+                          and steps[-1] == 10 * (n_expected - 1)
+                          and np.allclose(last.positions, expected.positions) and np.allclose(last.get_momenta(), expected.get_momenta()))
+                detail = f'{len(offsets)} frames'
+            except Exception as e:
+                passed, detail = False, f'{type(e).__name__}: {e}'
+            print(f'  {"ok" if passed else "FAILED":<7} {name} ({detail})')
+            return passed
+
+        print(f'repair_tail/load_index self-test ({full} frames of {count.decode()} atoms):')
+        for name, (data, n_expected) in cases.items():
+            ok &= check(name, data, n_expected)
+        # Index sidecar ahead of the trajectory: the file was cut back (here mid-frame) after the entries were written.
+        offsets = np.array([0] + ends[:-1], dtype=np.int64)
+        steps = 10 * np.arange(full, dtype=np.int64)
+        ok &= check('index past EOF', clean[:ends[-2] + 40], full - 1, index=(offsets, steps))
+        ok &= check('index past EOF, all but one frame', clean[:ends[0] + 40], 1, index=(offsets, steps))
+        raw = np.stack([offsets, steps], axis=1).astype('<i8').tobytes()
+        ok &= check('index entry half-written', clean, full, index=raw[:-8])
+        ok &= check('index behind the trajectory', clean, full, index=raw[:-32])
+    finally:
+        shutil.rmtree(tmp)
+    print('All passed.' if ok else 'Some checks FAILED.')
+    return ok
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python extxyz_index.py traj.xyz   (rebuilds traj.xyz.idx)\n'
+              '       python extxyz_index.py --selftest   (repair/index checks on synthetic truncated files)')
+        exit(1)
+    if sys.argv[1] == '--selftest':
+        exit(0 if selftest() else 1)
+    offsets, steps = build_index(sys.argv[1])
+    print(f'Indexed {len(offsets)} frames -> {index_name(sys.argv[1])}')
@@ -0,0 +1,179 @@
+import argparse, contextlib, os, time
+import numpy as np
+from ase.calculators.calculator import Calculator, all_changes
+from ase.io import read
+
+from calculators import BACKENDS, get_calculator
+
+
+# Inference speed-ups for the backend calculators, guarded by a reference check.
+#
+# accelerate() starts from the plain calculator (get_calculator(), backend
+# default precision) and tries, in order:
+#   - the requested precision (float32/float64, backends with a switch),
+#   - torch.inference_mode() around each call,
+#   - torch.compile() of the calculator's torch modules.
+# Each combination is checked against the plain calculator on a sample frame
+# (energy per atom and max force difference) before the run starts. Options
+# that raise or disagree are dropped one by one (compile first, then
+# inference_mode, then precision), so a backend only gets what it supports.
+# The conservative models (orb v3 conservative, MACE, SevenNet, AIMNet2) take
+# forces as -dE/dx through autograd, which inference_mode forbids; for those the
+# check fails and the option is dropped rather than silently breaking forces.
+#
+# Compiled graphs go to the inductor cache in CACHE_DIR (FX graph + autograd
+# caches on disk), so later jobs with the same model, torch version and system
+# size reload them instead of recompiling.
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'aibn_mlp', 'inductor')
+ENERGY_TOL = 1e-3   # NOTE: eV/atom vs the reference path.
+FORCE_TOL = 5e-2    # NOTE: eV/A, max over atoms and components.
+COMPILE_MODE = 'default'  # NOTE: torch.compile mode ('default', 'reduce-overhead', 'max-autotune').
+
+
+def enable_compile_cache(cache_dir=CACHE_DIR):
+    """Persistent inductor caches in cache_dir (set before the first torch.compile; existing env vars win)."""
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', cache_dir)
+    os.environ.setdefault('TORCHINDUCTOR_FX_GRAPH_CACHE', '1')
+    os.environ.setdefault('TORCHINDUCTOR_AUTOGRAD_CACHE', '1')
+
+
+def torch_modules(calc):
+    """(owner, attribute, index or None) of every torch.nn.Module held by a calculator (one level down, lists included)."""
+    import torch
+    found = []
+    # One level down for wrappers (AIMNet2ASE keeps its model on a non-ASE AIMNet2Calculator).
+    owners = [v for v in vars(calc).values() if isinstance(v, Calculator) or type(v).__name__.endswith('Calculator')]
+    for owner in [calc] + owners:
+        for attr, value in vars(owner).items():
+            if isinstance(value, torch.nn.Module):
+                found.append((owner, attr, None))
+            elif isinstance(value, (list, tuple)) and value and all(isinstance(v, torch.nn.Module) for v in value):
+                found += [(owner, attr, k) for k in range(len(value))]
+    return found
+
+
+def swap_modules(calc, fn):
+    """Replace each torch module of calc by fn(module). Returns a function that puts the originals back."""
+    swapped = []
+    for owner, attr, k in torch_modules(calc):
+        value = getattr(owner, attr)
+        if k is None:
+            swapped.append((owner, attr, None, value))
+            setattr(owner, attr, fn(value))
+        else:
+            swapped.append((owner, attr, k, value[k]))
+            value = list(value)
+            value[k] = fn(value[k])
+            setattr(owner, attr, value)
+
+    def restore():
+        for owner, attr, k, module in reversed(swapped):
+            if k is None:
+                setattr(owner, attr, module)
+            else:
+                value = list(getattr(owner, attr))
+                value[k] = module
+                setattr(owner, attr, value)
+    return restore
+
+
+class InferenceCalculator(Calculator):
+    """Runs another calculator's calculate() under torch.inference_mode() (or as-is)."""
+
+    def __init__(self, calc, inference_mode=True):
+        super().__init__()
+        self.calc = calc
+        self.inference_mode = inference_mode
+        self.implemented_properties = list(calc.implemented_properties)
+
+    def calculate(self, atoms=None, properties=('energy',), system_changes=all_changes):
+        super().calculate(atoms, properties, system_changes)
+        if self.inference_mode:
+            import torch
+            context = torch.inference_mode()
+        else:
+            context = contextlib.nullcontext()
+        with context:
+            self.calc.calculate(self.atoms, properties, system_changes)
+        self.results = dict(self.calc.results)
+
+
+def evaluate(calc, atoms, repeats=3):
+    """Energy, forces and mean seconds per call of calc on a copy of atoms (first call not timed)."""
+    test = atoms.copy()
+    test.calc = calc
+    energy, forces = test.get_potential_energy(), test.get_forces().copy()
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        calc.results.clear()
+        test.get_forces()
+    return energy, forces, (time.perf_counter() - t0) / repeats
+
+
+def accelerate(name, atoms, device=None, precision=None, inference_mode=True, compile=False,
+               cache_dir=CACHE_DIR, energy_tol=ENERGY_TOL, force_tol=FORCE_TOL):
+    """Fastest calculator for a backend that agrees with the plain one on atoms. Returns (calc, report dict)."""
+    try:
+        import torch
+    except ImportError:
+        print(f'Backend {name}: torch not available, nothing to accelerate.')
+        return get_calculator(name, device), {'backend': name}
+    if compile:
+        enable_compile_cache(cache_dir)
+
+    base = get_calculator(name, device)
+    e_ref, f_ref, t_ref = evaluate(base, atoms)
+    # Most to least aggressive; each drops one option from the previous.
+    candidates = [(precision, inference_mode, compile), (precision, inference_mode, False),
+                  (precision, False, False), (None, False, False)]
+    tried = []
+    for option in candidates:
+        if option in tried:
+            continue
+        tried.append(option)
+        prec, inference, compiled = option
+        if option == (None, False, False):
+            break
+        restore = None
+        try:
+            calc = get_calculator(name, device, prec) if prec else base
+            if compiled:
+                restore = swap_modules(calc, lambda m: torch.compile(m, mode=COMPILE_MODE, dynamic=True))
+            calc = InferenceCalculator(calc, inference_mode=inference)
+            energy, forces, t = evaluate(calc, atoms)
+        except Exception as e:
+            print(f'Backend {name}: precision={prec}, inference_mode={inference}, compile={compiled} failed ({type(e).__name__}: {e})')
+            if restore:
+                restore()
+            continue
+        de = abs(energy - e_ref) / len(atoms)
+        df = np.abs(forces - f_ref).max()
+        if de <= energy_tol and df <= force_tol:
+            report = {'backend': name, 'precision': prec, 'inference_mode': inference, 'compile': compiled,
+                      'energy_diff_per_atom': de, 'max_force_diff': df, 'reference_s': t_ref, 'call_s': t}
+            print(f'Backend {name}: precision={prec}, inference_mode={inference}, compile={compiled}: '
+                  f'dE {de:.2e} eV/atom, max dF {df:.2e} eV/A, {t_ref / t:.2f}x the reference speed')
+            return calc, report
+        print(f'Backend {name}: precision={prec}, inference_mode={inference}, compile={compiled} rejected '
+              f'(dE {de:.2e} eV/atom, max dF {df:.2e} eV/A)')
+        if restore:
+            restore()
+    print(f'Backend {name}: using the reference path.')
+    return base, {'backend': name, 'precision': None, 'inference_mode': False, 'compile': False, 'reference_s': t_ref}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Try inference speed-ups for a backend against its reference path.')
+    parser.add_argument('backend', choices=sorted(BACKENDS))
+    parser.add_argument('input', help='Sample frame (.xyz).')
+    parser.add_argument('--precision', choices=['float32', 'float64'], default=None)
+    parser.add_argument('--no-inference-mode', action='store_true')
+    parser.add_argument('--compile', action='store_true')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--device', default=None)
+    args = parser.parse_args()
+
+    atoms = read(args.input)
+    accelerate(args.backend, atoms, device=args.device, precision=args.precision,
+               inference_mode=not args.no_inference_mode, compile=args.compile, cache_dir=args.cache_dir)
@@ -0,0 +1,262 @@
+import argparse, json, time
+import numpy as np
+from ase import units
+from ase.calculators.calculator import all_changes
+from ase.io import read
+from ase.md.md import MolecularDynamics
+
+
+# Lean NVT integrators: Nose-Hoover chain and Langevin (BAOAB).
+#
+# The production runs use ase.md.npt.NPT with pfactor=None as a Nose-Hoover
+# NVT, which goes through the general NPT code (cell matrices, get/set copies of
+# positions and momenta every step). These integrators update
+# atoms.arrays['positions'] and ['momenta'] in place with preallocated scratch
+# arrays, call calculator.calculate() directly (no check_state/array copies),
+# and keep the forces for the next half kick, so a step costs one force call
+# plus a few passes over (N, 3) arrays.
+#
+# They are ASE MolecularDynamics objects (attach/observers/nsteps/run), so the
+# existing trajectory writers, ThermoRecorder, AsyncObservers and Checkpointer
+# work unchanged and write the same outputs, including the step-0 frame. The
+# Nose-Hoover chain conserved energy is exposed as get_gibbs_free_energy(), the
+# name ThermoRecorder already reads from NPT. Constraints are not supported.
+#
+#   python integrators.py box.xyz --steps 2000            (overhead per step, zero-cost calculator)
+#   python integrators.py box.xyz --steps 2000 --validate  (mock potential: T and conserved-energy drift)
+TTIME = 100.0        # NOTE: fs, Nose-Hoover time constant (same as the NPT runs).
+CHAIN_LENGTH = 3
+FRICTION = 0.01      # NOTE: 1/fs, Langevin friction (1/TTIME).
+# Suzuki-Yoshida weights for the chain propagation (4th order).
+SY_WEIGHTS = (1 / (2 - 2 ** (1 / 3)), -2 ** (1 / 3) / (2 - 2 ** (1 / 3)), 1 / (2 - 2 ** (1 / 3)))
+
+
+class InPlaceNVT(MolecularDynamics):
+    """In-place array access, direct force calls and a lean run loop shared by the NVT integrators."""
+
+    def __init__(self, atoms, timestep, temperature_K, **kwargs):
+        if atoms.constraints:
+            raise ValueError(f'{type(self).__name__} does not support constraints.')
+        super().__init__(atoms, timestep, **kwargs)
+        self.temperature_K = temperature_K
+        self.kT = units.kB * temperature_K
+        self.ndof = 3 * len(atoms)      # Same count as ThermoRecorder.
+        self.inv_m = 1 / self.masses    # (N, 1)
+        self.tmp = np.empty((len(atoms), 3))
+        self.forces = None
+
+    def _compute_forces(self):
+        calc = self.atoms.calc
+        calc.reset()    # Drop stale results (e.g. stress) so observers can't read them as current.
+        calc.calculate(self.atoms, ['energy', 'forces'], all_changes)
+        return calc.results['forces']
+
+    def _kick(self, dt):
+        """p += dt * F"""
+        np.multiply(self.forces, dt, out=self.tmp)
+        self.atoms.arrays['momenta'] += self.tmp
+
+    def _drift(self, dt):
+        """x += dt * p / m"""
+        np.multiply(self.atoms.arrays['momenta'], self.inv_m, out=self.tmp)
+        self.tmp *= dt
+        self.atoms.arrays['positions'] += self.tmp
+
+    def _ekin2(self):
+        """2 x kinetic energy."""
+        p = self.atoms.arrays['momenta']
+        np.multiply(p, p, out=self.tmp)
+        self.tmp *= self.inv_m
+        return self.tmp.sum()
+
+    def irun(self, steps=50):
+        self.max_steps = self.nsteps + steps
+        # Forces are recomputed at the start of every run(): the atoms may have been changed in between.
+        self.forces = self._compute_forces()
+        if self.nsteps == 0:
+            self.call_observers()
+        yield self.nsteps == self.max_steps
+        while self.nsteps < self.max_steps:
+            self.step()
+            self.nsteps += 1
+            self.call_observers()
+            yield self.nsteps == self.max_steps
+
+    def run(self, steps=50):
+        for complete in self.irun(steps):
+            pass
+        return complete
+
+
+class NoseHooverChainNVT(InPlaceNVT):
+    """Nose-Hoover chain NVT (Martyna-Tuckerman-Klein), velocity-Verlet with Trotter-split chain half steps."""
+
+    def __init__(self, atoms, timestep, temperature_K, ttime=TTIME*units.fs, chain_length=CHAIN_LENGTH, **kwargs):
+        super().__init__(atoms, timestep, temperature_K, **kwargs)
+        self.Q = np.full(chain_length, self.kT * ttime ** 2)
+        self.Q[0] *= self.ndof
+        self.eta = np.zeros(chain_length)
+        self.v_eta = np.zeros(chain_length)
+
+    def _chain_force(self, k, ekin2):
+        if k == 0:
+            return (ekin2 - self.ndof * self.kT) / self.Q[0]
+        return (self.Q[k - 1] * self.v_eta[k - 1] ** 2 - self.kT) / self.Q[k]
+
+    def _thermostat(self, dt):
+        """Propagate the chain by dt and scale the momenta once."""
+        v, M = self.v_eta, len(self.v_eta)
+        ekin2 = self._ekin2()
+        scale = 1.0
+        for w in SY_WEIGHTS:
+            d = w * dt
+            for k in range(M - 1, -1, -1):
+                s = np.exp(-v[k + 1] * d / 4) if k < M - 1 else 1.0
+                v[k] = (v[k] * s + self._chain_force(k, ekin2) * d / 2) * s
+            f = np.exp(-v[0] * d)
+            scale *= f
+            ekin2 *= f * f
+            self.eta += v * d
+            for k in range(M):
+                s = np.exp(-v[k + 1] * d / 4) if k < M - 1 else 1.0
+                v[k] = (v[k] * s + self._chain_force(k, ekin2) * d / 2) * s
+        self.atoms.arrays['momenta'] *= scale
+
+    def step(self):
+        half = 0.5 * self.dt
+        self._thermostat(half)
+        self._kick(half)
+        self._drift(self.dt)
+        self.forces = self._compute_forces()
+        self._kick(half)
+        self._thermostat(half)
+
+    def get_gibbs_free_energy(self):
+        """Conserved energy of the extended system (eV)."""
+        epot = self.atoms.calc.results['energy']
+        return (epot + 0.5 * self._ekin2() + 0.5 * (self.Q * self.v_eta ** 2).sum()
+                + self.ndof * self.kT * self.eta[0] + self.kT * self.eta[1:].sum())
+
+    def get_state(self):
+        return {'eta': self.eta.copy(), 'v_eta': self.v_eta.copy()}
+
+    def set_state(self, state):
+        self.eta[:] = state['eta']
+        self.v_eta[:] = state['v_eta']
+
+
+class LangevinNVT(InPlaceNVT):
+    """Langevin NVT with the BAOAB splitting (kick, drift, friction + noise, drift, kick)."""
+
+    def __init__(self, atoms, timestep, temperature_K, friction=FRICTION/units.fs, seed=None, **kwargs):
+        super().__init__(atoms, timestep, temperature_K, **kwargs)
+        self.friction = friction
+        self.c1 = np.exp(-friction * timestep)
+        self.sqrt_m = np.sqrt(self.masses)
+        self.c2 = np.sqrt((1 - self.c1 ** 2) * self.kT)
+        self.rng = np.random.default_rng(seed)
+        self.noise = np.empty((len(atoms), 3))
+
+    def step(self):
+        half = 0.5 * self.dt
+        p = self.atoms.arrays['momenta']
+        self._kick(half)
+        self._drift(half)
+        self.rng.standard_normal(out=self.noise)
+        self.noise *= self.sqrt_m
+        self.noise *= self.c2
+        p *= self.c1
+        p += self.noise
+        self._drift(half)
+        self.forces = self._compute_forces()
+        self._kick(half)
+
+    def get_state(self):
+        return {'rng': np.array(json.dumps(self.rng.bit_generator.state))}
+
+    def set_state(self, state):
+        self.rng.bit_generator.state = json.loads(str(state['rng']))
+
+
+INTEGRATORS = {'nhc': NoseHooverChainNVT, 'langevin': LangevinNVT}
+
+
+def nvt(atoms, temperature_K, integrator='npt', timestep_fs=1.0, seed=None, **kwargs):
+    """NVT dynamics by name: 'npt' (ASE NPT with the barostat off, the original setup), 'nhc', 'langevin'
+    or 'respa' (respa.py, timestep_fs is then the inner step and respa.OUTER_FS the step).
+
+    seed (int or SeedSequence) seeds the Langevin noise (None: fresh entropy); the other integrators are
+    deterministic and ignore it. Other keyword arguments go to the integrator (respa_nvt for 'respa').
+    """
+    if integrator == 'respa':
+        from respa import OUTER_FS, respa_nvt
+        return respa_nvt(atoms, temperature_K, outer_fs=OUTER_FS, inner_fs=timestep_fs, **kwargs)
+    if integrator == 'npt':
+        from ase.md.npt import NPT
+        return NPT(atoms, timestep=timestep_fs*units.fs, temperature_K=temperature_K,
+                   **{'externalstress': 0, 'pfactor': None, 'ttime': TTIME*units.fs, **kwargs})
+    if integrator == 'langevin':
+        kwargs['seed'] = seed
+    return INTEGRATORS[integrator](atoms, timestep_fs*units.fs, temperature_K, **kwargs)
+
+
+def overhead(atoms, steps, integrators=('npt', 'nhc', 'langevin'), temperature_K=330):
+    """Integrator cost per step in ms with a zero-cost calculator (forces are all zero)."""
+    from ase.md.velocitydistribution import MaxwellBoltzmannDistribution
+    from mock_calculator import ZeroCalculator
+
+    results = {}
+    for name in integrators:
+        run = atoms.copy()
+        MaxwellBoltzmannDistribution(run, temperature_K=temperature_K, rng=np.random.default_rng(0))
+        run.calc = ZeroCalculator()
+        dyn = nvt(run, temperature_K, name, seed=0)
+        dyn.run(10)
+        t0 = time.perf_counter()
+        dyn.run(steps)
+        results[name] = (time.perf_counter() - t0) / steps * 1e3
+        print(f'{name:>9}: {results[name]:.3f} ms/step integrator overhead ({len(atoms)} atoms)')
+    return results
+
+
+def validate(atoms, steps, integrators=('npt', 'nhc', 'langevin'), temperature_K=330, interval=10):
+    """Mock-potential NVT: mean T and conserved-energy drift per integrator."""
+    from ase.md.velocitydistribution import MaxwellBoltzmannDistribution, Stationary
+    from mock_calculator import MockCalculator
+
+    for name in integrators:
+        run = atoms.copy()
+        MaxwellBoltzmannDistribution(run, temperature_K=temperature_K, rng=np.random.default_rng(0))
+        Stationary(run)
+        run.calc = MockCalculator(skin=1.0)
+        dyn = nvt(run, temperature_K, name, seed=0)
+        temps, econs = [], []
+
+        def record():
+            temps.append(run.get_temperature())
+            if hasattr(dyn, 'get_gibbs_free_energy'):
+                econs.append(dyn.get_gibbs_free_energy())
+
+        dyn.attach(record, interval)
+        t0 = time.perf_counter()
+        dyn.run(steps)
+        wall = time.perf_counter() - t0
+        half = len(temps) // 2
+        drift = f', conserved energy drift {(econs[-1] - econs[0]) / len(run) / (steps * 1e-3) * 1e3:+.3f} meV/atom/ps' if econs else ''
+        print(f'{name:>9}: <T> {np.mean(temps[half:]):.1f} K (second half){drift}, {wall / steps * 1e3:.1f} ms/step')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Integrator overhead (zero-cost calculator) and mock validation.')
+    parser.add_argument('input', help='Periodic structure (.xyz with a cell).')
+    parser.add_argument('--steps', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, nargs=3, default=[1, 1, 1], help='Tile the box (e.g. 2 2 2).')
+    parser.add_argument('--validate', action='store_true', help='Run the mock potential instead and report T and drift.')
+    args = parser.parse_args()
+
+    atoms = read(args.input).repeat(args.repeat)
+    atoms.set_pbc(True)
+    if args.validate:
+        validate(atoms, args.steps)
+    else:
+        overhead(atoms, args.steps)
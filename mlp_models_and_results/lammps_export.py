@@ -0,0 +1,67 @@
+import argparse
+import numpy as np
+
+from traj_convert import CHUNK_FRAMES, TextSink, convert
+
+
+# Vectorised LAMMPS dump exporter for TRAVIS.
+#
+# Replaces the per-atom f.write loops of the production/resume scripts. Each
+# frame body is formatted with ONE %-format call on a template built once per
+# trajectory ('1 O %.4f %.4f %.4f\n2 H ...'). LammpsSink plugs into the
+# single-pass converter in traj_convert.py (process pool, frames read through
+# the .idx sidecar or the binary records), so wrapped and unwrapped dumps can
+# be written from one read. The output is byte-identical to the old loops.
+
+
+def body_template(symbols, unwrapped=True):
+    cols = 'xu yu zu' if unwrapped else 'x y z'
+    rows = ''.join(f'{j+1} {sym} %.4f %.4f %.4f\n' for j, sym in enumerate(symbols))
+    return f'ITEM: ATOMS id element {cols}\n' + rows
+
+
+def _format_standard(i, cell, positions, template):
+    box = np.diag(cell)
+    header = (f'ITEM: TIMESTEP\n{i}\nITEM: NUMBER OF ATOMS\n{len(positions)}\n'
+              'ITEM: BOX BOUNDS pp pp pp\n'
+              f'0.000000 {box[0]:.6f}\n0.000000 {box[1]:.6f}\n0.000000 {box[2]:.6f}\n')
+    return header + template % tuple(positions.ravel().tolist())
+
+
+class LammpsSink(TextSink):
+    """LAMMPS dump output for traj_convert.convert() (TIMESTEP counts the frames written)."""
+
+    def __init__(self, filename, unwrapped=True, stride=1):
+        self.filename = filename
+        self.unwrapped = unwrapped
+        self.stride = stride
+
+    def open(self, frames):
+        self.template = body_template(frames.symbols, self.unwrapped)
+        super().open(frames)
+
+    def format(self, i, frame):
+        cell, positions = frame.standard() if self.unwrapped else frame.wrapped()
+        return _format_standard(i, cell, positions, self.template).encode('ascii')
+
+
+def export_lammps(traj_file, out_file, unwrapped=True, workers=None, chunk_frames=CHUNK_FRAMES, stride=1):
+    """Convert a .xyz (indexed) or .bin trajectory to a LAMMPS dump. Returns frames/s."""
+    return convert(traj_file, [LammpsSink(out_file, unwrapped=unwrapped, stride=stride)],
+                   workers=workers, chunk_frames=chunk_frames)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export a .xyz/.bin trajectory to a LAMMPS dump for TRAVIS.')
+    parser.add_argument('traj')
+    parser.add_argument('out')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--unwrapped', dest='unwrapped', action='store_true', default=True,
+                      help='xu yu zu columns, no wrapping (default, needed for MSD).')
+    mode.add_argument('--wrapped', dest='unwrapped', action='store_false', help='x y z columns, wrapped into the box.')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk', type=int, default=CHUNK_FRAMES)
+    parser.add_argument('--stride', type=int, default=1)
+    args = parser.parse_args()
+    export_lammps(args.traj, args.out, unwrapped=args.unwrapped, workers=args.workers,
+                  chunk_frames=args.chunk, stride=args.stride)
@@ -0,0 +1,255 @@
+import argparse, json, os, subprocess, sys, time
+import numpy as np
+from ase import units
+from ase.io import read, write
+from ase.md.npt import NPT
+from ase.optimize import LBFGS
+from ase.md.velocitydistribution import MaxwellBoltzmannDistribution, Stationary
+
+from calculators import BACKENDS, measure_startup
+from inference import accelerate
+from binary_traj import BinaryTrajectoryWriter
+from async_observers import AsyncObservers, frame_writer
+from thermo_log import BLOCK_SIZE, ThermoRecorder
+from checkpoint import Checkpointer
+from equilibration import WINDOW_STEPS, run_until_converged
+from integrators import INTEGRATORS, nvt
+from lammps_export import export_lammps
+from profiling import MetricsExporter, SignalProfiler, Timers, instrument
+
+
+# Model-agnostic production driver: minimise -> heat -> NVT equilibration ->
+# NVT production -> unwrapped LAMMPS export, for any backend in calculators.py.
+#
+# Replaces the bodies of orb/mace/aimnet2/seven_net *_prod_run.py, which are
+# now thin wrappers calling run(<backend>). Only the selected backend is
+# imported, and its calculator is loaded once and kept for every phase (the old
+# scripts re-read the equilibrated structure and reloaded the model "to be
+# safe"; the equilibrated .xyz is still written as a checkpoint).
+#
+#   python md_driver.py orb                           (same as orb/orb_prod_run.py)
+#   python md_driver.py mock --steps-equil 100 --steps-prod 1000
+#   python md_driver.py mace --accelerate --precision float64 --compile
+#   python md_driver.py orb --input big.xyz --prepared --steps-equil 10000   (supercell.py start)
+#   python md_driver.py --startup orb mace aimnet2 sevennet mock
+INPUT_FILE = '../water_acetic_imidazole_mix.xyz'
+TEMP_TARGET = 330
+STEPS_EQUIL = 100000
+EQUIL_CONVERGE = False            # NOTE: Stop equilibration once T/PE have converged (equilibration.py); STEPS_EQUIL is then the maximum.
+EQUIL_MIN_STEPS = 10000
+STEPS_PROD = 2000000
+BOX_LENGTH = 37.2
+VERSION = '_2mill_interval_10'  # NOTE: PLACEHOLDER TO MARK/NAME OUTSPUTS (i.e., a suffix)
+INTERVAL = 10                     # NOTE: Interval to save production analysis in.
+ASYNC_IO = True                   # NOTE: Frame writes/status prints on a background thread (False = inline, to compare ms/step).
+PROFILE = False                   # NOTE: Time forces/observers into <name>_metrics_<version>.json/.prom; `kill -USR1 <pid>` for a cProfile window.
+INTEGRATOR = 'npt'                # NOTE: NVT integrator for equilibration/production: 'npt' (ASE NPT, barostat off), 'nhc', 'langevin' (integrators.py) or 'respa' (respa.py, a step is then one respa.OUTER_FS MLP step).
+SEED = None                       # NOTE: Seeds the heating velocities and the Langevin noise (None: drawn and printed).
+ACCELERATE = False                # NOTE: Try inference_mode/precision/torch.compile (inference.py), checked against the plain model first.
+
+
+def load_system(input_file=INPUT_FILE, box_length=BOX_LENGTH):
+    try:
+        atoms = read(input_file)
+    except FileNotFoundError:
+        print(f'Error: {input_file} not found. Run generate_system.py first.')
+        exit()
+    # Cubic box_length only for files without a cell (generate_system.py and supercell.py write theirs).
+    if atoms.cell.volume == 0:
+        atoms.set_cell([box_length, box_length, box_length])
+    atoms.set_pbc(True)
+    atoms.center()
+    print(f'Loaded {len(atoms)} atoms.')
+    return atoms
+
+
+def minimise(atoms):
+    # Use Fmax=0.1 to ensure it stops once atoms are comfortable.
+    LBFGS(atoms).run(fmax=0.1, steps=50)
+
+
+def heat(atoms, temp_target=TEMP_TARGET, rng=None):
+    print(f'\nHeating 100K -> {temp_target}K')
+    atoms.set_velocities(np.zeros_like(atoms.get_positions()))
+    for t in range(100, temp_target + 1, 50):
+        print(f' -> {t} K')
+        MaxwellBoltzmannDistribution(atoms, temperature_K=t, rng=rng)
+        Stationary(atoms)
+
+        # NVT heating (barostat off).
+        # 100fs coupling is safer for bonds.
+        NPT(atoms, timestep=1.0*units.fs, temperature_K=t, externalstress=0, pfactor=None, ttime=100*units.fs).run(500)
+
+
+def equilibrate(atoms, name, steps=STEPS_EQUIL, temp_target=TEMP_TARGET, version=VERSION, interval=INTERVAL,
+                converge=EQUIL_CONVERGE, min_steps=EQUIL_MIN_STEPS, integrator=INTEGRATOR, seed=None, integrator_kwargs=None):
+    print(f'\nNVT Equilibration ({f"{min_steps}-{steps} steps, until converged" if converge else f"{steps} steps"})')
+    dyn_equil = nvt(atoms, temp_target, integrator, seed=seed, **(integrator_kwargs or {}))
+    # Thermo goes to a ring-buffered log; only a throttled summary line is printed.
+    equil_thermo = ThermoRecorder(f'{name}_equil_thermo_{version}.csv', atoms, phase='Equil',
+                                  block_size=max(BLOCK_SIZE, WINDOW_STEPS // interval))
+    equil_thermo.attach(dyn_equil, interval=interval)
+    if converge:
+        run_until_converged(dyn_equil, equil_thermo, temp_target, interval, min_steps=min_steps, max_steps=steps,
+                            log_file=f'{name}_equil_convergence_{version}.json')
+    else:
+        dyn_equil.run(steps)
+    equil_thermo.close()
+    write(f'{name}_equilibrated_{version}.xyz', atoms)  # Checkpoint.
+
+
+def output_files(name, version=VERSION):
+    """Production file names for a run prefixed with name (the backend by default), shared with resume_interupted_prod_run.py."""
+    return {'traj': f'{name}_proton_sim_{version}.bin',
+            'thermo': f'{name}_thermo_{version}.csv',
+            'checkpoint': f'{name}_checkpoint_{version}',
+            'startup': f'{name}_startup_{version}.json',
+            'lmp_wrapped': f'{name}_proton_sim_{version}.lmp',
+            'lmp_unwrapped': f'{name}_analysis_unwrapped_{version}.lmp'}
+
+
+def setup_production(atoms, name, temp_target=TEMP_TARGET, version=VERSION, interval=INTERVAL, async_io=ASYNC_IO,
+                     integrator=INTEGRATOR, seed=None, integrator_kwargs=None):
+    """Production integrator with its trajectory, thermo and checkpoint observers attached.
+
+    Returns (dyn, trajectory writer, writers to close).
+    """
+    files = output_files(name, version)
+    dyn_prod = nvt(atoms, temp_target, integrator, seed=seed, **(integrator_kwargs or {}))
+    # Buffered binary trajectory (float32, file kept open). Convert with `python binary_traj.py traj.bin out.xyz` if extxyz is needed.
+    traj_writer = BinaryTrajectoryWriter(files['traj'], atoms)
+    # Observers only snapshot the arrays; formatting and disk writes happen on a background thread.
+    observers = AsyncObservers(atoms, policy='block', enabled=async_io)
+    observers.attach(dyn_prod, frame_writer(traj_writer), interval=interval)
+    thermo = ThermoRecorder(files['thermo'], atoms, phase='Prod')
+    thermo.attach(dyn_prod, interval=interval)
+    # Full-state checkpoints (atomic, last KEEP_LAST kept) for exact restarts with resume_interupted_prod_run.py.
+    checkpointer = Checkpointer(files['checkpoint'], atoms, dyn_prod, track_files=[traj_writer.filename, thermo.filename],
+                                flush=[observers, traj_writer, thermo])
+    checkpointer.attach()
+    return dyn_prod, traj_writer, [observers, traj_writer, thermo]
+
+
+def produce(atoms, name, steps=STEPS_PROD, temp_target=TEMP_TARGET, version=VERSION, interval=INTERVAL, async_io=ASYNC_IO,
+            profile=PROFILE, integrator=INTEGRATOR, seed=None, integrator_kwargs=None):
+    print(f'\nNVT Production ({steps} steps)')
+    dyn_prod, traj_writer, writers = setup_production(atoms, name, temp_target=temp_target, version=version, interval=interval,
+                                                      async_io=async_io, integrator=integrator, seed=seed,
+                                                      integrator_kwargs=integrator_kwargs)
+    if profile:
+        timers = instrument(dyn_prod, Timers())
+        profiler = SignalProfiler(f'{name}_profile_{version}')
+        profiler.attach(dyn_prod)
+        writers += [MetricsExporter(timers, [f'{name}_metrics_{version}.json', f'{name}_metrics_{version}.prom']), profiler]
+    t_start = time.perf_counter()
+    dyn_prod.run(steps)
+    for w in writers:
+        w.close()
+    print(f'Production wall time: {(time.perf_counter() - t_start) / steps * 1e3:.2f} ms/step (ASYNC_IO={async_io})')
+    return traj_writer.filename
+
+
+def run(backend, name=None, input_file=INPUT_FILE, steps_equil=STEPS_EQUIL, steps_prod=STEPS_PROD,
+        version=VERSION, interval=INTERVAL, async_io=ASYNC_IO, device=None,
+        accel=ACCELERATE, precision=None, compile=False, profile=PROFILE, equil_converge=EQUIL_CONVERGE,
+        equil_min_steps=EQUIL_MIN_STEPS, integrator=INTEGRATOR, prepared=False, seed=SEED):
+    """Full production protocol with one loaded model. Output files are prefixed with name (default: backend).
+
+    prepared: the input is already relaxed and has velocities (supercell.py), so minimisation and heating are skipped.
+    seed: one SeedSequence split into heating velocities, equilibration and production Langevin noise.
+    """
+    name = name or backend
+    seq = np.random.SeedSequence(seed)
+    print(f'Seed {seq.entropy} (--seed {seq.entropy} repeats the heating and Langevin noise)')
+    heat_seed, equil_seed, prod_seed = seq.spawn(3)
+    atoms = load_system(input_file)
+    atoms.calc, stats = measure_startup(backend, atoms, device)
+    with open(output_files(name, version)['startup'], 'w') as f:
+        json.dump(stats, f, indent=1)
+    if accel:
+        atoms.calc, _ = accelerate(backend, atoms, device=device, precision=precision, compile=compile)
+
+    if prepared:
+        print(f'\nPrepared start: keeping the input velocities ({atoms.get_temperature():.0f} K)')
+    else:
+        minimise(atoms)
+        heat(atoms, rng=np.random.default_rng(heat_seed))
+    integrator_kwargs = {}
+    if integrator == 'respa':
+        # One fast-bond fit for equilibration and production (a restart takes it from the checkpoint).
+        from respa import fit_current
+        integrator_kwargs['fast'] = fit_current(atoms)
+    equilibrate(atoms, name, steps=steps_equil, version=version, interval=interval, converge=equil_converge,
+                min_steps=equil_min_steps, integrator=integrator, seed=equil_seed, integrator_kwargs=integrator_kwargs)
+    traj_file = produce(atoms, name, steps=steps_prod, version=version, interval=interval, async_io=async_io, profile=profile,
+                        integrator=integrator, seed=prod_seed, integrator_kwargs=integrator_kwargs)
+
+    # NOTE: Need unwrapped coords in TRAVIS, so this is the actually import file:
+    print('Exporting UNWRAPPED coordinates for TRAVIS')
+    # Vectorised export in a process pool (`python lammps_export.py traj.bin out.lmp --wrapped` for wrapped coords).
+    lmp_file = output_files(name, version)['lmp_unwrapped']
+    export_lammps(traj_file, lmp_file, unwrapped=True)
+
+    print(f"\n\nSUCCESS. Saved to '{lmp_file}'")
+    print('(use this file for all Travis analyses.)')
+
+
+def startup_report(backends, input_file=INPUT_FILE, device=None):
+    """Startup time and peak memory per backend, each measured in a fresh process."""
+    results = []
+    for backend in backends:
+        cmd = [sys.executable, os.path.abspath(__file__), backend, '--startup-only', '--input', input_file]
+        if device:
+            cmd += ['--device', device]
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        lines = [l for l in proc.stdout.splitlines() if l.startswith('{')]
+        if proc.returncode != 0 or not lines:
+            err = (proc.stderr.strip().splitlines() or ['no output'])[-1]
+            print(f'{backend:>9}: failed ({err})')
+            continue
+        results.append(json.loads(lines[-1]))
+    print(f'\n{"backend":>9} {"torch import":>13} {"model load":>11} {"first call":>11} {"next call":>10} {"peak RSS":>10}')
+    for r in results:
+        print(f'{r["backend"]:>9} {r["torch_import_s"]:>11.2f} s {r["model_load_s"]:>9.2f} s {r["first_call_s"]:>9.2f} s '
+              f'{r["second_call_s"]:>8.3f} s {r["peak_rss_mb"]:>7.0f} MB')
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Production MD with any backend from calculators.py.')
+    parser.add_argument('backend', nargs='?', choices=sorted(BACKENDS))
+    parser.add_argument('--name', default=None, help='Output file prefix (default: backend).')
+    parser.add_argument('--input', default=INPUT_FILE)
+    parser.add_argument('--steps-equil', type=int, default=STEPS_EQUIL)
+    parser.add_argument('--equil-converge', action='store_true', help='Stop equilibration when converged (--steps-equil is the maximum).')
+    parser.add_argument('--equil-min-steps', type=int, default=EQUIL_MIN_STEPS)
+    parser.add_argument('--steps-prod', type=int, default=STEPS_PROD)
+    parser.add_argument('--version', default=VERSION)
+    parser.add_argument('--interval', type=int, default=INTERVAL)
+    parser.add_argument('--prepared', action='store_true', help='Input is relaxed with velocities (supercell.py): skip minimise/heat.')
+    parser.add_argument('--integrator', default=INTEGRATOR, choices=['npt', 'respa'] + sorted(INTEGRATORS))
+    parser.add_argument('--seed', type=int, default=SEED, help='Reproducible heating velocities and Langevin noise.')
+    parser.add_argument('--sync-io', action='store_true', help='Write frames inline instead of on a background thread.')
+    parser.add_argument('--device', default=None)
+    parser.add_argument('--profile', action='store_true', help='Live step-timing metrics; SIGUSR1 starts a cProfile window.')
+    parser.add_argument('--accelerate', action='store_true', help='Use inference.py speed-ups that pass the reference check.')
+    parser.add_argument('--precision', choices=['float32', 'float64'], default=None, help='With --accelerate.')
+    parser.add_argument('--compile', action='store_true', help='With --accelerate: torch.compile (cached on disk).')
+    parser.add_argument('--startup', nargs='+', metavar='BACKEND', help='Only report startup time/memory for these backends.')
+    parser.add_argument('--startup-only', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.startup:
+        startup_report(args.startup, input_file=args.input, device=args.device)
+    elif args.backend is None:
+        parser.error('Give a backend (or --startup BACKEND ...).')
+    elif args.startup_only:
+        _, stats = measure_startup(args.backend, load_system(args.input), args.device)
+        print(json.dumps(stats))
+    else:
+        run(args.backend, name=args.name, input_file=args.input, steps_equil=args.steps_equil,
+            steps_prod=args.steps_prod, version=args.version, interval=args.interval,
+            async_io=not args.sync_io, device=args.device,
+            accel=args.accelerate or ACCELERATE, precision=args.precision, compile=args.compile,
+            profile=args.profile or PROFILE, equil_converge=args.equil_converge or EQUIL_CONVERGE,
+            equil_min_steps=args.equil_min_steps, integrator=args.integrator, prepared=args.prepared, seed=args.seed)
@@ -0,0 +1,132 @@
+import time
+import numpy as np
+from ase.calculators.calculator import Calculator, all_changes
+from ase.data import covalent_radii
+from ase.neighborlist import neighbor_list
+
+from neighbour_list import VerletList
+
+
+# Cheap stand-in for the MLP calculators (CPU only, no torch).
+#
+# A Morse pair potential between all atoms within CUTOFF, with the minimum at
+# the sum of covalent radii (so O-H, C-H, N-H, ... bonds stay roughly intact)
+# and a cosine cutoff so energy and forces go smoothly to zero. Energy is
+# conserved, so it is good enough to exercise the MD drivers, integrators and
+# I/O without a GPU. `delay` adds a fixed sleep per call to mimic the latency of
+# a model forward pass when timing everything around it. `skin` switches the
+# per-call neighbour search to a Verlet list (neighbour_list.py).
+CUTOFF = 4.0    # NOTE: A.
+DEPTH = 0.1     # NOTE: Morse well depth in eV.
+ALPHA = 1.5     # NOTE: Morse width in 1/A.
+
+
+def morse_pairs(numbers, d, depth=DEPTH, alpha=ALPHA, cutoff=CUTOFF, i=None, j=None):
+    """Pair energies and dE/dr for distances d between atoms i and j."""
+    r0 = covalent_radii[numbers[i]] + covalent_radii[numbers[j]]
+    x = np.exp(-alpha * (d - r0))
+    v = depth * (x * x - 2 * x)
+    dv = depth * (-2 * alpha * x * x + 2 * alpha * x)
+    fc = 0.5 * (1 + np.cos(np.pi * d / cutoff))
+    dfc = -0.5 * np.pi / cutoff * np.sin(np.pi * d / cutoff)
+    return v * fc, dv * fc + v * dfc
+
+
+def batch_results(atoms_list, cutoff=CUTOFF, depth=DEPTH, alpha=ALPHA, nlists=None):
+    """Energy, forces and stress (Voigt) for several systems evaluated as one disjoint graph.
+
+    The neighbour lists of all systems are concatenated (atom indices offset)
+    and the pair terms are computed in one pass, then split back per system.
+    nlists: optional VerletList per system (None = ASE neighbor_list every call).
+    """
+    sizes = np.array([len(a) for a in atoms_list])
+    offsets = np.cumsum(sizes) - sizes
+    numbers = np.concatenate([a.get_atomic_numbers() for a in atoms_list])
+    nlists = nlists or [None] * len(atoms_list)
+    lists = [nl.neighbor_list('ijdD', a) if nl else neighbor_list('ijdD', a, cutoff) for a, nl in zip(atoms_list, nlists)]
+    i = np.concatenate([l[0] + off for l, off in zip(lists, offsets)])
+    j = np.concatenate([l[1] + off for l, off in zip(lists, offsets)])
+    d = np.concatenate([l[2] for l in lists])
+    D = np.concatenate([l[3] for l in lists])
+    graph = np.repeat(np.arange(len(atoms_list)), [len(l[0]) for l in lists])
+
+    e, de = morse_pairs(numbers, d, depth, alpha, cutoff, i=i, j=j)
+    # Full lists: every pair appears twice.
+    energies = 0.5 * np.bincount(graph, weights=e, minlength=len(atoms_list))
+    f_pair = (de / d)[:, None] * D     # dE/dr_j for the j end of each pair.
+    forces = np.stack([np.bincount(i, weights=f_pair[:, k], minlength=len(numbers)) for k in range(3)], axis=1)
+    outer = (f_pair[:, :, None] * D[:, None, :]).reshape(-1, 9)
+    virials = -0.5 * np.stack([np.bincount(graph, weights=outer[:, k], minlength=len(atoms_list))
+                               for k in range(9)], axis=1).reshape(-1, 3, 3)
+    # Per-atom split: half of each pair term to each end (what a local model's atomic energies are).
+    atom_energies = 0.5 * np.bincount(i, weights=e, minlength=len(numbers))
+    voigt = [0, 4, 8, 5, 2, 1]
+    atom_virials = -0.5 * np.stack([np.bincount(i, weights=outer[:, k], minlength=len(numbers)) for k in voigt], axis=1)
+
+    results = []
+    for k, atoms in enumerate(atoms_list):
+        own = slice(offsets[k], offsets[k] + sizes[k])
+        volume = atoms.get_volume() if atoms.cell.rank == 3 else None
+        stress = (-virials[k] / volume).flat[voigt] if volume else np.zeros(6)
+        results.append({'energy': energies[k], 'free_energy': energies[k], 'energies': atom_energies[own],
+                        'forces': forces[own], 'stress': stress,
+                        'stresses': -atom_virials[own] / volume if volume else np.zeros((sizes[k], 6))})
+    return results
+
+
+class MockCalculator(Calculator):
+    """Morse pair potential with a smooth cutoff (energy, forces, stress, and per-atom energies/stresses)."""
+
+    implemented_properties = ['energy', 'free_energy', 'energies', 'forces', 'stress', 'stresses']
+
+    def __init__(self, cutoff=CUTOFF, depth=DEPTH, alpha=ALPHA, delay=0.0, skin=None, **kwargs):
+        super().__init__(**kwargs)
+        self.cutoff = cutoff
+        self.depth = depth
+        self.alpha = alpha
+        self.delay = delay
+        self.nlist = VerletList(cutoff, skin) if skin else None
+        self.calls = 0
+
+    def calculate(self, atoms=None, properties=('energy',), system_changes=all_changes):
+        super().calculate(atoms, properties, system_changes)
+        self.calls += 1
+        self.results.update(batch_results([self.atoms], self.cutoff, self.depth, self.alpha, [self.nlist])[0])
+        if self.delay:
+            time.sleep(self.delay)
+
+
+class MockBatchedCalculator:
+    """Batched counterpart of MockCalculator: compute(list of Atoms) -> list of result dicts.
+
+    All systems go through one batch_results() pass and `delay` is paid once
+    per batch, like one forward pass over a batched graph.
+    """
+
+    def __init__(self, cutoff=CUTOFF, depth=DEPTH, alpha=ALPHA, delay=0.0, skin=None):
+        self.cutoff = cutoff
+        self.depth = depth
+        self.alpha = alpha
+        self.delay = delay
+        self.skin = skin
+        self.nlists = []   # One VerletList per batch slot (replica k is always slot k).
+        self.calls = 0
+
+    def compute(self, atoms_list):
+        self.calls += 1
+        if self.skin:
+            self.nlists += [VerletList(self.cutoff, self.skin) for _ in range(len(atoms_list) - len(self.nlists))]
+        results = batch_results(atoms_list, self.cutoff, self.depth, self.alpha, self.nlists if self.skin else None)
+        if self.delay:
+            time.sleep(self.delay)
+        return results
+
+
+class ZeroCalculator(Calculator):
+    """Zero energy, forces and stress at no cost, to time everything except the model."""
+
+    implemented_properties = ['energy', 'free_energy', 'forces', 'stress']
+
+    def calculate(self, atoms=None, properties=('energy',), system_changes=all_changes):
+        super().calculate(atoms, properties, system_changes)
+        self.results = {'energy': 0.0, 'free_energy': 0.0, 'forces': np.zeros((len(self.atoms), 3)), 'stress': np.zeros(6)}
@@ -0,0 +1,190 @@
+import argparse, itertools, time
+import numpy as np
+from ase.io import read
+from ase.neighborlist import neighbor_list as ase_neighbor_list
+
+
+# Verlet-skin neighbour list on a cell list.
+#
+# Candidate pairs are found once within cutoff + skin and reused until some
+# atom has moved more than skin/2 since the last build (then no pair can have
+# crossed the cutoff unnoticed). In between, only the distances of the stored
+# candidates are recomputed. With ~0.01 A/fs displacements and a 1 A skin that
+# is one build every few tens of steps instead of one per step.
+#
+# The build bins atoms into cells at least cutoff + skin wide (in fractional
+# coordinates, so triclinic boxes work) and only looks at the 27 neighbouring
+# cells. Boxes narrower than 3 cells along an axis, or not fully periodic, fall
+# back to ASE's neighbor_list for the build. Positions may be wrapped between
+# builds: displacements are taken with the minimum image. A changed cell (NPT
+# with the barostat on) forces a rebuild.
+#
+# VerletList.neighbor_list(quantities, atoms) returns the same full i/j/d/D/S
+# lists as ase.neighborlist.neighbor_list, so calculators that accept edges
+# (mock_calculator.py) and analysis code can use either.
+SKIN = 1.0   # NOTE: A. Larger = fewer rebuilds but more candidate pairs per step.
+
+
+def cell_list_pairs(positions, cell, cutoff):
+    """Full pair list (i, j, S) within cutoff for a periodic cell, plus the wrapped positions it refers to.
+
+    Returns None if the box is narrower than 3 cells of width cutoff along an axis.
+    """
+    cell = np.asarray(cell, dtype=float)
+    inv = np.linalg.inv(cell)
+    frac = positions @ inv
+    frac -= np.floor(frac)
+    widths = 1 / np.linalg.norm(inv, axis=0)   # Spacing of the lattice planes.
+    n = np.floor(widths / cutoff).astype(int)
+    if (n < 3).any():
+        return None
+    wrapped = frac @ cell
+
+    # Atoms sorted into a padded (cells, max occupancy) table, -1 = empty.
+    bins = np.minimum((frac * n).astype(int), n - 1)
+    c = np.ravel_multi_index(bins.T, n)
+    ncells = int(np.prod(n))
+    order = np.argsort(c, kind='stable')
+    counts = np.bincount(c, minlength=ncells)
+    slot = np.arange(len(c)) - (np.cumsum(counts) - counts)[c[order]]
+    table = np.full((ncells, counts.max()), -1)
+    table[c[order], slot] = order
+    home = np.array(np.unravel_index(np.arange(ncells), n)).T
+
+    i_all, j_all, s_all = [], [], []
+    for off in itertools.product((-1, 0, 1), repeat=3):
+        nb = home + off
+        shift = nb // n                        # Image of the neighbouring cell (-1, 0, 1 per axis).
+        a = table[:, :, None]
+        b = table[np.ravel_multi_index((nb % n).T, n)][:, None, :]
+        cells, ia, jb = np.nonzero((a >= 0) & (b >= 0))
+        i, j = table[cells, ia], table[np.ravel_multi_index((nb[cells] % n).T, n), jb]
+        S = shift[cells]
+        D = wrapped[j] + S @ cell - wrapped[i]
+        keep = (np.einsum('ij,ij->i', D, D) < cutoff * cutoff) & ((i != j) | S.any(axis=1))
+        i_all.append(i[keep])
+        j_all.append(j[keep])
+        s_all.append(S[keep])
+    i, j, S = np.concatenate(i_all), np.concatenate(j_all), np.concatenate(s_all)
+    order = np.lexsort((j, i))
+    return i[order], j[order], S[order], wrapped
+
+
+class VerletList:
+    """Neighbour list within cutoff, rebuilt (within cutoff + skin) only when an atom moves more than skin/2."""
+
+    def __init__(self, cutoff, skin=SKIN):
+        self.cutoff = cutoff
+        self.skin = skin
+        self.builds = 0
+        self.calls = 0
+        self.build_time = 0.0
+        self.query_time = 0.0
+        self.cell = None
+
+    def _build(self, atoms):
+        t0 = time.perf_counter()
+        rc = self.cutoff + self.skin
+        pairs = cell_list_pairs(atoms.positions, atoms.cell, rc) if atoms.pbc.all() else None
+        if pairs is None:
+            i, j, S = ase_neighbor_list('ijS', atoms, rc)
+            ref = atoms.positions.copy()
+        else:
+            i, j, S, ref = pairs
+        self.i, self.j, self.S, self.ref = i, j, S, ref
+        self.positions = atoms.positions.copy()
+        self.cell = atoms.cell.array.copy()
+        self.pbc = atoms.pbc.copy()
+        self.builds += 1
+        self.build_time += time.perf_counter() - t0
+
+    def _displacements(self, atoms):
+        """Displacements since the last build, minimum image along periodic axes."""
+        d = atoms.positions - self.positions
+        if self.pbc.any():
+            frac = d @ np.linalg.inv(self.cell)
+            frac[:, self.pbc] -= np.round(frac[:, self.pbc])
+            d = frac @ self.cell
+        return d
+
+    def update(self, atoms):
+        """Rebuild if needed. Returns True if the list was rebuilt."""
+        if (self.cell is None or len(atoms) != len(self.positions) or (atoms.pbc != self.pbc).any()
+                or not np.allclose(atoms.cell.array, self.cell)):
+            self._build(atoms)
+            return True
+        d = self._displacements(atoms)
+        if np.einsum('ij,ij->i', d, d).max() > (0.5 * self.skin) ** 2:
+            self._build(atoms)
+            return True
+        return False
+
+    def neighbor_list(self, quantities, atoms):
+        """Same as ase.neighborlist.neighbor_list(quantities, atoms, cutoff) for 'i', 'j', 'd', 'D' and 'S'."""
+        self.calls += 1
+        self.update(atoms)
+        t0 = time.perf_counter()
+        pos = self.ref + self._displacements(atoms)
+        D = pos[self.j] + self.S @ self.cell - pos[self.i]
+        d = np.sqrt(np.einsum('ij,ij->i', D, D))
+        keep = d < self.cutoff
+        i, j, S = self.i[keep], self.j[keep], self.S[keep]
+        values = {'i': i, 'j': j, 'd': d[keep], 'D': D[keep], 'S': S}
+        if 'S' in quantities and self.pbc.any():
+            # Shifts are stored for the wrapped build positions; re-express them for atoms.positions as given.
+            k = np.round((pos - atoms.positions) @ np.linalg.inv(self.cell)).astype(int)
+            values['S'] = S + k[j] - k[i]
+        self.query_time += time.perf_counter() - t0
+        return tuple(values[q] for q in quantities)
+
+    def report(self):
+        """Rebuilds and estimated neighbour-search time saved, per 1000 calls, against a full build every call."""
+        if not self.calls:
+            return {}
+        per_build = self.build_time / self.builds
+        saved = self.calls * per_build - self.build_time - self.query_time
+        stats = {'calls': self.calls, 'builds': self.builds, 'builds_per_1000': 1000 * self.builds / self.calls,
+                 'build_ms': per_build * 1e3, 'query_ms': self.query_time / self.calls * 1e3,
+                 'saved_s_per_1000': 1000 * saved / self.calls}
+        print(f'Neighbour list (cutoff {self.cutoff} A, skin {self.skin} A): {stats["builds_per_1000"]:.0f} rebuilds '
+              f'per 1000 steps, build {stats["build_ms"]:.1f} ms, query {stats["query_ms"]:.1f} ms, '
+              f'~{stats["saved_s_per_1000"]:.1f} s saved per 1000 steps')
+        return stats
+
+
+if __name__ == '__main__':
+    from ase import units
+    from ase.md.npt import NPT
+    from ase.md.velocitydistribution import MaxwellBoltzmannDistribution, Stationary
+    from mock_calculator import CUTOFF, MockCalculator
+
+    parser = argparse.ArgumentParser(description='Check the Verlet list against ASE and time it in mock NVT.')
+    parser.add_argument('input', help='Periodic structure (.xyz with a cell).')
+    parser.add_argument('--cutoff', type=float, default=CUTOFF)
+    parser.add_argument('--skin', type=float, default=SKIN)
+    parser.add_argument('--steps', type=int, default=1000)
+    parser.add_argument('--temperature', type=float, default=330)
+    args = parser.parse_args()
+
+    atoms = read(args.input)
+    atoms.set_pbc(True)
+    ref = ase_neighbor_list('ijS', atoms, args.cutoff)
+    t0 = time.perf_counter()
+    ase_neighbor_list('ijdD', atoms, args.cutoff)
+    t_ase = time.perf_counter() - t0
+    new = VerletList(args.cutoff, args.skin).neighbor_list('ijS', atoms)
+    same = (sorted(zip(*ref[:2], map(tuple, ref[2]))) == sorted(zip(*new[:2], map(tuple, new[2]))))
+    print(f'{len(ref[0])} pairs, identical to ASE: {same}. ASE neighbor_list: {t_ase * 1e3:.1f} ms per call')
+
+    for skin in (None, args.skin):
+        run = atoms.copy()
+        MaxwellBoltzmannDistribution(run, temperature_K=args.temperature, rng=np.random.default_rng(0))
+        Stationary(run)
+        run.calc = MockCalculator(cutoff=args.cutoff, skin=skin)
+        t0 = time.perf_counter()
+        NPT(run, timestep=1.0*units.fs, temperature_K=args.temperature, externalstress=0, pfactor=None,
+            ttime=100*units.fs).run(args.steps)
+        wall = time.perf_counter() - t0
+        print(f'skin={skin}: {wall / args.steps * 1e3:.1f} ms/step over {args.steps} steps')
+        if skin:
+            run.calc.nlist.report()
@@ -0,0 +1,210 @@
+import cProfile, collections, io, json, os, pstats, signal, threading, time
+import numpy as np
+
+
+# Timers for where an MD step's time goes.
+#
+# instrument(dyn, timers) wraps the calculator's calculate() ('forces') and
+# every observer already attached to dyn (frame writes, thermo/status, check-
+# points), each under its own name. Frame-write handlers queued on an
+# AsyncObservers thread are timed separately as 'io: <handler>': with async
+# I/O that time overlaps the next steps instead of adding to them. Whatever is
+# left of the wall time is the integrator itself.
+#
+# For live runs, MetricsExporter rewrites a JSON and/or Prometheus-text file
+# every EXPORT_EVERY seconds with counts, totals and rolling percentiles over
+# the last WINDOW calls of each timer (tail it, or point node_exporter's
+# textfile collector at the .prom). SignalProfiler runs cProfile on the MD loop
+# for PROFILE_SECONDS when the process gets SIGUSR1 (`kill -USR1 <pid>`) and
+# dumps '<prefix>_<time>.pstats' plus a text summary of the top functions.
+WINDOW = 1000          # NOTE: Calls per timer kept for the rolling percentiles.
+PERCENTILES = (50, 90, 99)
+EXPORT_EVERY = 30.0    # NOTE: Seconds between metric file rewrites.
+PROFILE_SECONDS = 30.0 # NOTE: Length of a signal-triggered cProfile window.
+PROFILE_SIGNAL = signal.SIGUSR1
+
+
+class Timers:
+    """Call counts, total seconds and the last WINDOW durations per name (thread-safe)."""
+
+    def __init__(self, window=WINDOW):
+        self.stats = {}
+        self.recent = {}
+        self.window = window
+        self.lock = threading.Lock()
+
+    def add(self, name, dt):
+        with self.lock:
+            s = self.stats.setdefault(name, [0, 0.0])
+            s[0] += 1
+            s[1] += dt
+            if name not in self.recent:
+                self.recent[name] = collections.deque(maxlen=self.window)
+            self.recent[name].append(dt)
+
+    def wrap(self, name, fn):
+        """fn, timed under name."""
+        def timed(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(name, time.perf_counter() - t0)
+        return timed
+
+    def total(self, prefix=''):
+        return sum(s[1] for name, s in self.stats.items() if name.startswith(prefix))
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+            self.recent.clear()
+
+    def summary(self, percentiles=PERCENTILES):
+        """{name: {'count', 'total_s', 'p50_s', ..., 'max_s'}} with percentiles over the rolling window."""
+        with self.lock:
+            items = [(name, s[0], s[1], np.array(self.recent[name])) for name, s in self.stats.items()]
+        out = {}
+        for name, count, total, recent in items:
+            row = {'count': count, 'total_s': total}
+            row.update({f'p{q}_s': float(v) for q, v in zip(percentiles, np.percentile(recent, percentiles))})
+            row['max_s'] = float(recent.max())
+            out[name] = row
+        return out
+
+
+def _short_name(fn):
+    """'frame_writer' for frame_writer.<locals>.handler, 'ThermoRecorder' for a bound method, etc."""
+    owner = getattr(fn, '__self__', None)
+    if owner is not None:
+        return type(owner).__name__
+    return getattr(fn, '__qualname__', repr(fn)).split('.')[0]
+
+
+def observer_name(function, args):
+    """Readable name of an ASE observer entry (AsyncObservers entries are named after their handler)."""
+    name = _short_name(function)
+    handler = next((a for a in args if callable(a)), None)
+    return f'{name}({_short_name(handler)})' if name == 'AsyncObservers' and handler else name
+
+
+def instrument(dyn, timers, calc=True):
+    """Time dyn's calculator and its currently attached observers (call after the last dyn.attach)."""
+    if calc and dyn.atoms.calc is not None:
+        c = dyn.atoms.calc
+        # From the class method, so instrumenting a reused calculator again replaces the old timer.
+        c.calculate = timers.wrap('forces', type(c).calculate.__get__(c))
+    for k, (function, interval, args, kwargs) in enumerate(dyn.observers):
+        name = observer_name(function, args)
+        if _short_name(function) == 'AsyncObservers':
+            args = tuple(timers.wrap(f'io: {_short_name(a)}', a) if callable(a) else a for a in args)
+        dyn.observers[k] = (timers.wrap(f'observer: {name}', function), interval, args, kwargs)
+    return timers
+
+
+def prometheus_text(summary, prefix='md'):
+    """Prometheus text exposition of Timers.summary() (one summary metric, labelled by timer name)."""
+    lines = [f'# HELP {prefix}_timer_seconds Time per call of MD step components.', f'# TYPE {prefix}_timer_seconds summary']
+    for name, row in summary.items():
+        label = name.replace('\\', '\\\\').replace('"', '\\"')
+        for key, value in row.items():
+            if key.startswith('p') and key.endswith('_s'):
+                lines.append(f'{prefix}_timer_seconds{{name="{label}",quantile="{int(key[1:-2]) / 100:g}"}} {value:.9g}')
+        lines.append(f'{prefix}_timer_seconds_sum{{name="{label}"}} {row["total_s"]:.9g}')
+        lines.append(f'{prefix}_timer_seconds_count{{name="{label}"}} {row["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def _atomic_write(filename, text):
+    tmp = f'{filename}.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, filename)
+
+
+class MetricsExporter:
+    """Rewrites metric files (.prom = Prometheus text, anything else = JSON) every `every` seconds on a thread."""
+
+    def __init__(self, timers, filenames, every=EXPORT_EVERY):
+        self.timers = timers
+        self.filenames = [filenames] if isinstance(filenames, str) else list(filenames)
+        self.every = every
+        self.started = time.time()
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self._loop, name='metrics-exporter', daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        while not self._stop.wait(self.every):
+            self.write()
+
+    def write(self):
+        summary = self.timers.summary()
+        for filename in self.filenames:
+            if filename.endswith('.prom'):
+                _atomic_write(filename, prometheus_text(summary))
+            else:
+                _atomic_write(filename, json.dumps({'time': time.time(), 'uptime_s': time.time() - self.started,
+                                                    'timers': summary}, indent=1))
+
+    def flush(self):
+        self.write()
+
+    def close(self):
+        if not self._stop.is_set():
+            self._stop.set()
+            self.thread.join()
+            self.write()
+
+
+class SignalProfiler:
+    """cProfile window of `duration` seconds on the MD loop, started by a signal.
+
+    The signal handler only sets a flag; profiling starts and stops in an
+    observer on the dynamics (every step), i.e. on the thread running the MD loop.
+    """
+
+    def __init__(self, prefix, duration=PROFILE_SECONDS, signum=PROFILE_SIGNAL, top=30):
+        self.prefix = prefix
+        self.duration = duration
+        self.top = top
+        self.requested = False
+        self.profile = None
+        self.signum = signum
+        self.previous = signal.signal(signum, self._request)
+
+    def _request(self, signum, frame):
+        self.requested = True
+
+    def attach(self, dyn):
+        dyn.attach(self.check, 1)
+
+    def check(self):
+        if self.profile is None and self.requested:
+            self.requested = False
+            print(f'cProfile window started ({self.duration:g} s).')
+            self.t_start = time.perf_counter()
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        elif self.profile is not None and time.perf_counter() - self.t_start >= self.duration:
+            self.stop()
+
+    def stop(self):
+        if self.profile is None:
+            return
+        self.profile.disable()
+        stem = f'{self.prefix}_{time.strftime("%Y%m%d-%H%M%S")}'
+        self.profile.dump_stats(f'{stem}.pstats')
+        out = io.StringIO()
+        pstats.Stats(self.profile, stream=out).sort_stats('cumulative').print_stats(self.top)
+        with open(f'{stem}.txt', 'w') as f:
+            f.write(out.getvalue())
+        self.profile = None
+        print(f'cProfile window written to {stem}.pstats / {stem}.txt')
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.stop()
+        signal.signal(self.signum, self.previous)
@@ -0,0 +1,255 @@
+import argparse, itertools, os, time
+import numpy as np
+from multiprocessing import Pool
+from ase import Atoms
+
+from respa import bonded_pairs
+from traj_convert import CHUNK_FRAMES, available_cpus
+from traj_readers import open_frames
+
+
+# Streaming radial distribution functions, in the TRAVIS CSV layout.
+#
+# Reads the .xyz (indexed), .bin/.zbin or LAMMPS (.lmp) trajectories directly,
+# frame by frame, so no .lmp export or TRAVIS run is needed. Frames are split
+# into chunks of CHUNK_FRAMES and histogrammed in a process pool; the main
+# process only adds up the per-chunk histograms. Every pair is computed from
+# the same read of each frame.
+#
+# Atoms are selected as 'ELEMENT@context', '*@context' or 'ELEMENT'. The
+# context comes from the covalent bonds to C and N in the first frame (these
+# do not break, unlike the O-H/N-H bonds the protons hop between):
+#   imidazole   N, C bonded to N and their C-H hydrogens
+#   acetic      C not bonded to N, O bonded to C and the methyl hydrogens
+#   water       O not bonded to C
+#   labile      H not bonded to C (the protons; TRAVIS "H" after breaking the O-H/N-H bonds)
+# PAIRS reproduces the stored TRAVIS analyses: rdf_H_O_[H1r_O1o] is H@labile
+# with O@water, and rdf_H_C2H3O2_[H1r_CHOo] counts all atoms of the acid
+# skeleton (*@acetic).
+#
+# Distances come from a cell list of the observed atoms (cells >= RMAX, only
+# the 27 around each reference cell), or all minimum-image pairs when fewer
+# than MIN_CELLS cells fit along a side (the 37.2 A box at RMAX). g(r) is
+# normalised as in TRAVIS: counts / (frames x N_ref x N_obs / V x shell
+# volume), and the integral is the running coordination number sum(g x N_obs /
+# V x shell volume). Written as '# Distance / pm;  g(r);  Integral' CSVs that
+# visualise_rdf.py plots as is.
+#
+#   python rdf.py orb_proton_sim__2mill_interval_10.bin                  (the PAIRS files)
+#   python rdf.py traj.lmp --pair H@labile N@imidazole --rmax 800 --bins 800
+#   python rdf.py traj.bin --compare orb/results/05.02_200ksteps_interval10_rdf
+RMAX = 1200.0    # NOTE: pm, as in the TRAVIS runs.
+BINS = 1200
+STRIDE = 1
+MIN_CELLS = 5    # NOTE: with fewer cells per side the 27 neighbour cells are most of the box.
+# Output file (TRAVIS name) -> (reference, observed).
+PAIRS = {
+    'rdf_H_O_[H1r_O1o]': ('H@labile', 'O@water'),
+    'rdf_H_C2H3O2_[H1r_CHOo]': ('H@labile', '*@acetic'),
+    'rdf_H_C3H3N2_[H1r_CHNo]': ('H@labile', '*@imidazole'),
+}
+CONTEXTS = ('imidazole', 'acetic', 'water', 'labile')
+CSV_HEADER = '# Distance / pm;  g(r);  Integral'
+CSV_ROW = '%#.10g;  %#.10g;  %#.10g'
+
+_frames = None
+_selections = None
+_edges = None
+
+
+def contexts(symbols, cell, positions):
+    """Molecular context per atom (see CONTEXTS), from the covalent bonds to C and N. Other atoms get ''."""
+    symbols = np.asarray(symbols)
+    i, j, _, _ = bonded_pairs(Atoms(symbols=symbols, positions=positions, cell=cell, pbc=True))
+    i, j = np.concatenate([i, j]), np.concatenate([j, i])    # Both directions.
+    ctx = np.full(len(symbols), '', dtype='<U9')
+    ctx[symbols == 'N'] = 'imidazole'
+    carbon = symbols == 'C'
+    ctx[carbon] = 'acetic'
+    ctx[i[carbon[i] & (symbols[j] == 'N')]] = 'imidazole'
+    oxygen = symbols == 'O'
+    ctx[oxygen] = 'water'
+    ctx[i[oxygen[i] & carbon[j]]] = 'acetic'
+    hydrogen = symbols == 'H'
+    ctx[hydrogen] = 'labile'
+    ch = hydrogen[i] & carbon[j]
+    ctx[i[ch]] = ctx[j[ch]]
+    return ctx
+
+
+def select(spec, symbols, ctx):
+    """Indices of the atoms matching 'ELEMENT', 'ELEMENT@context' or '*@context'."""
+    element, _, context = spec.partition('@')
+    if context and context not in CONTEXTS:
+        raise ValueError(f'Unknown context {context!r} in {spec!r} (known: {CONTEXTS}).')
+    mask = np.ones(len(symbols), dtype=bool) if element == '*' else np.asarray(symbols) == element
+    if context:
+        mask &= ctx == context
+    if not mask.any():
+        raise ValueError(f'No atoms match {spec!r}.')
+    return np.flatnonzero(mask)
+
+
+def _cell_table(frac, n):
+    """Atom indices per cell, padded with -1: (cells, max occupancy)."""
+    c = np.ravel_multi_index(np.minimum((frac * n).astype(int), n - 1).T, n)
+    order = np.argsort(c, kind='stable')
+    counts = np.bincount(c, minlength=int(np.prod(n)))
+    slot = np.arange(len(c)) - (np.cumsum(counts) - counts)[c[order]]
+    table = np.full((len(counts), max(counts.max(), 1)), -1)
+    table[c[order], slot] = order
+    return table
+
+
+def pair_distances(cell, pos_a, pos_b, rmax, idx_a, idx_b):
+    """Distances < rmax between atoms a and b (all periodic images), the same atom (idx_a == idx_b) excluded."""
+    inv = np.linalg.inv(cell)
+    frac_a, frac_b = pos_a @ inv, pos_b @ inv
+    frac_a -= np.floor(frac_a)
+    frac_b -= np.floor(frac_b)
+    widths = 1 / np.linalg.norm(inv, axis=0)
+    n = np.floor(widths / rmax).astype(int)
+    out = []
+    if (n < MIN_CELLS).any():
+        # Few cells: all minimum-image pairs (rmax <= half the plane spacing, checked in rdf()).
+        for start in range(0, len(frac_a), 128):
+            d = frac_b[None, :, :] - frac_a[start:start + 128, None, :]
+            d -= np.round(d)
+            d = d @ cell
+            d2 = np.einsum('ijk,ijk->ij', d, d)
+            keep = (d2 < rmax * rmax) & (idx_a[start:start + 128, None] != idx_b[None, :])
+            out.append(np.sqrt(d2[keep]))
+        return np.concatenate(out)
+    wa, wb = frac_a @ cell, frac_b @ cell
+    ta, tb = _cell_table(frac_a, n), _cell_table(frac_b, n)
+    home = np.array(np.unravel_index(np.arange(len(ta)), n)).T
+    for off in itertools.product((-1, 0, 1), repeat=3):
+        nb = home + off
+        shift = (nb // n) @ cell
+        b = tb[np.ravel_multi_index((nb % n).T, n)]
+        cells, ia, jb = np.nonzero((ta[:, :, None] >= 0) & (b[:, None, :] >= 0))
+        i, j = ta[cells, ia], b[cells, jb]
+        D = wb[j] + shift[cells] - wa[i]
+        d = np.sqrt(np.einsum('ij,ij->i', D, D))
+        keep = (d < rmax) & ((idx_a[i] != idx_b[j]) | (nb[cells] // n).any(axis=1))
+        out.append(d[keep])
+    return np.concatenate(out)
+
+
+def _init_worker(frames, selections, edges):
+    global _frames, _selections, _edges
+    _frames, _selections, _edges = frames, selections, edges
+
+
+def _rdf_chunk(indices):
+    """Histograms (pairs, bins) and sum of N_ref x N_obs / V over the frames in indices."""
+    nbins = len(_edges) - 1
+    rmax, dr = _edges[-1], _edges[1] - _edges[0]
+    hist = np.zeros((len(_selections), nbins), dtype=np.int64)
+    norm = np.zeros(len(_selections))
+    for k in indices:
+        cell, positions = _frames.frame(k)
+        volume = abs(np.linalg.det(cell))
+        for p, (a, b) in enumerate(_selections):
+            d = pair_distances(cell, positions[a], positions[b], rmax, a, b)
+            hist[p] += np.bincount(np.minimum((d / dr).astype(int), nbins - 1), minlength=nbins)
+            norm[p] += len(a) * len(b) / volume
+    return hist, norm, len(indices)
+
+
+def rdf(traj_file, pairs=PAIRS, rmax=RMAX, bins=BINS, stride=STRIDE, workers=None, chunk_frames=CHUNK_FRAMES):
+    """g(r) for each {name: (reference, observed)} over the trajectory. Returns {name: (r / pm, g, integral)}."""
+    t_start = time.perf_counter()
+    frames = open_frames(traj_file)
+    cell, positions = frames.frame(0)
+    if rmax / 100 > 0.5 / np.linalg.norm(np.linalg.inv(cell), axis=0).max():
+        raise ValueError(f'rmax {rmax} pm is more than half the smallest cell width.')
+    ctx = contexts(frames.symbols, cell, positions)
+    selections = [(select(ref, frames.symbols, ctx), select(obs, frames.symbols, ctx)) for ref, obs in pairs.values()]
+    for name, (a, b) in zip(pairs, selections):
+        print(f'{name}: {len(a)} reference x {len(b)} observed atoms')
+    edges = np.linspace(0, rmax / 100, bins + 1)      # A
+    ks = np.arange(0, len(frames), stride)
+    tasks = [ks[start:start + chunk_frames] for start in range(0, len(ks), chunk_frames)]
+    workers = workers or available_cpus()
+
+    hist = np.zeros((len(pairs), bins), dtype=np.int64)
+    norm = np.zeros(len(pairs))
+    done = 0
+    with Pool(workers, initializer=_init_worker, initargs=(frames, selections, edges)) as pool:
+        for h, n, count in pool.imap_unordered(_rdf_chunk, tasks):
+            hist += h
+            norm += n
+            done += count
+            print(f'RDF: {done}/{len(ks)} frames...', end='\r')
+    elapsed = time.perf_counter() - t_start
+    print(f'\nRDF: {done} frames in {elapsed:.1f} s ({done / elapsed:.1f} frames/s with {workers} workers)')
+
+    shell = 4 / 3 * np.pi * (edges[1:] ** 3 - edges[:-1] ** 3)
+    r = 50 * (edges[1:] + edges[:-1])                 # Bin centres in pm.
+    results = {}
+    for p, (name, (a, b)) in enumerate(zip(pairs, selections)):
+        g = hist[p] / (norm[p] * shell)
+        rho = norm[p] / (done * len(a))               # Mean N_obs / V.
+        results[name] = (r, g, np.cumsum(g * rho * shell))
+    return results
+
+
+def write_csv(filename, r, g, integral):
+    """TRAVIS RDF layout."""
+    with open(filename, 'w') as f:
+        f.write(CSV_HEADER + '\n')
+        f.writelines(CSV_ROW % row + '\n' for row in zip(r, g, integral))
+
+
+def read_csv(filename):
+    """(r / pm, g, integral) from a TRAVIS (or write_csv) RDF file."""
+    r, g, integral = np.loadtxt(filename, delimiter=';', comments='#', unpack=True)
+    return r, g, integral
+
+
+def first_shell(r, g, integral):
+    """First maximum (r, g) and the first minimum after it (r, g, coordination number)."""
+    k = np.argmax(g)
+    m = k + np.argmin(g[k:k + np.searchsorted(r[k:], r[k] + 200)])   # Within 200 pm of the maximum.
+    return r[k], g[k], r[m], g[m], integral[m]
+
+
+def compare(results, reference_dir):
+    """Peak positions/heights, coordination numbers and max |delta g| against stored TRAVIS CSVs of the same name."""
+    print(f'\n{"RDF":<28} {"max r/pm":>9} {"g_max":>7} {"min r/pm":>9} {"CN":>7}   {"max |dg|":>9}')
+    for name, (r, g, integral) in results.items():
+        path = os.path.join(reference_dir, f'{name}.csv')
+        if not os.path.exists(path):
+            print(f'{name:<28} (no {path})')
+            continue
+        ref = read_csv(path)
+        ours = first_shell(r, g, integral)
+        theirs = first_shell(*ref)
+        dg = np.abs(np.interp(ref[0], r, g) - ref[1]).max()
+        for label, (rmx, gmx, rmn, _, cn) in (('this', ours), ('TRAVIS', theirs)):
+            print(f'{name if label == "this" else "  " + label:<28} {rmx:>9.1f} {gmx:>7.3f} {rmn:>9.1f} {cn:>7.3f}'
+                  + (f'   {dg:>9.4f}' if label == 'this' else ''))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Streaming RDFs from .xyz/.bin/.zbin/.lmp trajectories (TRAVIS CSV layout).')
+    parser.add_argument('traj')
+    parser.add_argument('--pair', nargs=2, action='append', metavar=('REF', 'OBS'),
+                        help='e.g. H@labile O@water (repeatable; default: the PAIRS files).')
+    parser.add_argument('--rmax', type=float, default=RMAX, help='pm')
+    parser.add_argument('--bins', type=int, default=BINS)
+    parser.add_argument('--stride', type=int, default=STRIDE, help='Use every n-th frame.')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk', type=int, default=CHUNK_FRAMES)
+    parser.add_argument('--out-dir', default='.')
+    parser.add_argument('--compare', metavar='DIR', default=None, help='Stored TRAVIS results to compare against.')
+    args = parser.parse_args()
+
+    pairs = {f'rdf_{a}_{b}'.replace('@', '-').replace('*', 'all'): (a, b) for a, b in args.pair} if args.pair else PAIRS
+    results = rdf(args.traj, pairs, args.rmax, args.bins, args.stride, args.workers, args.chunk)
+    for name, columns in results.items():
+        write_csv(os.path.join(args.out_dir, f'{name}.csv'), *columns)
+        print(f'Saved {os.path.join(args.out_dir, name)}.csv')
+    if args.compare:
+        compare(results, args.compare)
@@ -0,0 +1,188 @@
+import argparse, threading, time
+import numpy as np
+from ase.calculators.calculator import Calculator, all_changes
+from ase.io import read
+from ase.md.velocitydistribution import MaxwellBoltzmannDistribution, Stationary
+
+from calculators import BACKENDS, get_batched_calculator
+from integrators import INTEGRATORS, nvt
+from binary_traj import BinaryTrajectoryWriter
+from async_observers import AsyncObservers, frame_writer
+from thermo_log import ThermoRecorder
+
+
+# Multi-replica MD with one batched model call per step for all replicas.
+#
+# Every replica keeps its own Atoms, its own unmodified integrator from
+# integrators.nvt() (NPT/NHC/Langevin thermostat state, RNG, observers, trajectory) and runs in its own thread. Its
+# calculator is a BatchSlot: when the integrator asks for forces, the slot
+# parks the replica's Atoms and waits on a barrier. The barrier action (run by
+# the last replica to arrive) makes ONE compute() call on the batched backend
+# for all parked replicas and hands each slot its own energy/forces/stress.
+#
+# Replicas advance in lock step, so they must run the same integrator type and
+# number of steps; they may differ in seed, temperature and starting frame.
+# Anything that asks a replica for a new calculation outside the integrator
+# (e.g. an observer moving atoms) would stall the barrier, hence the timeout.
+TIMESTEP_FS = 1.0
+INTEGRATOR = 'npt'        # NOTE: 'npt', 'nhc' or 'langevin' (integrators.py). Not 'respa': its setup needs forces before the replicas run.
+BARRIER_TIMEOUT = 600.0   # NOTE: Seconds to wait for the other replicas before giving up (a stuck replica raises instead of hanging).
+
+
+class BatchSlot(Calculator):
+    """Per-replica calculator that delegates to ReplicaBatch's batched call."""
+
+    implemented_properties = ['energy', 'free_energy', 'forces', 'stress']
+
+    def __init__(self, batch, k):
+        super().__init__()
+        self.batch = batch
+        self.k = k
+
+    def calculate(self, atoms=None, properties=('energy',), system_changes=all_changes):
+        super().calculate(atoms, properties, system_changes)
+        self.batch.requests[self.k] = self.atoms
+        self.batch.barrier.wait()
+        self.results = dict(self.batch.results[self.k])
+
+
+class ReplicaBatch:
+    """Runs one integrator per replica in lock step with batched force calls."""
+
+    def __init__(self, replicas, batched_calc, timeout=BARRIER_TIMEOUT):
+        self.replicas = replicas
+        self.calc = batched_calc
+        self.requests = [None] * len(replicas)
+        self.results = [None] * len(replicas)
+        self.barrier = threading.Barrier(len(replicas), action=self._compute, timeout=timeout)
+        self.calls = 0
+        self.compute_time = 0.0
+        for k, atoms in enumerate(replicas):
+            atoms.calc = BatchSlot(self, k)
+
+    def _compute(self):
+        t0 = time.perf_counter()
+        self.results = self.calc.compute(self.requests)
+        self.compute_time += time.perf_counter() - t0
+        self.calls += 1
+
+    def run(self, dyns, steps):
+        """dyn.run(steps) for every replica's integrator, concurrently. Re-raises the first error."""
+        errors = []
+
+        def target(dyn):
+            try:
+                dyn.run(steps)
+            except BaseException as e:
+                errors.append(e)
+                self.barrier.abort()  # Release the other replicas instead of leaving them waiting.
+
+        threads = [threading.Thread(target=target, args=(dyn,), daemon=True) for dyn in dyns]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if errors:
+            # Prefer the root cause over the BrokenBarrierErrors it caused in the other replicas.
+            raise next((e for e in errors if not isinstance(e, threading.BrokenBarrierError)), errors[0])
+
+
+def make_replicas(frames, n, temperatures, seed=0):
+    """n replicas from one or more starting frames, each with its own seeded Maxwell-Boltzmann velocities."""
+    frames = frames if isinstance(frames, list) else [frames]
+    replicas = []
+    for k in range(n):
+        atoms = frames[k % len(frames)].copy()
+        MaxwellBoltzmannDistribution(atoms, temperature_K=temperatures[k], rng=np.random.default_rng(seed + k))
+        Stationary(atoms)
+        replicas.append(atoms)
+    return replicas
+
+
+def replica_seed(seed, k):
+    """Langevin noise seed of replica k: distinct per replica and from the velocity seed (seed + k)."""
+    return np.random.SeedSequence([seed, k])
+
+
+def ns_per_day(n_replicas, steps, wall):
+    return n_replicas * steps * TIMESTEP_FS * 1e-6 / wall * 86400
+
+
+def run_replicas(frames, backend, n, temperatures, steps, name, interval=10, seed=0, device=None, integrator=INTEGRATOR):
+    """Production-style run: per-replica thermostat, trajectory (.bin) and thermo log. Returns aggregate ns/day."""
+    replicas = make_replicas(frames, n, temperatures, seed)
+    batch = ReplicaBatch(replicas, get_batched_calculator(backend, device))
+    dyns, writers = [], []
+    for k, atoms in enumerate(replicas):
+        dyn = nvt(atoms, temperatures[k], integrator, timestep_fs=TIMESTEP_FS, seed=replica_seed(seed, k))
+        traj_writer = BinaryTrajectoryWriter(f'{name}_replica{k}_{temperatures[k]:g}K.bin', atoms)
+        # Inline observers: the replica threads already overlap with each other.
+        observers = AsyncObservers(atoms, enabled=False)
+        observers.attach(dyn, frame_writer(traj_writer), interval=interval)
+        thermo = ThermoRecorder(f'{name}_replica{k}_{temperatures[k]:g}K_thermo.csv', atoms, phase=f'Replica {k}')
+        thermo.attach(dyn, interval=interval)
+        dyns.append(dyn)
+        writers += [observers, traj_writer, thermo]
+
+    t0 = time.perf_counter()
+    try:
+        batch.run(dyns, steps)
+    finally:
+        for w in writers:
+            w.close()
+    wall = time.perf_counter() - t0
+    rate = ns_per_day(n, steps, wall)
+    print(f'{n} replicas x {steps} steps in {wall:.1f} s: {rate:.3f} ns/day aggregate, '
+          f'{batch.calls} batched calls ({batch.compute_time / wall:.0%} of wall time in the model)')
+    return rate
+
+
+def benchmark(atoms, n, steps, delay, temperature=330, seed=0, integrator=INTEGRATOR):
+    """Aggregate ns/day of n replicas run one after another vs batched, with the mock backend."""
+    from mock_calculator import MockBatchedCalculator, MockCalculator
+
+    temperatures = [temperature] * n
+    replicas = make_replicas(atoms, n, temperatures, seed)
+    t0 = time.perf_counter()
+    for k, r in enumerate(replicas):
+        r.calc = MockCalculator(delay=delay)
+        nvt(r, temperature, integrator, timestep_fs=TIMESTEP_FS, seed=replica_seed(seed, k)).run(steps)
+    serial = ns_per_day(n, steps, time.perf_counter() - t0)
+
+    replicas = make_replicas(atoms, n, temperatures, seed)
+    batch = ReplicaBatch(replicas, MockBatchedCalculator(delay=delay))
+    t0 = time.perf_counter()
+    batch.run([nvt(r, temperature, integrator, timestep_fs=TIMESTEP_FS, seed=replica_seed(seed, k))
+               for k, r in enumerate(replicas)], steps)
+    batched = ns_per_day(n, steps, time.perf_counter() - t0)
+    print(f'{n} replicas of {len(atoms)} atoms, {steps} steps, {delay * 1e3:.0f} ms model latency per call: '
+          f'serial {serial:.3f} ns/day, batched {batched:.3f} ns/day ({batched / serial:.2f}x)')
+    return serial, batched
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batched multi-replica NVT.')
+    parser.add_argument('input', help='Starting structure (all frames of an .xyz are used round-robin).')
+    parser.add_argument('--backend', default='mock', choices=sorted(BACKENDS))
+    parser.add_argument('--replicas', type=int, default=4)
+    parser.add_argument('--temperatures', type=float, nargs='+', default=[330], help='One per replica, or one for all.')
+    parser.add_argument('--steps', type=int, default=1000)
+    parser.add_argument('--interval', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--integrator', default=INTEGRATOR, choices=['npt'] + sorted(INTEGRATORS))
+    parser.add_argument('--name', default='replicas')
+    parser.add_argument('--benchmark', action='store_true', help='Serial vs batched ns/day with the mock backend.')
+    parser.add_argument('--delay', type=float, default=0.02, help='Mock model latency per call in s (--benchmark).')
+    args = parser.parse_args()
+
+    frames = read(args.input, index=':')
+    for atoms in frames:
+        if not atoms.pbc.any():
+            atoms.set_pbc(True)
+    temps = args.temperatures * args.replicas if len(args.temperatures) == 1 else args.temperatures
+    if args.benchmark:
+        benchmark(frames[0], args.replicas, args.steps, args.delay, temperature=temps[0], seed=args.seed,
+                  integrator=args.integrator)
+    else:
+        run_replicas(frames, args.backend, args.replicas, temps, args.steps, args.name,
+                     interval=args.interval, seed=args.seed, integrator=args.integrator)
@@ -0,0 +1,312 @@
+import argparse, time
+import numpy as np
+from ase import units
+from ase.data import chemical_symbols, covalent_radii
+from ase.io import read
+from ase.neighborlist import neighbor_list
+
+from integrators import NoseHooverChainNVT
+from neighbour_list import VerletList
+
+
+# Multiple-time-step (r-RESPA) NVT: cheap bonded forces on the inner step, the
+# MLP correction on the outer step.
+#
+# The fast model is a Gaussian well per bonded element pair in the starting
+# structure (O-H, N-H, C-H, C-O, C-N, ...): V(r) = -k w^2 exp(-(r - r0)^2 / 2w^2),
+# harmonic with force constant k near r0, with r0 and k fitted to MLP forces
+# projected on the bonds of reference frames. It depends on distances only (no
+# fixed topology) and vanishes a few widths w from r0, so a proton moving to a
+# new partner is pulled by the new bond and released by the old one instead of
+# being pinned; everything else (and the anharmonic rest) is the outer force.
+#
+# One outer step of length dt (Tuckerman, Berne & Martyna 1992):
+#   chain half step, kick (F_mlp - F_fast) * dt/2,
+#   n_inner velocity-Verlet steps of dt/n_inner with F_fast,
+#   F_mlp at the new positions, kick (F_mlp - F_fast) * dt/2, chain half step.
+# The MLP is called once per outer step; the conserved energy is that of the
+# full MLP Hamiltonian, so its drift measures the splitting error.
+#
+#   python respa.py box.xyz --backend mock --ps 2 --outer 2 3 4
+FAST_WIDTH = 0.2      # NOTE: A, width w of the fast bond wells (thermal O-H amplitude is ~0.03 A).
+FAST_RANGE = 5.0      # NOTE: Widths from r0 beyond which the fast term is dropped (exp(-12.5) of the depth).
+FAST_SKIN = 1.0       # NOTE: A, Verlet skin of the fast pair list.
+BOND_FACTOR = 1.2     # NOTE: Bonded if closer than BOND_FACTOR x sum of covalent radii.
+OUTER_FS = 3.0        # NOTE: fs, MLP step for integrator='respa' (md_driver step counts are then outer steps).
+INNER_FS = 1.0
+
+
+class FastBonds:
+    """Gaussian-well bond forces for bonded element pairs, on a Verlet list (numpy only)."""
+
+    def __init__(self, params, width=FAST_WIDTH, fast_range=FAST_RANGE):
+        self.params = params    # {(Z1, Z2): (r0, k)} with Z1 <= Z2.
+        self.width = width
+        self.fast_range = fast_range
+        self.reach = fast_range * width
+        # Lookup tables indexed by atomic number pairs (r0 = 0 marks 'no fast term').
+        self.r0 = np.zeros((119, 119))
+        self.k = np.zeros((119, 119))
+        for (z1, z2), (r0, k) in params.items():
+            self.r0[z1, z2] = self.r0[z2, z1] = r0
+            self.k[z1, z2] = self.k[z2, z1] = k
+        self.cutoff = max(r0 for r0, k in params.values()) + self.reach
+        self.nlist = None
+
+    def forces(self, atoms):
+        """(energy, forces) of the fast model."""
+        if self.nlist is None:
+            self.nlist = VerletList(self.cutoff, skin=FAST_SKIN)
+        i, j, S = self.nlist.neighbor_list('ijS', atoms)
+        # Vectors from atoms.positions (not the list's build reference), so a restart with a fresh list is bit-exact.
+        D = atoms.positions[j] + S @ atoms.cell.array - atoms.positions[i]
+        d = np.sqrt(np.einsum('ij,ij->i', D, D))
+        z = atoms.numbers
+        r0 = self.r0[z[i], z[j]]
+        keep = (r0 > 0) & (np.abs(d - r0) < self.reach)
+        i, j, d, D, r0 = i[keep], j[keep], d[keep], D[keep], r0[keep]
+        k = self.k[z[i], z[j]]
+        x = d - r0
+        v = -k * self.width ** 2 * np.exp(-0.5 * (x / self.width) ** 2)
+        de = -v * x / self.width ** 2     # dV/dr
+        f_pair = (de / d)[:, None] * D
+        forces = np.zeros((len(atoms), 3))
+        np.add.at(forces, i, f_pair)   # Full list: each pair appears twice.
+        return 0.5 * v.sum(), forces
+
+    def get_state(self):
+        """The fit as arrays (for checkpoints)."""
+        keys = sorted(self.params)
+        return {'fast_pairs': np.array(keys, dtype=np.int64).reshape(-1, 2),
+                'fast_params': np.array([self.params[key] for key in keys], dtype=float).reshape(-1, 2),
+                'fast_width': np.array(self.width), 'fast_range': np.array(self.fast_range)}
+
+    @classmethod
+    def from_state(cls, state):
+        params = {(int(a), int(b)): (float(r0), float(k)) for (a, b), (r0, k) in zip(state['fast_pairs'], state['fast_params'])}
+        return cls(params, float(state['fast_width']), float(state['fast_range']))
+
+    def describe(self):
+        return ', '.join(f'{chemical_symbols[a]}-{chemical_symbols[b]} r0 {r0:.3f} A k {k:.1f} eV/A2'
+                         for (a, b), (r0, k) in sorted(self.params.items()))
+
+
+def bonded_pairs(atoms, factor=BOND_FACTOR):
+    """i < j pairs closer than factor x the sum of covalent radii, with their distances and unit vectors."""
+    i, j, d, D = neighbor_list('ijdD', atoms, 2 * factor * covalent_radii[atoms.numbers].max())
+    z = atoms.numbers
+    keep = (i < j) & (d < factor * (covalent_radii[z[i]] + covalent_radii[z[j]]))
+    return i[keep], j[keep], d[keep], D[keep] / d[keep, None]
+
+
+def fit_fast_bonds(frames, width=FAST_WIDTH, fast_range=FAST_RANGE, factor=BOND_FACTOR):
+    """Fit r0 and k per bonded element pair to MLP forces. frames: list of (atoms, forces).
+
+    Along a bond, (F_j - F_i).u / 2 = -k (r - r0); a straight-line fit of that
+    projection against r over all bonds of a type gives k and r0.
+    """
+    samples = {}
+    for atoms, forces in frames:
+        i, j, d, u = bonded_pairs(atoms, factor)
+        z = atoms.numbers
+        proj = 0.5 * np.einsum('ij,ij->i', forces[j] - forces[i], u)
+        for a, b, r, f in zip(np.minimum(z[i], z[j]), np.maximum(z[i], z[j]), d, proj):
+            samples.setdefault((a, b), ([], []))
+            samples[a, b][0].append(r)
+            samples[a, b][1].append(f)
+    params = {}
+    for key, (r, f) in samples.items():
+        r, f = np.array(r), np.array(f)
+        if len(r) < 10 or np.ptp(r) < 1e-3:
+            continue
+        slope, intercept = np.polyfit(r, f, 1)
+        k = -slope
+        if k <= 0:
+            print(f'Fast bonds: no restoring force fitted for {chemical_symbols[key[0]]}-{chemical_symbols[key[1]]}, skipped.')
+            continue
+        params[key] = (intercept / k, k)
+    return FastBonds(params, width, fast_range)
+
+
+class RespaNVT(NoseHooverChainNVT):
+    """r-RESPA with a Nose-Hoover chain on the outer step. timestep is the outer (MLP) step."""
+
+    def __init__(self, atoms, timestep, temperature_K, fast, n_inner, **kwargs):
+        super().__init__(atoms, timestep, temperature_K, **kwargs)
+        self.fast = fast
+        self.n_inner = n_inner
+        self.f_fast = None
+        self.f_slow = np.empty((len(atoms), 3))
+        self.mlp_calls = 0
+
+    def _compute_slow(self):
+        """MLP forces at the current positions; f_slow = F_mlp - f_fast (f_fast must be current)."""
+        self.mlp_calls += 1
+        self.forces = super()._compute_forces()
+        np.subtract(self.forces, self.f_fast, out=self.f_slow)
+
+    def _compute_forces(self):
+        # Called by irun() at the start of each run: the atoms may have changed, so both parts are recomputed.
+        self.f_fast = self.fast.forces(self.atoms)[1]
+        self._compute_slow()
+        return self.forces
+
+    def _kick_with(self, forces, dt):
+        np.multiply(forces, dt, out=self.tmp)
+        self.atoms.arrays['momenta'] += self.tmp
+
+    def step(self):
+        half = 0.5 * self.dt
+        h = self.dt / self.n_inner
+        self._thermostat(half)
+        self._kick_with(self.f_slow, half)
+        for _ in range(self.n_inner):
+            self._kick_with(self.f_fast, 0.5 * h)
+            self._drift(h)
+            self.f_fast = self.fast.forces(self.atoms)[1]
+            self._kick_with(self.f_fast, 0.5 * h)
+        self._compute_slow()
+        self._kick_with(self.f_slow, half)
+        self._thermostat(half)
+
+    def get_state(self):
+        """Chain state and the fast-bond fit, so a restart integrates with the same split."""
+        return {**super().get_state(), **self.fast.get_state()}
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.fast = FastBonds.from_state(state)
+
+
+def fit_current(atoms):
+    """Fast bonds fitted to the MLP forces of the current (thermalised) structure."""
+    return fit_fast_bonds([(atoms, atoms.get_forces().copy())])
+
+
+def fast_from_checkpoint(state):
+    """The FastBonds of a RespaNVT run from its checkpoint (checkpoint.load_checkpoint() dict)."""
+    return FastBonds.from_state({key[len('dyn_'):]: value for key, value in state.items() if key.startswith('dyn_')})
+
+
+def respa_nvt(atoms, temperature_K, outer_fs=OUTER_FS, inner_fs=INNER_FS, fast=None, **kwargs):
+    """RespaNVT with the given fast bonds, or fitted to the current structure (fit_current) if None.
+
+    Pass the same fit to every phase of a run (md_driver fits once after heating).
+    """
+    if fast is None:
+        fast = fit_current(atoms)
+    print(f'RESPA {outer_fs:g}/{inner_fs:g} fs, fast bonds: {fast.describe()}')
+    return RespaNVT(atoms, outer_fs * units.fs, temperature_K, fast, max(int(round(outer_fs / inner_fs)), 1), **kwargs)
+
+
+def rdf(frames, rmax=6.0, nbins=120, pair=None):
+    """g(r) averaged over frames (all pairs, or one element pair like ('O', 'H'))."""
+    edges = np.linspace(0, rmax, nbins + 1)
+    hist = np.zeros(nbins)
+    norm = 0.0
+    for atoms in frames:
+        i, j, d = neighbor_list('ijd', atoms, rmax)
+        if pair:
+            s = np.array(atoms.get_chemical_symbols())
+            mask = (s[i] == pair[0]) & (s[j] == pair[1])
+            i, j, d = i[mask], j[mask], d[mask]
+            na, nb = (s == pair[0]).sum(), (s == pair[1]).sum()
+        else:
+            na = nb = len(atoms)
+        hist += np.histogram(d, edges)[0]
+        norm += na * nb / atoms.get_volume()
+    shell = 4 / 3 * np.pi * (edges[1:] ** 3 - edges[:-1] ** 3)
+    return 0.5 * (edges[1:] + edges[:-1]), hist / (norm * shell)
+
+
+def run_nvt(dyn, atoms, steps, interval):
+    """Run and collect frames (copies), conserved energies and positions for the MSD."""
+    frames, econs = [], []
+
+    def record():
+        frames.append(atoms.copy())
+        econs.append(dyn.get_gibbs_free_energy())
+
+    dyn.attach(record, interval)
+    t0 = time.perf_counter()
+    dyn.run(steps)
+    return frames, np.array(econs), time.perf_counter() - t0
+
+
+def compare(atoms, backend, ps, outers, inner_fs=INNER_FS, temperature_K=330, interval_fs=10, device=None):
+    """1 fs NHC reference vs RESPA at each outer step: drift, MSD, MLP calls per ps and the RDF deviation
+    (sum |g - g_ref| / sum g_ref over 0-6 A, all pairs and O-H)."""
+    from ase.md.velocitydistribution import MaxwellBoltzmannDistribution, Stationary
+    from calculators import get_calculator
+
+    calc = get_calculator(backend, device)
+
+    def start_from(seed):
+        start = atoms.copy()
+        MaxwellBoltzmannDistribution(start, temperature_K=temperature_K, rng=np.random.default_rng(seed))
+        Stationary(start)
+        start.calc = calc
+        return start
+
+    start = start_from(0)
+    natoms = len(start)
+
+    def summary(label, frames, econs, wall, calls, record_fs):
+        t_ps = np.arange(len(econs)) * record_fs * 1e-3
+        drift = np.polyfit(t_ps, econs / natoms, 1)[0] * 1e3
+        msd = ((frames[-1].positions - frames[0].positions) ** 2).sum(axis=1).mean()
+        return {'label': label, 'drift': drift, 'msd': msd, 'rdf': rdf(frames[len(frames) // 5:]),
+                'rdf_oh': rdf(frames[len(frames) // 5:], pair=('O', 'H')) if {'O', 'H'} <= set(start.get_chemical_symbols()) else None,
+                'calls_per_ps': calls / ps, 'wall_per_ps': wall / ps, 'frames': frames}
+
+    steps = int(round(ps * 1000))
+    ref_atoms = start_from(0)
+    frames, econs, wall = run_nvt(NoseHooverChainNVT(ref_atoms, 1.0 * units.fs, temperature_K), ref_atoms, steps, interval_fs)
+    ref = summary('1 fs reference', frames, econs, wall, steps, interval_fs)
+    # Same run from other velocities: the statistical noise floor of the MSD and RDF comparisons.
+    noise_atoms = start_from(1)
+    noise = summary('1 fs, other velocities', *run_nvt(NoseHooverChainNVT(noise_atoms, 1.0 * units.fs, temperature_K),
+                                                        noise_atoms, steps, interval_fs), steps, interval_fs)
+
+    # Forces for the fit: one MLP call per sampled reference frame.
+    fit_frames = []
+    for f in frames[:: max(len(frames) // 20, 1)]:
+        probe = f.copy()
+        probe.calc = calc
+        fit_frames.append((probe, probe.get_forces().copy()))
+    fast = fit_fast_bonds(fit_frames)
+    print(f'Fast bonds fitted on {len(fit_frames)} frames: {fast.describe()}')
+
+    rows = [ref, noise]
+    for outer in outers:
+        n_inner = max(int(round(outer / inner_fs)), 1)
+        run_atoms = start_from(0)
+        dyn = RespaNVT(run_atoms, outer * units.fs, temperature_K, fast, n_inner)
+        n_record = max(int(round(interval_fs / outer)), 1)   # Outer steps per frame: 9 fs at 3 fs, 8 fs at 4 fs.
+        frames, econs, wall = run_nvt(dyn, run_atoms, int(round(ps * 1000 / outer)), n_record)
+        rows.append(summary(f'RESPA {outer:g}/{outer / n_inner:g} fs', frames, econs, wall, dyn.mlp_calls, n_record * outer))
+
+    print(f'\n{"":>24} {"MLP calls/ps":>12} {"wall s/ps":>9} {"drift meV/atom/ps":>18} {"MSD A2":>8} {"dg(r)":>8} {"dg_OH(r)":>10}')
+    for r in rows:
+        dg = np.abs(r['rdf'][1] - ref['rdf'][1]).sum() / ref['rdf'][1].sum()
+        dg_oh = np.abs(r['rdf_oh'][1] - ref['rdf_oh'][1]).sum() / ref['rdf_oh'][1].sum() if r['rdf_oh'] is not None else np.nan
+        print(f'{r["label"]:>24} {r["calls_per_ps"]:>12.0f} {r["wall_per_ps"]:>9.2f} {r["drift"]:>18.3f} '
+              f'{r["msd"]:>8.3f} {dg:>8.4f} {dg_oh:>10.4f}')
+    return rows
+
+
+if __name__ == '__main__':
+    from calculators import BACKENDS
+
+    parser = argparse.ArgumentParser(description='Validate r-RESPA against 1 fs NVT and report MLP calls per ps.')
+    parser.add_argument('input', help='Equilibrated periodic structure (.xyz with a cell).')
+    parser.add_argument('--backend', default='mock', choices=sorted(BACKENDS))
+    parser.add_argument('--ps', type=float, default=2.0, help='Length of each run in ps.')
+    parser.add_argument('--outer', type=float, nargs='+', default=[2.0, 3.0, 4.0], help='Outer (MLP) steps in fs.')
+    parser.add_argument('--inner', type=float, default=INNER_FS, help='Inner (fast bond) step in fs.')
+    parser.add_argument('--device', default=None)
+    args = parser.parse_args()
+
+    atoms = read(args.input)
+    atoms.set_pbc(True)
+    compare(atoms, args.backend, args.ps, args.outer, inner_fs=args.inner, device=args.device)
@@ -1,28 +1,32 @@
-import torch, os
-import numpy as np
-from ase import units
-from ase.io import read, write, iread
-from ase.md.npt import NPT
-from ase.optimize import LBFGS
-from ase.md.velocitydistribution import MaxwellBoltzmannDistribution, Stationary
-from ase.geometry import cell_to_cellpar, cellpar_to_cell
-
-from sevenn.calculator import SevenNetCalculator
-# from aimnet.calculators import AIMNet2ASE
-# from orb_models.forcefield import pretrained
-# from orb_models.forcefield.calculator import ORBCalculator
-# from mace.calculators import mace_mp 
+import os, sys, time
+from ase.io import read
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from async_observers import AsyncObservers, extxyz_appender, frame_writer
+from thermo_log import ThermoRecorder
+from binary_traj import BinaryTrajectoryWriter, BinaryTrajectoryReader
+from extxyz_index import IndexedExtxyzWriter, load_index, read_frame, repair_tail
+from lammps_export import LammpsSink
+from traj_convert import convert
+from checkpoint import Checkpointer, latest_checkpoint, load_checkpoint, atoms_from_checkpoint, restore_dynamics, truncate_outputs
+
+from calculators import default_device, get_calculator
+from integrators import nvt
+from respa import fast_from_checkpoint
+from md_driver import STEPS_PROD, VERSION, output_files
 
 
 INPUT_FILE = '../water_acetic_imidazole_mix.xyz'
 TEMP_TARGET = 330
 STEPS_EQUIL = 100000
-STEPS_PROD = 1000000
 BOX_LENGTH = 37.2  
-DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
-VERSION = 'v8_2mill_interval_10'  # NOTE: PLACEHOLDER TO MARK/NAME OUTSPUTS (i.e., a suffix)
+DEVICE = default_device()
 INTERVAL = 10                     # NOTE: Interval to save production analysis in.
-MODEL = 'sevennet'                # NOTE: Placeholder for model name (does not acutally change loaded model, just for file naming).
+MODEL = 'sevennet'                # NOTE: Backend from calculators.py (orb, mace, aimnet2, sevennet, mock); also used for file naming.
+# NOTE: File names come from md_driver.output_files(MODEL, VERSION) and STEPS_PROD from md_driver, so they match the production run.
+#       Set VERSION/STEPS_PROD here if it ran with other values.
+ASYNC_IO = True                   # NOTE: Frame writes/status prints on a background thread (False = inline, to compare ms/step).
+INTEGRATOR = 'npt'                # NOTE: Must match the production run ('npt', 'nhc', 'langevin' or 'respa', see integrators.py).
+#       With 'respa', STEPS_PROD and INTERVAL count outer steps (one respa.OUTER_FS MLP step each), as in the production run.
 
 try:
     atoms = read(INPUT_FILE)
@@ -34,111 +38,91 @@ except FileNotFoundError:
     print(f'Error: {INPUT_FILE} not found. Run generate_system.py first.')
     exit()
 
-TRAJ_FILE = f'{MODEL}_proton_sim_{INTERVAL}.xyz'
-OUTPUT_LMP_WRAPPED = f'{MODEL}__proton_sim_{INTERVAL}.lmp'
-OUTPUT_LMP_UNWRAPPED = f'{MODEL}__analysis_unwrapped_{INTERVAL}.lmp'
-
+FILES = output_files(MODEL, VERSION)
+TRAJ_FILE = FILES['traj']  # NOTE: Runs from older scripts wrote '.xyz' trajectories; both are handled below.
+CHECKPOINT_PREFIX = FILES['checkpoint']
+OUTPUT_LMP_WRAPPED = FILES['lmp_wrapped']
+OUTPUT_LMP_UNWRAPPED = FILES['lmp_unwrapped']
+THERMO_FILE = FILES['thermo']
 
-def count_frames_xyz(filename):
-    count = 0
-    CHUNK_SIZE = 16 * 1024 * 1024 
-    pattern = b'Lattice='
-    with open(filename, 'rb') as f:
-        while True:
-            chunk = f.read(CHUNK_SIZE)
-            if not chunk: break
-            count += chunk.count(pattern)
-    return count
 
 try:
-    if not os.path.exists(TRAJ_FILE):
-        print(f'Error: {TRAJ_FILE} not found.')
-        # Add logic here to start fresh if file missing?
-        exit()
-
-    atoms = read(TRAJ_FILE, index=-1)
-    frames_done = count_frames_xyz(TRAJ_FILE)
-    steps_done = frames_done * 10
+    # Prefer an exact restart from the newest full-state checkpoint.
+    ckpt = latest_checkpoint(CHECKPOINT_PREFIX)
+    state = None
+    if ckpt is not None:
+        print(f'Restarting from checkpoint {ckpt}')
+        state = load_checkpoint(ckpt)
+        truncate_outputs(state)  # Drop frames/thermo rows written after the checkpoint.
+        atoms = atoms_from_checkpoint(state)
+        steps_done = int(state['step'])
+    else:
+        # Legacy restart: last frame of the trajectory (no thermostat state).
+        if not os.path.exists(TRAJ_FILE):
+            print(f'Error: {TRAJ_FILE} not found.')
+            # Add logic here to start fresh if file missing?
+            exit()
+        if TRAJ_FILE.endswith('.bin'):
+            reader = BinaryTrajectoryReader(TRAJ_FILE)
+            atoms = reader.get_atoms(-1)
+            steps_done = int(reader[-1]['step'])
+        else:
+            # Cut a half-written last frame (walltime kill), then count/read through the .idx sidecar.
+            repair_tail(TRAJ_FILE)
+            index = load_index(TRAJ_FILE)
+            atoms = read_frame(TRAJ_FILE, -1, index=index)
+            frames_done = len(index[0])
+            steps_done = int(index[1][-1]) if index[1][-1] >= 0 else frames_done * 10
     steps_remaining = STEPS_PROD - steps_done
     
     print(f'Steps remaining: {steps_remaining}')
     if steps_remaining <= 0:
         print('Simulation finished.')
     else:
-        atoms.calc = SevenNetCalculator(model='sevennet-0', device=DEVICE)
+        atoms.calc = get_calculator(MODEL, DEVICE)
 
         print(f'\nRestarting NVT Production ({steps_remaining} steps)')
-        dyn_prod = NPT(atoms, timestep=1.0*units.fs, temperature_K=TEMP_TARGET, externalstress=0, pfactor=None, ttime=100*units.fs)
-
-        def write_frame():
-            write(TRAJ_FILE, atoms, format='extxyz', append=True)
-
-        def print_status(dyn, current_step_offset):
-            pe = atoms.get_potential_energy()
-            total_step = current_step_offset + dyn.nsteps
-            print(f'Prod Step {total_step}: Temp={atoms.get_temperature():.1f}K, PE={pe:.1f} eV')
-
-        dyn_prod.attach(lambda: print_status(dyn_prod, steps_done), interval=1000) # Print status rarely
-        dyn_prod.attach(write_frame, interval=INTERVAL) # Write frames (10fs)
-
-        dyn_prod.run(steps_remaining)
-        print('Production finished.')
+        # RESPA continues with the fast-bond fit saved in the checkpoint (a legacy restart refits it to the last frame).
+        fast = {'fast': fast_from_checkpoint(state)} if INTEGRATOR == 'respa' and state is not None else {}
+        dyn_prod = nvt(atoms, TEMP_TARGET, INTEGRATOR, **fast)
+        if state is not None:
+            restore_dynamics(dyn_prod, state)  # Thermostat, step counter and RNG continue bit-for-bit.
+            step_offset = steps_done - int(state['nsteps'])
+        else:
+            step_offset = steps_done
+
+        # Observers only snapshot the arrays; formatting and disk writes happen on a background thread.
+        if TRAJ_FILE.endswith('.bin'):
+            traj_out = BinaryTrajectoryWriter(TRAJ_FILE, atoms)
+            write_frame = frame_writer(traj_out)
+        else:
+            traj_out = IndexedExtxyzWriter(TRAJ_FILE)
+            write_frame = extxyz_appender(traj_out, atoms)
+        observers = AsyncObservers(atoms, policy='block', enabled=ASYNC_IO)
+        thermo = ThermoRecorder(THERMO_FILE, atoms, phase='Prod') # Appends; prints a throttled summary only
+        thermo.attach(dyn_prod, interval=INTERVAL, step_offset=step_offset)
+        observers.attach(dyn_prod, write_frame, interval=INTERVAL, step_offset=step_offset) # Write frames (10fs)
+        checkpointer = Checkpointer(CHECKPOINT_PREFIX, atoms, dyn_prod, track_files=[TRAJ_FILE, THERMO_FILE],
+                                    flush=[observers, traj_out, thermo], step_offset=step_offset)
+        checkpointer.attach()
+
+        t_start = time.perf_counter()
+        try:
+            dyn_prod.run(steps_remaining)
+        finally:
+            observers.close()
+            traj_out.close()
+            thermo.close()
+        print(f'Production finished. {(time.perf_counter() - t_start) / steps_remaining * 1e3:.2f} ms/step (ASYNC_IO={ASYNC_IO})')
 
 except Exception as e:
     print(f'Error during simulation: {e}')
     exit()
 
 
-print(f'\nConverting to LAMMPS')
+print(f'\nConverting to LAMMPS (wrapped + UNWRAPPED for TRAVIS, one pass over the trajectory)')
 try:
-    with open(OUTPUT_LMP_WRAPPED, 'w') as f:
-        # Use iread to prevent memory crash
-        for i, frame in enumerate(iread(TRAJ_FILE)):
-            cp = cell_to_cellpar(frame.cell)
-            frame.set_cell(cellpar_to_cell(cp), scale_atoms=True)
-            frame.wrap() # Wrap atoms into box
-
-            c = frame.cell
-            pos = frame.get_positions()
-            
-            f.write(f'ITEM: TIMESTEP\n{i}\nITEM: NUMBER OF ATOMS\n{len(frame)}\n')
-            f.write('ITEM: BOX BOUNDS pp pp pp\n')
-            f.write(f'0.000000 {c[0,0]:.6f}\n')
-            f.write(f'0.000000 {c[1,1]:.6f}\n')
-            f.write(f'0.000000 {c[2,2]:.6f}\n')
-            
-            f.write('ITEM: ATOMS id element x y z\n')
-            for j, sym in enumerate(frame.get_chemical_symbols()):
-                f.write(f'{j+1} {sym} {pos[j,0]:.4f} {pos[j,1]:.4f} {pos[j,2]:.4f}\n')
-    print(f'Done. Saved {OUTPUT_LMP_WRAPPED}')
+    convert(TRAJ_FILE, [LammpsSink(OUTPUT_LMP_WRAPPED, unwrapped=False),   # Wrap atoms into box
+                        LammpsSink(OUTPUT_LMP_UNWRAPPED, unwrapped=True)])  # Do NOT wrap. Drift is needed for diffusion.
 except Exception as e:
-    print(f'Error writing wrapped lammps: {e}')
-
-
-print(f'Exporting UNWRAPPED coordinates for TRAVIS')
-try:
-    with open(OUTPUT_LMP_UNWRAPPED, 'w') as f:
-        for i, frame in enumerate(iread(TRAJ_FILE)):
-            
-            cp = cell_to_cellpar(frame.cell)
-            frame.set_cell(cellpar_to_cell(cp), scale_atoms=True)
-
-            # Do NOT wrap. Drift is needed for diffusion.
-            pos = frame.get_positions()
-            box = np.diag(frame.cell)
-            symbols = frame.get_chemical_symbols()
-            f.write(f'ITEM: TIMESTEP\n{i}\nITEM: NUMBER OF ATOMS\n{len(frame)}\n')
-            f.write('ITEM: BOX BOUNDS pp pp pp\n')
-            f.write(f'0.000000 {box[0]:.6f}\n')
-            f.write(f'0.000000 {box[1]:.6f}\n')
-            f.write(f'0.000000 {box[2]:.6f}\n')
-            
-            f.write('ITEM: ATOMS id element xu yu zu\n')
-            for j, sym in enumerate(symbols):
-                f.write(f'{j+1} {sym} {pos[j,0]:.4f} {pos[j,1]:.4f} {pos[j,2]:.4f}\n')
-
-    print(f'\nSaved to {OUTPUT_LMP_UNWRAPPED}')
-
-except Exception as e:
-    print(f'\nError writing unwrapped lammps: {e}')
-
+    print(f'\nError writing lammps: {e}')
@@ -0,0 +1,255 @@
+import argparse, itertools, time
+import numpy as np
+from ase import Atoms, units
+from ase.constraints import FixAtoms
+from ase.data import covalent_radii
+from ase.io import read, write
+from ase.md.velocitydistribution import Stationary
+from ase.neighborlist import neighbor_list
+from ase.optimize import LBFGS
+
+from neighbour_list import cell_list_pairs
+from respa import bonded_pairs
+
+
+# Large-system starts by tiling an equilibrated box (*_equilibrated_*.xyz).
+#
+# The box is replicated n x m x k. Each replica gets its own transformation of
+# the equilibrated molecules, so the copies are not images of each other:
+#   'rotate'  a random symmetry rotation of the box (signed axis permutation,
+#             det +1, among axes of equal length) and a random periodic shift;
+#   'shift'   a random periodic shift only (any cell);
+#   'none'    plain copies.
+# Molecules (covalent connectivity, respa.bonded_pairs) are made whole first
+# and wrapped into their replica by their centre, so no bond is cut. Each
+# replica gets fresh Maxwell-Boltzmann velocities at TEMP from its own seed.
+#
+# Inside a replica the structure is the equilibrated one; only at the seams
+# (faces between replicas, along tiled axes) do molecules meet neighbours they
+# have not equilibrated with. The relief stage pushes the molecules within SEAM
+# of a face apart as rigid bodies until no intermolecular pair is closer than
+# CONTACT_FACTOR x the sum of covalent radii (at least MIN_CONTACT), or than the
+# closest pair of the same elements in the equilibrated box if that is closer
+# (so plain copies have no overlaps). With
+# --relax BACKEND, a short LBFGS with the MLP follows, with only the seam atoms
+# free. The result then needs only a short re-equilibration
+# (md_driver.py --prepared --steps-equil ...).
+#
+#   python supercell.py orb_equilibrated__2mill_interval_10.xyz 2 2 2 --seed 1
+#   python supercell.py box.xyz 3 3 3 --mode shift --relax mace --output big.xyz
+MODE = 'rotate'
+TEMP = 330
+SEAM = 3.0               # NOTE: A from a replica face within which molecules may be moved.
+CONTACT_FACTOR = 1.6     # NOTE: x (r_cov,i + r_cov,j): closer intermolecular pairs count as overlaps (H-O 1.55 A, O-O 2.11 A).
+MIN_CONTACT = 1.5        # A, the floor of that distance (H-H), as MIN_DISTANCE in generate_system.py.
+RELIEF_ITERS = 200
+MAX_PUSH = 0.2           # A per molecule and iteration.
+RELIEF_SKIN = 2.0        # A. Pairs are searched again once a molecule has moved more than RELIEF_SKIN/2.
+RELAX_STEPS = 50
+RELAX_FMAX = 0.1         # eV/A, as md_driver.minimise().
+
+
+def molecules(atoms):
+    """Molecule index per atom (connected components of the covalent bonds)."""
+    i, j, _, _ = bonded_pairs(atoms)
+    mol = np.arange(len(atoms))
+    while True:
+        low = np.minimum(mol[i], mol[j])
+        new = mol.copy()
+        np.minimum.at(new, i, low)
+        np.minimum.at(new, j, low)
+        new = new[new]
+        if (new == mol).all():
+            break
+        mol = new
+    return np.unique(mol, return_inverse=True)[1]
+
+
+def whole(atoms, mol):
+    """Scaled positions with every molecule whole (minimum image to its first atom)."""
+    scaled = atoms.get_scaled_positions()
+    first = np.zeros(mol.max() + 1, dtype=int)
+    first[mol[::-1]] = np.arange(len(mol))[::-1]
+    d = scaled - scaled[first[mol]]
+    return scaled[first[mol]] + d - np.round(d)
+
+
+def box_rotations(cell, tol=1e-6):
+    """Signed axis permutations (det +1) that map the (orthorhombic) cell onto itself."""
+    cell = np.asarray(cell)
+    if np.abs(cell - np.diag(np.diag(cell))).max() > tol:
+        raise ValueError("Mode 'rotate' needs an orthorhombic cell (use --mode shift).")
+    lengths = np.diag(cell)
+    rotations = []
+    for perm in itertools.permutations(range(3)):
+        if np.abs(lengths[list(perm)] - lengths).max() > tol:
+            continue
+        for signs in itertools.product((1, -1), repeat=3):
+            R = np.zeros((3, 3))
+            R[range(3), perm] = signs
+            if np.linalg.det(R) > 0:
+                rotations.append(R)
+    return rotations
+
+
+def replica(scaled, mol, mode, rng, rotations):
+    """Scaled positions (in [0, 1) by molecule centre) of one transformed copy of the box."""
+    s = scaled
+    if mode == 'rotate':
+        # About the box centre. For an orthorhombic cell a signed permutation acts the same on scaled and
+        # Cartesian coordinates.
+        s = (s - 0.5) @ rotations[rng.integers(len(rotations))].T + 0.5
+    if mode in ('rotate', 'shift'):
+        s = s + rng.random(3)
+    counts = np.bincount(mol)
+    centres = np.stack([np.bincount(mol, s[:, k]) / counts for k in range(3)], axis=1)
+    return s - np.floor(centres)[mol]
+
+
+def maxwell_boltzmann(masses, temperature_K, rng):
+    return rng.normal(size=(len(masses), 3)) * np.sqrt(masses * units.kB * temperature_K)[:, None]
+
+
+def tile(atoms, reps, mode=MODE, temperature_K=TEMP, seed=None):
+    """Supercell of reps = (n, m, k) transformed replicas with fresh velocities.
+
+    Returns (supercell, molecule index per atom, replica index per atom).
+    """
+    if mode not in ('rotate', 'shift', 'none'):
+        raise ValueError(f'Unknown mode {mode!r}.')
+    reps = np.asarray(reps, dtype=int)
+    mol = molecules(atoms)
+    scaled = whole(atoms, mol)
+    rotations = box_rotations(atoms.cell) if mode == 'rotate' else None
+    seeds = np.random.SeedSequence(seed).spawn(int(reps.prod()))
+    n_mol = mol.max() + 1
+    positions, momenta, mols, owner = [], [], [], []
+    for r, offset in enumerate(itertools.product(*(range(n) for n in reps))):
+        rng = np.random.default_rng(seeds[r])
+        s = replica(scaled, mol, mode, rng, rotations)
+        positions.append(((s + offset) / reps) @ (atoms.cell * reps[:, None]))
+        momenta.append(maxwell_boltzmann(atoms.get_masses(), temperature_K, rng))
+        mols.append(mol + r * n_mol)
+        owner.append(np.full(len(atoms), r))
+    big = Atoms(numbers=np.tile(atoms.numbers, len(positions)), positions=np.concatenate(positions),
+                cell=atoms.cell * reps[:, None], pbc=True, momenta=np.concatenate(momenta))
+    Stationary(big)
+    return big, np.concatenate(mols), np.concatenate(owner)
+
+
+def seam_molecules(atoms, mol, reps, seam=SEAM):
+    """Boolean per molecule: some atom within seam of a face between replicas (tiled axes only)."""
+    frac = (atoms.get_scaled_positions(wrap=False) * reps) % 1
+    width = np.linalg.norm(atoms.cell, axis=1) / reps      # Replica edge lengths.
+    dist = np.minimum(frac, 1 - frac) * width
+    near = ((dist < seam) & (reps > 1)).any(axis=1)
+    return np.bincount(mol, near, minlength=mol.max() + 1) > 0
+
+
+def contact_table(atoms, mol, factor=CONTACT_FACTOR, min_contact=MIN_CONTACT):
+    """Overlap distance per element pair: factor x (r_cov,i + r_cov,j), at least min_contact, but never more
+    than the closest intermolecular pair of those elements in atoms (the equilibrated box)."""
+    radii = covalent_radii[:atoms.numbers.max() + 1]
+    table = np.maximum(factor * (radii[:, None] + radii[None, :]), min_contact)
+    i, j, d = neighbor_list('ijd', atoms, table.max())
+    inter = mol[i] != mol[j]
+    np.minimum.at(table, (atoms.numbers[i][inter], atoms.numbers[j][inter]), d[inter])
+    return table
+
+
+def candidate_pairs(atoms, mol, movable, cutoff):
+    """Intermolecular pairs (i < j) within cutoff with at least one movable molecule: (i, j, vectors i -> j)."""
+    pairs = cell_list_pairs(atoms.positions, atoms.cell, cutoff)
+    if pairs is None:
+        i, j, D = neighbor_list('ijD', atoms, cutoff)
+    else:
+        i, j, S, wrapped = pairs
+        D = wrapped[j] + S @ atoms.cell.array - wrapped[i]
+    keep = (i < j) & (mol[i] != mol[j]) & (movable[mol[i]] | movable[mol[j]])
+    return i[keep], j[keep], D[keep]
+
+
+def overlaps(atoms, mol, movable, table):
+    """Number of candidate pairs closer than table[Z_i, Z_j]."""
+    i, j, D = candidate_pairs(atoms, mol, movable, table.max())
+    return int((np.linalg.norm(D, axis=1) < table[atoms.numbers[i], atoms.numbers[j]]).sum())
+
+
+def relieve(atoms, mol, movable, table, iters=RELIEF_ITERS, skin=RELIEF_SKIN):
+    """Push overlapping movable molecules apart as rigid bodies. Returns (iterations, overlaps left).
+
+    Candidate pairs are searched within table.max() + skin and their vectors updated from the molecule shifts;
+    they are searched again once a molecule has moved more than skin/2.
+    """
+    moved = None
+    for it in range(iters + 1):
+        if moved is None or np.einsum('ij,ij->i', moved, moved).max() > (0.5 * skin) ** 2:
+            i, j, D0 = candidate_pairs(atoms, mol, movable, table.max() + skin)
+            contact = table[atoms.numbers[i], atoms.numbers[j]]
+            mi, mj = movable[mol[i]], movable[mol[j]]
+            moved = np.zeros((mol.max() + 1, 3))
+        D = D0 + moved[mol[j]] - moved[mol[i]]
+        d = np.sqrt(np.einsum('ij,ij->i', D, D))
+        hit = d < contact
+        if not hit.any() or it == iters:
+            return it, int(hit.sum())
+        # Half the gap each (all of it if the other molecule is fixed), plus a little, summed per molecule.
+        share = (np.where(mi & mj, 0.5, 1.0) * (contact - d + 0.05) / d)[hit, None] * -D[hit]
+        shift = np.zeros_like(moved)
+        np.add.at(shift, mol[i[hit & mi]], share[mi[hit]])
+        np.add.at(shift, mol[j[hit & mj]], -share[mj[hit]])
+        # A molecule pushed by several neighbours at once moves at most MAX_PUSH per iteration.
+        length = np.linalg.norm(shift, axis=1, keepdims=True)
+        shift *= np.minimum(1, MAX_PUSH / np.maximum(length, 1e-12))
+        atoms.positions += shift[mol]
+        moved += shift
+
+
+def relax(atoms, mol, movable, backend, steps=RELAX_STEPS, fmax=RELAX_FMAX, device=None):
+    """Short LBFGS with the MLP, only the seam molecules free. Velocities are kept."""
+    from calculators import get_calculator
+
+    atoms.calc = get_calculator(backend, device)
+    atoms.set_constraint(FixAtoms(mask=~movable[mol]))
+    LBFGS(atoms).run(fmax=fmax, steps=steps)
+    atoms.set_constraint()
+
+
+def supercell(atoms, reps, mode=MODE, temperature_K=TEMP, seed=None, seam=SEAM, backend=None, device=None):
+    """tile() + seam overlap relief (+ an MLP relax of the seams with backend)."""
+    t0 = time.perf_counter()
+    big, mol, _ = tile(atoms, reps, mode, temperature_K, seed)
+    reps = np.asarray(reps)
+    movable = seam_molecules(big, mol, reps, seam)
+    table = contact_table(atoms, mol[:len(atoms)])
+    n_before = overlaps(big, mol, movable, table)
+    iters, n_left = relieve(big, mol, movable, table)
+    print(f'{len(atoms)} -> {len(big)} atoms ({"x".join(map(str, reps))}, mode {mode}), {movable.sum()} / {len(movable)} '
+          f'molecules at seams, overlaps {n_before} -> {n_left} in {iters} relief iterations '
+          f'({time.perf_counter() - t0:.1f} s)')
+    if n_left:
+        print(f'Warning: {n_left} overlapping pairs left (raise RELIEF_ITERS or relax with a backend).')
+    if backend:
+        relax(big, mol, movable, backend, device=device)
+    return big
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tile an equilibrated box into a supercell for large-system starts.')
+    parser.add_argument('input', help='Equilibrated structure (*_equilibrated_*.xyz, with a cell).')
+    parser.add_argument('reps', type=int, nargs=3, help='Replicas along a, b, c.')
+    parser.add_argument('--mode', default=MODE, choices=['rotate', 'shift', 'none'])
+    parser.add_argument('--temp', type=float, default=TEMP, help='Velocity temperature (K).')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--seam', type=float, default=SEAM)
+    parser.add_argument('--relax', metavar='BACKEND', default=None, help='Short LBFGS of the seam atoms with this backend.')
+    parser.add_argument('--device', default=None)
+    parser.add_argument('--output', default=None, help='Default: <input>_<n>x<m>x<k>.xyz')
+    args = parser.parse_args()
+
+    atoms = read(args.input)
+    atoms.set_pbc(True)
+    big = supercell(atoms, args.reps, args.mode, args.temp, args.seed, args.seam, args.relax, args.device)
+    output = args.output or f'{args.input.rsplit(".", 1)[0]}_{"x".join(map(str, args.reps))}.xyz'
+    write(output, big)
+    print(f'Saved to {output} (with velocities)')
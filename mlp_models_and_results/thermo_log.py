@@ -0,0 +1,127 @@
+import os, time
+import numpy as np
+from ase import units
+
+
+# Compact thermo log for the MD scripts.
+#
+# Instead of printing an f-string every INTERVAL steps, each record
+# (step, T, PE, KE, conserved energy) goes into a preallocated numpy ring
+# buffer that is flushed to disk one block at a time. Running mean/variance
+# (Welford) are kept for the whole run and only a throttled summary line is
+# printed.
+#
+# File formats (picked from the extension):
+#   .csv - text with a 'step,T,PE,KE,Econs' header.
+#   other - raw little-endian float64 records of 5 columns (see read_thermo).
+COLUMNS = ('step', 'T', 'PE', 'KE', 'Econs')
+BLOCK_SIZE = 1000       # NOTE: Records per disk flush (also the size of the in-memory window).
+SUMMARY_EVERY = 60.0    # NOTE: Seconds of wall time between summary lines.
+
+
+class ThermoRecorder:
+    """Ring-buffered thermo recorder with running statistics."""
+
+    def __init__(self, filename, atoms, block_size=BLOCK_SIZE, summary_every=SUMMARY_EVERY, phase='Prod'):
+        self.filename = filename
+        self.atoms = atoms
+        self.phase = phase
+        self.csv = filename.endswith('.csv')
+        self.buffer = np.zeros((block_size, len(COLUMNS)))
+        self.n_records = 0      # Total records seen.
+        self.n_flushed = 0      # Records already on disk.
+        self.summary_every = summary_every
+        self._last_summary = time.perf_counter()
+        self.ndof = 3 * len(atoms)
+        # Welford accumulators for T, PE, KE, Econs.
+        self.count = 0
+        self.mean = np.zeros(len(COLUMNS) - 1)
+        self.m2 = np.zeros(len(COLUMNS) - 1)
+
+        new_file = not os.path.exists(filename) or os.path.getsize(filename) == 0
+        self.f = open(filename, 'a' if self.csv else 'ab')
+        if self.csv and new_file:
+            self.f.write(','.join(COLUMNS) + '\n')
+
+    def attach(self, dyn, interval=1, step_offset=0):
+        """Record every `interval` steps of `dyn` (the conserved energy comes from dyn if it has one)."""
+        dyn.attach(self._observe, interval, dyn, step_offset)
+
+    def _observe(self, dyn, step_offset):
+        epot = self.atoms.get_potential_energy()
+        ekin = self.atoms.get_kinetic_energy()
+        if hasattr(dyn, 'get_gibbs_free_energy'):
+            econs = dyn.get_gibbs_free_energy()
+        else:
+            econs = epot + ekin
+        self.record(step_offset + dyn.nsteps, 2 * ekin / (self.ndof * units.kB), epot, ekin, econs)
+
+    def record(self, step, temp, epot, ekin, econs):
+        row = self.buffer[self.n_records % len(self.buffer)]
+        row[:] = (step, temp, epot, ekin, econs)
+        self.n_records += 1
+
+        x = row[1:]
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+        if self.n_records - self.n_flushed == len(self.buffer):
+            self.flush()
+        if time.perf_counter() - self._last_summary >= self.summary_every:
+            self.print_summary()
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else np.zeros_like(self.m2)
+
+    def window(self, n=None):
+        """Return the last n records (at most block_size) in chronological order."""
+        size = len(self.buffer)
+        n = min(self.n_records, size) if n is None else min(n, self.n_records, size)
+        idx = np.arange(self.n_records - n, self.n_records) % size
+        return self.buffer[idx]
+
+    def flush(self):
+        """Write the records not yet on disk in one block."""
+        n = self.n_records - self.n_flushed
+        if n == 0:
+            return
+        block = self.window(n)
+        if self.csv:
+            np.savetxt(self.f, block, fmt=['%d', '%.3f', '%.6f', '%.6f', '%.6f'], delimiter=',')
+        else:
+            self.f.write(block.astype('<f8').tobytes())
+        self.f.flush()
+        self.n_flushed = self.n_records
+
+    def print_summary(self):
+        self._last_summary = time.perf_counter()
+        if self.count == 0:
+            return
+        step, temp, epot = self.window(1)[0][:3]
+        std = np.sqrt(self.variance)
+        print(f'{self.phase} Step {int(step)}: T={temp:.1f}K (mean {self.mean[0]:.1f} +/- {std[0]:.1f}), '
+              f'PE={epot:.1f} eV (mean {self.mean[1]:.1f} +/- {std[1]:.1f}), '
+              f'Econs mean {self.mean[3]:.1f} eV [{self.count} records]', flush=True)
+
+    def close(self):
+        if not self.f.closed:
+            self.flush()
+            self.print_summary()
+            self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_thermo(filename):
+    """Load a thermo log (csv or binary) as an (n, 5) array."""
+    if filename.endswith('.csv'):
+        return np.loadtxt(filename, delimiter=',', skiprows=1, ndmin=2)
+    data = np.fromfile(filename, dtype='<f8')
+    return data[:len(data) // len(COLUMNS) * len(COLUMNS)].reshape(-1, len(COLUMNS))
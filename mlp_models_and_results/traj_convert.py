@@ -0,0 +1,230 @@
+import argparse, os, time
+import numpy as np
+from collections import deque
+from multiprocessing import Pool
+from ase import Atoms
+from ase.geometry import cell_to_cellpar, cellpar_to_cell, wrap_positions
+
+from binary_traj import BinaryTrajectoryWriter, frame_dtype
+from compressed_traj import CompressedTrajectoryWriter
+from traj_readers import open_frames
+
+
+# Single-pass, multi-sink trajectory conversion.
+#
+# Each frame is read and parsed ONCE and handed to every sink (wrapped/unwrapped
+# LAMMPS, binary, ... each optionally subsampled with its own stride). The
+# orientation fix (cell_to_cellpar -> cellpar_to_cell) and the wrap are computed
+# at most once per frame and shared. Chunks of frames run in a process pool;
+# every sink formats its part of a chunk in the worker and the main process
+# appends the parts to the sink files in order.
+#
+# A sink needs: filename, stride, open(frames), format(out_index, frame) -> bytes
+# or array (run in workers), write(part) and close() (run in the main process).
+CHUNK_FRAMES = 200   # NOTE: Frames per pool task.
+LOOKAHEAD = 2        # NOTE: Chunks per worker converted ahead of the writes (bounds memory if a sink is slow, e.g. a FIFO).
+
+_frames = None
+_sinks = None
+
+
+class Frame:
+    """One parsed frame with the derived coordinates cached for all sinks."""
+
+    def __init__(self, k, step, data):
+        self.k = k
+        self.step = step
+        self.cell = data['cell']
+        self.positions = data['positions']
+        self.velocities = data['velocities']
+        self._standard = None
+        self._wrapped = None
+
+    def standard(self):
+        """Cell/positions after set_cell(cellpar_to_cell(cell_to_cellpar(cell)), scale_atoms=True)."""
+        if self._standard is None:
+            new_cell = cellpar_to_cell(cell_to_cellpar(self.cell))
+            self._standard = (new_cell, self.positions @ np.linalg.solve(self.cell, new_cell))
+        return self._standard
+
+    def wrapped(self):
+        """standard() followed by Atoms.wrap()."""
+        if self._wrapped is None:
+            cell, positions = self.standard()
+            self._wrapped = (cell, wrap_positions(positions, cell, pbc=True))
+        return self._wrapped
+
+
+class BinarySink:
+    """Writes frames to a binary_traj.py container (velocities zero if the source has none)."""
+
+    def __init__(self, filename, stride=1):
+        self.filename = filename
+        self.stride = stride
+
+    def open(self, frames):
+        self.dtype = frame_dtype(len(frames.symbols))
+        open(self.filename, 'wb').close()   # Replace, like TextSink: the writer appends to a file with a matching header.
+        self.writer = BinaryTrajectoryWriter(self.filename, Atoms(symbols=frames.symbols, pbc=True))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('writer', None)
+        return state
+
+    def format(self, i, frame):
+        rec = np.zeros(1, dtype=self.dtype)
+        rec['step'] = frame.step
+        rec['cell'] = frame.cell
+        rec['positions'] = frame.positions
+        if frame.velocities is not None:
+            rec['velocities'] = frame.velocities
+        return rec
+
+    def write(self, parts):
+        if parts:
+            self.writer.write_block(np.concatenate(parts))
+
+    def close(self):
+        self.writer.close()
+
+
+class CompressedSink:
+    """Writes frames to a compressed_traj.py container (velocities zero if the source has none)."""
+
+    def __init__(self, filename, stride=1):
+        self.filename = filename
+        self.stride = stride
+
+    def open(self, frames):
+        open(self.filename, 'wb').close()   # Replace, like TextSink: the writer appends to a file with a matching header.
+        self.writer = CompressedTrajectoryWriter(self.filename, Atoms(symbols=frames.symbols, pbc=True))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('writer', None)
+        return state
+
+    def format(self, i, frame):
+        return frame.step, frame.cell, frame.positions, frame.velocities
+
+    def write(self, parts):
+        for part in parts:
+            self.writer.write_arrays(*part)
+
+    def close(self):
+        self.writer.close()
+
+
+class TextSink:
+    """Base for text sinks: parts are bytes, written to an open file."""
+
+    def open(self, frames):
+        self.f = open(self.filename, 'wb')
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('f', None)
+        return state
+
+    def write(self, parts):
+        self.f.write(b''.join(parts))
+
+    def close(self):
+        self.f.close()
+
+
+def available_cpus():
+    """Cores this process may run on: the job's allocation on a shared SLURM node, not the whole node."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:   # No affinity API (macOS/Windows).
+        return os.cpu_count()
+
+
+def _init_worker(frames, sinks):
+    global _frames, _sinks
+    _frames, _sinks = frames, sinks
+
+
+def _convert_chunk(indices):
+    parts = [[] for _ in _sinks]
+    for k in indices:
+        step = _frames.steps[k] if _frames.steps[k] >= 0 else k
+        frame = Frame(k, step, _frames.read(k))
+        for sink, out in zip(_sinks, parts):
+            if k % sink.stride == 0:
+                out.append(sink.format(k // sink.stride, frame))
+    return parts
+
+
+def convert(traj_file, sinks, workers=None, chunk_frames=CHUNK_FRAMES):
+    """Read traj_file once and feed every sink. Returns frames/s."""
+    frames = open_frames(traj_file)
+    for sink in sinks:
+        sink.open(frames)
+    tasks = [np.arange(start, min(start + chunk_frames, len(frames)))
+             for start in range(0, len(frames), chunk_frames)]
+    workers = workers or available_cpus()
+
+    t_start = time.perf_counter()
+    done = 0
+
+    def write_next(pending):
+        nonlocal done
+        result, idx = pending.popleft()
+        for sink, part in zip(sinks, result.get()):
+            sink.write(part)
+        done += len(idx)
+        print(f'Converted {done}/{len(frames)} frames...', end='\r')
+
+    try:
+        with Pool(workers, initializer=_init_worker, initargs=(frames, sinks)) as pool:
+            # Chunks are written in order while at most workers * LOOKAHEAD run ahead.
+            pending = deque()
+            for idx in tasks:
+                pending.append((pool.apply_async(_convert_chunk, (idx,)), idx))
+                if len(pending) >= workers * LOOKAHEAD:
+                    write_next(pending)
+            while pending:
+                write_next(pending)
+    finally:
+        for sink in sinks:
+            sink.close()
+    elapsed = time.perf_counter() - t_start
+    fps = done / elapsed if elapsed > 0 else float('inf')
+    print(f'\nRead {done} frames once into {len(sinks)} sinks ({fps:.1f} frames/s with {workers} workers):')
+    for sink in sinks:
+        print(f'  {sink.filename} (every {sink.stride} frames)')
+    return fps
+
+
+def _sink_arg(value):
+    """'file' or 'file:stride'."""
+    name, _, stride = value.rpartition(':') if value.rpartition(':')[2].isdigit() else (value, '', '')
+    return name, int(stride) if stride else 1
+
+
+if __name__ == '__main__':
+    from lammps_export import LammpsSink
+
+    parser = argparse.ArgumentParser(description='Convert a .xyz/.bin trajectory into several outputs in one pass.')
+    parser.add_argument('traj')
+    parser.add_argument('--unwrapped', action='append', default=[], type=_sink_arg, metavar='FILE[:STRIDE]',
+                        help='LAMMPS dump with xu yu zu (no wrapping).')
+    parser.add_argument('--wrapped', action='append', default=[], type=_sink_arg, metavar='FILE[:STRIDE]',
+                        help='LAMMPS dump with x y z wrapped into the box.')
+    parser.add_argument('--bin', action='append', default=[], type=_sink_arg, metavar='FILE[:STRIDE]',
+                        help='Binary trajectory (binary_traj.py).')
+    parser.add_argument('--zbin', action='append', default=[], type=_sink_arg, metavar='FILE[:STRIDE]',
+                        help='Compressed fixed-point trajectory (compressed_traj.py).')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk', type=int, default=CHUNK_FRAMES)
+    args = parser.parse_args()
+    sinks = ([LammpsSink(f, unwrapped=True, stride=s) for f, s in args.unwrapped]
+             + [LammpsSink(f, unwrapped=False, stride=s) for f, s in args.wrapped]
+             + [BinarySink(f, stride=s) for f, s in args.bin]
+             + [CompressedSink(f, stride=s) for f, s in args.zbin])
+    if not sinks:
+        parser.error('Give at least one of --unwrapped, --wrapped, --bin, --zbin.')
+    convert(args.traj, sinks, workers=args.workers, chunk_frames=args.chunk)
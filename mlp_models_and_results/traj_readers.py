@@ -0,0 +1,218 @@
+import mmap, re
+import numpy as np
+from ase.data import atomic_masses, atomic_numbers, chemical_symbols
+
+from binary_traj import BinaryTrajectoryReader
+from compressed_traj import CompressedTrajectoryReader
+from extxyz_index import load_index
+
+
+# Random-access frame readers returning plain numpy arrays.
+#
+# Used by the converters/analysis tools that do not need ASE Atoms per frame.
+# LAMMPS dumps (.lmp/.lammpstrj/.dump, e.g. the TRAVIS exports) are indexed by
+# one regex scan for the TIMESTEP items when opened. Every reader has
+# .symbols, .steps, len(), frame(k) -> (cell (3x3), positions (N x 3)) and
+# read(k) -> dict(cell, positions, velocities or None), all float64.
+# They only hold a filename until first use, so they can be pickled to worker
+# processes.
+LATTICE_RE = re.compile(rb'Lattice="([^"]+)"')
+PROPERTIES_RE = re.compile(rb'Properties=(\S+)')
+TIMESTEP_RE = re.compile(rb'ITEM: TIMESTEP\s+(-?\d+)')
+LAMMPS_EXTENSIONS = ('.lmp', '.lammpstrj', '.dump')
+
+
+def parse_extxyz_frame(buf):
+    """Cell, positions, symbols and velocities (None if absent) from the bytes of one extxyz frame."""
+    header, comment, body = buf.split(b'\n', 2)
+    natoms = int(header)
+    cell = np.array(LATTICE_RE.search(comment).group(1).split(), dtype=float).reshape(3, 3)
+
+    # Column layout from Properties= (species:S:1:pos:R:3:...), plain xyz otherwise.
+    m = PROPERTIES_RE.search(comment)
+    fields = m.group(1).strip(b'"').split(b':') if m else [b'species', b'S', b'1', b'pos', b'R', b'3']
+    col, cols = 0, {}
+    for name, n in zip(fields[0::3], fields[2::3]):
+        cols[name] = col
+        col += int(n)
+
+    rows = np.array(body.split()[:natoms * col]).reshape(natoms, col)
+    positions = rows[:, cols[b'pos']:cols[b'pos'] + 3].astype(float)
+    symbols = rows[:, cols[b'species']].astype(str)
+    velocities = None
+    if b'momenta' in cols:
+        masses = atomic_masses[[atomic_numbers[s] for s in symbols]]
+        velocities = rows[:, cols[b'momenta']:cols[b'momenta'] + 3].astype(float) / masses[:, None]
+    elif b'velo' in cols:
+        velocities = rows[:, cols[b'velo']:cols[b'velo'] + 3].astype(float)
+    return {'cell': cell, 'positions': positions, 'symbols': symbols, 'velocities': velocities}
+
+
+class ExtxyzFrames:
+    """extxyz trajectory read through its .idx sidecar (see extxyz_index.py)."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.offsets, self.steps = load_index(filename)
+        self._mm = None
+        with open(filename, 'rb') as f:
+            end = self.offsets[1] if len(self.offsets) > 1 else None
+            f.seek(self.offsets[0])
+            self.symbols = parse_extxyz_frame(f.read(None if end is None else end - self.offsets[0]))['symbols']
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_mm'] = None
+        return state
+
+    def raw(self, k):
+        if self._mm is None:
+            with open(self.filename, 'rb') as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        start = self.offsets[k]
+        end = self.offsets[k + 1] if k + 1 < len(self.offsets) else len(self._mm)
+        return self._mm[start:end]
+
+    def read(self, k):
+        return parse_extxyz_frame(self.raw(k))
+
+    def frame(self, k):
+        data = self.read(k)
+        return data['cell'], data['positions']
+
+
+class BinaryFrames:
+    """Binary trajectory from binary_traj.py."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._reader = BinaryTrajectoryReader(filename)
+        self.symbols = np.array([chemical_symbols[z] for z in self._reader.numbers])
+        self.steps = np.array(self._reader.frames['step'])
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_reader'] = None
+        return state
+
+    def read(self, k):
+        if self._reader is None:
+            self._reader = BinaryTrajectoryReader(self.filename)
+        rec = self._reader[k]
+        return {'cell': rec['cell'].astype(np.float64),
+                'positions': rec['positions'].astype(np.float64),
+                'symbols': self.symbols,
+                'velocities': rec['velocities'].astype(np.float64)}
+
+    def frame(self, k):
+        data = self.read(k)
+        return data['cell'], data['positions']
+
+
+class CompressedFrames:
+    """Compressed trajectory from compressed_traj.py."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._reader = CompressedTrajectoryReader(filename)
+        self.symbols = np.array([chemical_symbols[z] for z in self._reader.numbers])
+        self.steps = self._reader.steps
+
+    def __len__(self):
+        return len(self.steps)
+
+    def read(self, k):
+        # Workers get contiguous chunks, so the reader's one-block cache is hit for most frames.
+        _, cell, positions, velocities = self._reader.get_arrays(k)
+        return {'cell': cell, 'positions': positions, 'symbols': self.symbols, 'velocities': velocities}
+
+    def frame(self, k):
+        data = self.read(k)
+        return data['cell'], data['positions']
+
+
+def parse_lammps_frame(buf):
+    """Cell, positions (sorted by id), symbols (element, else type) and velocities from one LAMMPS dump frame."""
+    lines = buf.split(b'\n', 9)
+    natoms = int(lines[3])
+    bounds = np.array([l.split() for l in lines[5:8]], dtype=float)
+    if bounds.shape[1] == 3:
+        # Triclinic: bounding box plus tilt factors xy, xz, yz.
+        xy, xz, yz = bounds[:, 2]
+        lo = bounds[:, 0] - [min(0, xy, xz, xy + xz), min(0, yz), 0]
+        hi = bounds[:, 1] - [max(0, xy, xz, xy + xz), max(0, yz), 0]
+        cell = np.array([[hi[0] - lo[0], 0, 0], [xy, hi[1] - lo[1], 0], [xz, yz, hi[2] - lo[2]]])
+    else:
+        lo = bounds[:, 0]
+        cell = np.diag(bounds[:, 1] - lo)
+    names = lines[8].split()[2:]
+    cols = {name: k for k, name in enumerate(names)}
+    rows = np.array(lines[9].split()[:natoms * len(names)]).reshape(natoms, len(names))
+    if b'id' in cols:
+        rows = rows[np.argsort(rows[:, cols[b'id']].astype(int), kind='stable')]
+    for xyz, scaled in (((b'xu', b'yu', b'zu'), False), ((b'x', b'y', b'z'), False), ((b'xs', b'ys', b'zs'), True),
+                        ((b'xsu', b'ysu', b'zsu'), True)):
+        if all(c in cols for c in xyz):
+            positions = rows[:, [cols[c] for c in xyz]].astype(float)
+            positions = positions @ cell if scaled else positions - lo
+            break
+    else:
+        raise ValueError(f'No coordinate columns in LAMMPS dump (columns: {[n.decode() for n in names]}).')
+    symbols = rows[:, cols[b'element'] if b'element' in cols else cols[b'type']].astype(str)
+    velocities = None
+    if all(c in cols for c in (b'vx', b'vy', b'vz')):
+        velocities = rows[:, [cols[b'vx'], cols[b'vy'], cols[b'vz']]].astype(float)
+    return {'cell': cell, 'positions': positions, 'symbols': symbols, 'velocities': velocities}
+
+
+class LammpsFrames:
+    """LAMMPS text dump (as written by lammps_export.py), indexed by a scan for the TIMESTEP items."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._mm = None
+        with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            matches = [(m.start(), int(m.group(1))) for m in TIMESTEP_RE.finditer(mm)]
+        self.offsets = np.array([o for o, _ in matches], dtype=np.int64)
+        self.steps = np.array([s for _, s in matches], dtype=np.int64)
+        self.symbols = self.read(0)['symbols']
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_mm'] = None
+        return state
+
+    def raw(self, k):
+        if self._mm is None:
+            with open(self.filename, 'rb') as f:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        start = self.offsets[k]
+        end = self.offsets[k + 1] if k + 1 < len(self.offsets) else len(self._mm)
+        return self._mm[start:end]
+
+    def read(self, k):
+        return parse_lammps_frame(self.raw(k))
+
+    def frame(self, k):
+        data = self.read(k)
+        return data['cell'], data['positions']
+
+
+def open_frames(filename):
+    """Pick the reader from the file extension."""
+    if filename.endswith(LAMMPS_EXTENSIONS):
+        return LammpsFrames(filename)
+    if filename.endswith('.bin'):
+        return BinaryFrames(filename)
+    if filename.endswith('.zbin'):
+        return CompressedFrames(filename)
+    return ExtxyzFrames(filename)
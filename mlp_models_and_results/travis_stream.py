@@ -0,0 +1,188 @@
+import argparse, errno, glob, os, queue, shlex, subprocess, tempfile, threading, time
+
+from lammps_export import LammpsSink, body_template
+from traj_convert import Frame, convert
+
+
+# Stream LAMMPS dump frames into named pipes (FIFOs) for TRAVIS.
+#
+# Instead of materialising multi-GB wrapped/unwrapped .lmp copies, the stored
+# trajectory (.bin or indexed .xyz) is read ONCE by traj_convert.convert() and
+# every frame is written into one FIFO per TRAVIS run. TRAVIS is started with
+# `-p <fifo>.lmp` (the extension tells it the format) and reads the stream as
+# if it were a file, so several analyses run concurrently from one read and
+# no text trajectory touches the disk.
+#
+# TRAVIS opens the trajectory once during setup (it reads the first frame to
+# build the molecule list, then closes it) and again for the main pass, so each
+# FIFO first serves SETUP_OPENS opens with only frame 0 and waits for the
+# consumer to close it (checked in /proc, Linux only) before serving the full
+# stream. Each FIFO has its own writer thread and bounded queue, so one slow
+# analysis does not stall the others until its queue is full. A consumer that
+# exits early (or never opens its pipe) is dropped and the rest carry on.
+#
+# TRAVIS cannot seek in a pipe: use it for single-pass analyses answered from
+# an input file (-i), and keep a .lmp on disk for anything that rewinds.
+TRAVIS_CMD = 'travis'   # NOTE: TRAVIS executable (module load travis on the cluster).
+SETUP_OPENS = 1         # NOTE: Opens that only get frame 0 before the main pass (0 if the consumer reads once).
+QUEUE_CHUNKS = 4        # NOTE: Converted chunks buffered per FIFO.
+
+_STOP = object()
+
+
+def _fifo_holders(path):
+    """Open file descriptors on path in all processes we can see."""
+    n = 0
+    for fd_dir in glob.glob('/proc/[0-9]*/fd'):
+        try:
+            n += sum(os.readlink(os.path.join(fd_dir, fd)) == path for fd in os.listdir(fd_dir))
+        except OSError:
+            continue  # Process exited or not ours.
+    return n
+
+
+class FifoSink(LammpsSink):
+    """LammpsSink writing into a FIFO from a background thread.
+
+    Creates the FIFO. Set .proc to the consumer's Popen to give up on it if it
+    exits before opening the pipe.
+    """
+
+    def __init__(self, filename, unwrapped=True, stride=1, setup_opens=SETUP_OPENS, maxsize=QUEUE_CHUNKS):
+        super().__init__(filename, unwrapped=unwrapped, stride=stride)
+        self.setup_opens = setup_opens
+        self.maxsize = maxsize
+        self.proc = None
+        if not os.path.exists(filename):
+            os.mkfifo(filename)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ('queue', 'thread', 'first', 'proc'):
+            state.pop(key, None)
+        return state
+
+    def open(self, frames):
+        self.template = body_template(frames.symbols, self.unwrapped)
+        self.first = self.format(0, Frame(0, 0, frames.read(0))) if self.setup_opens else b''
+        self.dropped = False
+        self.queue = queue.Queue(maxsize=self.maxsize)
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def _open_pipe(self):
+        """Wait for the consumer to open the FIFO (polling, so a dead consumer is noticed)."""
+        while True:
+            try:
+                fd = os.open(self.filename, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as e:
+                if e.errno != errno.ENXIO:  # ENXIO: no reader yet.
+                    raise
+                if self.proc is not None and self.proc.poll() is not None:
+                    raise BrokenPipeError(f'consumer exited with {self.proc.returncode}')
+                time.sleep(0.1)
+                continue
+            os.set_blocking(fd, True)
+            return os.fdopen(fd, 'wb')
+
+    def _serve_setup(self):
+        """Frame 0 only; returns once the consumer has closed the pipe again."""
+        f = self._open_pipe()
+        try:
+            f.write(self.first)
+        except BrokenPipeError:
+            pass  # Closed before reading all of frame 0: fine for a setup read.
+        finally:
+            try:
+                f.close()  # The fd is released even if the final flush fails.
+            except BrokenPipeError:
+                pass
+        # Reopening the write end while the consumer still holds its setup read
+        # end would feed the main stream into the setup read.
+        path = os.path.abspath(self.filename)
+        while _fifo_holders(path) and (self.proc is None or self.proc.poll() is None):
+            time.sleep(0.05)
+
+    def _serve(self):
+        try:
+            for _ in range(self.setup_opens):
+                self._serve_setup()
+            with self._open_pipe() as f:
+                while True:
+                    part = self.queue.get()
+                    if part is _STOP:
+                        return
+                    f.write(part)
+        except BrokenPipeError as e:
+            print(f'\n{self.filename}: consumer closed the pipe ({e}), dropping it.')
+        self.dropped = True
+        # Keep draining so the converter never blocks on a dead consumer.
+        while self.queue.get() is not _STOP:
+            pass
+
+    def write(self, parts):
+        self.queue.put(b''.join(parts))
+
+    def close(self):
+        self.queue.put(_STOP)
+        self.thread.join()
+
+
+def stream_travis(traj_file, consumers, workers=None, fifo_dir=None, setup_opens=SETUP_OPENS):
+    """Serve traj_file to several consumers at once.
+
+    consumers: list of (unwrapped, travis_input). With a TRAVIS input file,
+    `travis -p <fifo> -i <input>` is started in the input file's directory
+    (every analysis keeps its own travis.log); with None the FIFO is only
+    created and printed, for a consumer started by hand. Returns the exit codes.
+    """
+    own_dir = fifo_dir is None
+    fifo_dir = tempfile.mkdtemp(prefix='travis_fifo_') if own_dir else fifo_dir
+    stem = os.path.splitext(os.path.basename(traj_file))[0]
+    sinks, procs = [], []
+    try:
+        for i, (unwrapped, travis_input) in enumerate(consumers):
+            fifo = os.path.join(fifo_dir, f'{stem}_{"unwrapped" if unwrapped else "wrapped"}_{i}.lmp')
+            sinks.append(FifoSink(fifo, unwrapped=unwrapped, setup_opens=setup_opens))
+            if travis_input is None:
+                print(f'Serving {fifo}: start e.g. `{TRAVIS_CMD} -p {fifo} -i input_tr.txt`')
+                continue
+            run_dir = os.path.dirname(os.path.abspath(travis_input))
+            cmd = [*shlex.split(TRAVIS_CMD), '-p', fifo, '-i', os.path.basename(travis_input)]
+            with open(os.path.join(run_dir, 'travis_stream.out'), 'w') as out:
+                procs.append(subprocess.Popen(cmd, cwd=run_dir, stdout=out, stderr=subprocess.STDOUT))
+            sinks[-1].proc = procs[-1]
+            print(f'Started {" ".join(cmd)} in {run_dir}')
+        convert(traj_file, sinks, workers=workers)
+        codes = [p.wait() for p in procs]
+        for p, code in zip(procs, codes):
+            if code != 0:
+                print(f'{" ".join(p.args)} exited with {code}.')
+        return codes
+    finally:
+        for p in procs:
+            if p.poll() is None:
+                p.terminate()
+        for sink in sinks:
+            if os.path.exists(sink.filename):
+                os.remove(sink.filename)
+        if own_dir:
+            os.rmdir(fifo_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stream a .bin/.xyz trajectory into TRAVIS through named pipes.')
+    parser.add_argument('traj')
+    parser.add_argument('--unwrapped', action='append', default=[], metavar='INPUT',
+                        help='Run TRAVIS with this input file on unwrapped (xu yu zu) frames. "-" only serves the FIFO.')
+    parser.add_argument('--wrapped', action='append', default=[], metavar='INPUT',
+                        help='Same, with wrapped (x y z) frames.')
+    parser.add_argument('--fifo-dir', default=None, help='Where to create the FIFOs (default: a temporary directory).')
+    parser.add_argument('--setup-opens', type=int, default=SETUP_OPENS)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    consumers = ([(True, None if x == '-' else x) for x in args.unwrapped]
+                 + [(False, None if x == '-' else x) for x in args.wrapped])
+    if not consumers:
+        parser.error('Give at least one --unwrapped or --wrapped consumer.')
+    stream_travis(args.traj, consumers, workers=args.workers, fifo_dir=args.fifo_dir, setup_opens=args.setup_opens)
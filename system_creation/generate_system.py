@@ -1,24 +1,47 @@
+import argparse, hashlib, json, os
 import numpy as np
-import random
-from ase import Atoms
+from concurrent.futures import ProcessPoolExecutor
+from ase import Atoms, units
 from ase.build import molecule
-from ase.io import write
-from ase.geometry import get_distances
+from ase.io import read, write
 
 
+# Builds a periodic box of a molecular mixture on a jittered grid.
+#
+#   python generate_system.py                                            (the production box below)
+#   python generate_system.py --composition water=500 imidazole=50 --density 1.05 --seed 1
+#
+# build_box() takes a composition ({molecule name: count}) and either a target
+# density (the cubic box side follows from the molecular masses) or a side. The
+# grid is the smallest cube with SPARE_SLOTS spare slots. cached_box() stores
+# every box under CACHE_DIR, named by a hash of all parameters that change the
+# result and BUILDER_VERSION, so a scan over compositions/densities builds each
+# box once. Without a seed the key has seed None: the first call draws one (kept
+# in the .json sidecar) and later unseeded calls reuse that box.
+
 # Calculated for approx 1.0 g/mL density:
 # Mass ~ 30,830 u. Volume needed ~ 51,200 A^3. Cube root ~ 37.13 A.
-SIDE_LENGTH = 37.2  
+SIDE_LENGTH = 37.2   # NOTE: Side used when neither --density nor --side is given.
 FILENAME = 'water_acetic_imidazole_mix.xyz'
 
 N_WATER = 1000
 N_ACETIC = 100
 N_IMIDAZOLE = 100
-TOTAL_MOLS = N_WATER + N_ACETIC + N_IMIDAZOLE
+COMPOSITION = {'water': N_WATER, 'acetic': N_ACETIC, 'imidazole': N_IMIDAZOLE}
 MIN_DISTANCE = 1.5   # Minimum allowed distance (Angstroms).
+SPARE_SLOTS = 0.1    # NOTE: Fraction of extra grid slots for crowded ones skipped (1200 molecules -> 11x11x11 = 1331 slots).
+N_ATTEMPTS = 500     # Random rotations tried per grid slot before it is skipped.
+FIRST_BATCH = 8      # Rotation candidates checked at once on the first try at a slot (most slots take the first)...
+BATCH = 64           # ...and on every further try, for crowded slots.
+JITTER = 0.4         # Random offset from the slot centre, +-JITTER/2 per axis (Angstroms).
+WORKERS = 1          # NOTE: Processes filling disjoint slabs of the grid in parallel (1 = serial).
+SEED = None          # NOTE: Set for a reproducible box.
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'aibn_mlp', 'boxes')
+BUILDER_VERSION = 1  # NOTE: Bump on any change that alters the box built from the same parameters (invalidates the cache).
+
 
-print(f'Generating system: {N_WATER} Water, {N_ACETIC} Acetic, {N_IMIDAZOLE} Imidazole')
-print(f'Box Size: {SIDE_LENGTH} A (Target Density ~ 1.0 g/mL)')
+class PlacementError(RuntimeError):
+    """Not all molecules fit: the density is too high for the grid placement."""
 
 
 def build_imidazole():
@@ -59,103 +82,309 @@ def build_acetic_acid():
     )
     return atoms
 
+def acetic_acid():
+    # Try ASE standard first, fallback to manual if missing
+    try:
+        return molecule('CH3COOH')
+    except Exception:
+        return build_acetic_acid()
+
+
+# Molecule builders by composition name (in this order in the shuffled molecule list).
+MOLECULES = {'water': lambda: molecule('H2O'), 'acetic': acetic_acid, 'imidazole': build_imidazole}
+
+
+# All 27 neighbour offsets (including the cell itself).
+NEIGHBOUR_OFFSETS = np.array([[i, j, k] for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)])
+
+
+class CellList:
+    """Periodic cell list of the placed atoms (cubic box), updated as molecules are accepted.
+
+    Cells are at least MIN_DISTANCE wide, so any atom closer than that to a
+    candidate atom is in one of the 27 cells around it: an overlap check costs
+    the same however many molecules are already in the box.
+    """
+
+    def __init__(self, side, min_distance, capacity=2):
+        self.side = side
+        self.min_distance = min_distance
+        self.n = max(int(side // min_distance), 1)
+        self.size = side / self.n
+        # Positions per cell, NaN-padded to a fixed capacity so a query is one gather.
+        self.positions = np.full((self.n, self.n, self.n, capacity, 3), np.nan)
+        self.count = np.zeros((self.n, self.n, self.n), dtype=int)
+
+    def _cells(self, positions):
+        return np.floor(positions / self.size).astype(int) % self.n
+
+    def add(self, positions):
+        for c, p in zip(self._cells(positions), positions):
+            c = tuple(c)
+            if self.count[c] == self.positions.shape[3]:
+                grown = np.full(self.positions.shape[:3] + (2 * self.positions.shape[3], 3), np.nan)
+                grown[:, :, :, :self.positions.shape[3]] = self.positions
+                self.positions = grown
+            self.positions[c + (self.count[c],)] = p
+            self.count[c] += 1
+
+    def overlaps(self, candidates):
+        """Per candidate (candidates, atoms, 3), True if any atom is within min_distance (minimum image) of a placed atom."""
+        positions = candidates.reshape(-1, 3)
+        cells = (self._cells(positions)[:, None, :] + NEIGHBOUR_OFFSETS) % self.n
+        near = self.positions[cells[..., 0], cells[..., 1], cells[..., 2]]    # (atoms, 27, capacity, 3)
+        d = near - positions[:, None, None, :]
+        d -= self.side * np.round(d / self.side)
+        hit = ((d * d).sum(axis=-1) <= self.min_distance ** 2).any(axis=(1, 2))  # NaN (empty slots) compares False.
+        return hit.reshape(candidates.shape[:2]).any(axis=1)
+
+
+def random_rotations(rng, n):
+    """n uniformly distributed rotation matrices, from random unit quaternions."""
+    q = rng.normal(size=(n, 4))
+    w, x, y, z = q.T / np.linalg.norm(q, axis=1)
+    return np.array([[1 - 2*(y*y + z*z), 2*(x*y - z*w), 2*(x*z + y*w)],
+                     [2*(x*y + z*w), 1 - 2*(x*x + z*z), 2*(y*z - x*w)],
+                     [2*(x*z - y*w), 2*(y*z + x*w), 1 - 2*(x*x + y*y)]]).transpose(2, 0, 1)
+
+
+def place_in_slot(template, centre, cell_list, rng):
+    """Positions of template at centre (+ jitter) with the first non-overlapping random rotation, or None.
+
+    Rotations are tried in batches: all candidates of a batch are transformed in
+    one matrix product and checked in one cell-list query.
+    """
+    tried, size = 0, FIRST_BATCH
+    while tried < N_ATTEMPTS:
+        n = min(size, N_ATTEMPTS - tried)
+        rotations = random_rotations(rng, n)
+        jitter = (rng.random((n, 3)) - 0.5) * JITTER
+        candidates = template @ rotations.transpose(0, 2, 1) + (centre + jitter)[:, None, :]
+        free = np.flatnonzero(~cell_list.overlaps(candidates))
+        if len(free):
+            return candidates[free[0]]
+        tried, size = tried + n, BATCH
+    return None
+
+
+def fill_slots(slots, mols, templates, cell_list, rng, step, progress=False):
+    """Place mols (template indices) in order into slots (grid indices), skipping crowded slots.
+
+    Returns (placed [(template index, positions)], slots not tried, molecules not placed).
+    """
+    placed = []
+    i = 0
+    while i < len(slots) and len(placed) < len(mols):
+        slot = slots[i]
+        i += 1
+        positions = place_in_slot(templates[mols[len(placed)]], (np.array(slot) + 0.5) * step, cell_list, rng)
+        if positions is None:
+            # If all N_ATTEMPTS fail, the grid is too tight here.
+            # We skip this grid slot and try the same molecule in the next one (we have ~130 spares).
+            print(f"Warning: Grid slot ({slot[0]},{slot[1]},{slot[2]}) too crowded. Skipping.")
+            continue
+        cell_list.add(positions)
+        placed.append((mols[len(placed)], positions))
+        if progress and len(placed) % 100 == 0:
+            print(f"Placed {len(placed)} molecules...")
+    return placed, slots[i:], mols[len(placed):]
+
+
+def fill_region(task):
+    """Worker: fill one slab's slots, with the atoms already placed elsewhere as fixed obstacles."""
+    slots, mols, templates, fixed, seed, side, step = task
+    cell_list = CellList(side, MIN_DISTANCE)
+    cell_list.add(fixed)
+    return fill_slots(slots, mols, templates, cell_list, np.random.default_rng(seed), step)
+
+
+def slabs(n_grid, step, radius, workers):
+    """Split the grid's x layers into an even number (<= 2 x workers) of slabs, each thick enough that molecules
+    in the slabs on either side of it can never be within MIN_DISTANCE of each other. [] if that is not possible."""
+    min_layers = max(int(np.ceil((2 * radius + MIN_DISTANCE + JITTER) / step)) - 1, 1)
+    n = min(2 * workers, n_grid // min_layers)
+    n -= n % 2
+    return [] if n < 2 else [range(a, b) for a, b in zip(np.linspace(0, n_grid, n + 1).astype(int)[:-1],
+                                                       np.linspace(0, n_grid, n + 1).astype(int)[1:])]
+
+
+def place_parallel(slots, mols, templates, side, step, regions, workers, seeds):
+    """Fill the slabs in two phases (even slabs, then odd ones) on a process pool, then place any molecules a
+    slab could not fit into the remaining slots serially. Returns (placed, molecules not placed)."""
+    region_slots = [[s for s in slots if s[0] in r] for r in regions]
+    # Molecules per slab in proportion to its slots (the shuffled order keeps the mixture uniform).
+    bounds = np.round(np.cumsum([0] + [len(r) for r in region_slots]) / len(slots) * len(mols)).astype(int)
+    chunks = [mols[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+    placed, unused, leftover = [], [], []
+    with ProcessPoolExecutor(workers) as pool:
+        for phase in (0, 1):
+            fixed = np.concatenate([p for _, p in placed]) if placed else np.zeros((0, 3))
+            tasks = [(region_slots[k], chunks[k], templates, fixed, seeds[k + 1], side, step)
+                     for k in range(phase, len(regions), 2)]
+            for p, u, l in pool.map(fill_region, tasks):
+                placed += p
+                unused += u
+                leftover += l
+            print(f"Phase {phase + 1}: {len(placed)} molecules placed in {len(regions) // 2} slabs.")
+    if leftover:
+        cell_list = CellList(side, MIN_DISTANCE)
+        cell_list.add(np.concatenate([p for _, p in placed]))
+        p, _, leftover = fill_slots(sorted(unused), leftover, templates, cell_list,
+                                    np.random.default_rng(seeds[-1]), step)
+        placed += p
+    return placed, leftover
+
+
+def box_side(composition, density):
+    """Cubic box side (Angstroms) holding composition at density (g/mL)."""
+    mass = sum(n * MOLECULES[name]().get_masses().sum() for name, n in composition.items())   # u
+    return (mass * units._amu * 1e3 / density * 1e24) ** (1 / 3)
+
+
+def grid_size(n_mols, spare=SPARE_SLOTS):
+    """Smallest n with n^3 >= (1 + spare) x n_mols slots."""
+    n = int(round((n_mols * (1 + spare)) ** (1 / 3)))
+    while n ** 3 < n_mols * (1 + spare):
+        n += 1
+    while n > 1 and (n - 1) ** 3 >= n_mols * (1 + spare):
+        n -= 1
+    return n
+
+
+def build_params(composition, density=None, side=None, seed=None, workers=WORKERS):
+    """Everything that determines the box, as hashed for the cache (composition canonicalised, seed None if not given)."""
+    unknown = set(composition) - set(MOLECULES)
+    if unknown:
+        raise ValueError(f'Unknown molecules {sorted(unknown)} (known: {list(MOLECULES)}).')
+    composition = {name: int(composition[name]) for name in MOLECULES if composition.get(name, 0) > 0}
+    if not composition:
+        raise ValueError('Empty composition.')
+    if (density is None) == (side is None):
+        raise ValueError('Give exactly one of density and side.')
+    if side is None:
+        side = box_side(composition, density)
+    return {'composition': composition, 'side': round(float(side), 6), 'seed': None if seed is None else int(seed),
+            'workers': int(workers), 'spare_slots': SPARE_SLOTS, 'min_distance': MIN_DISTANCE,
+            'n_attempts': N_ATTEMPTS, 'jitter': JITTER, 'version': BUILDER_VERSION}
+
+
+def box_key(params):
+    """Content hash of the build parameters (cache file name)."""
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def with_seed(params):
+    """params with a seed drawn if it is None (recorded, so the box can still be rebuilt)."""
+    if params['seed'] is not None:
+        return params
+    return dict(params, seed=int(np.random.SeedSequence().entropy))
+
+
+def build_box(composition, density=None, side=None, seed=None, workers=WORKERS):
+    """Periodic cubic box of composition ({name: count}) at density (g/mL) or with the given side (Angstroms).
+
+    Raises PlacementError if the grid is too tight for all the molecules.
+    """
+    params = build_params(composition, density, side, seed, workers)
+    return _build(with_seed(params))
+
+
+def _build(params):
+    composition, side, workers = params['composition'], params['side'], params['workers']
+    names = list(composition)
+    n_mols = sum(composition.values())
+    n_grid = grid_size(n_mols, params['spare_slots'])
+    print('Generating system: ' + ', '.join(f'{n} {name}' for name, n in composition.items()))
+    print(f'Box Size: {side:.3f} A, seed {params["seed"]}')
+    seeds = np.random.SeedSequence(params['seed']).spawn(2 * workers + 2)
+    rng = np.random.default_rng(seeds[0])
+
+    print("Building molecule list...")
+    protos = [MOLECULES[name]() for name in names]
+    density = sum(n * p.get_masses().sum() for n, p in zip(composition.values(), protos)) * units._amu * 1e3 / (side * 1e-8) ** 3
+    print(f'Density: {density:.3f} g/mL')
+    # Templates centred on their bounding box (what Atoms.center() did) and rotated about it.
+    templates = [p.positions - (p.positions.min(axis=0) + p.positions.max(axis=0)) / 2 for p in protos]
+    radius = max(np.linalg.norm(t, axis=1).max() for t in templates)
+
+    # Shuffle for random mixture
+    mol_list = list(rng.permutation(np.repeat(np.arange(len(names)), list(composition.values()))))
+
+    step = side / n_grid
+    slots = [(x, y, z) for x in range(n_grid) for y in range(n_grid) for z in range(n_grid)]
+
+    # Up to N_ATTEMPTS rotations per slot to find a non-overlapping configuration
+    # NECESSARY because grid step (3.38 A for the production box) < Mol Size (~4.5 A)
+    print(f"Placing molecules on {n_grid}x{n_grid}x{n_grid} grid with SAFETY CHECK...")
+    regions = slabs(n_grid, step, radius, workers) if workers > 1 else []
+    if regions:
+        placed, leftover = place_parallel(slots, mol_list, templates, side, step, regions, workers, seeds)
+    else:
+        placed, _, leftover = fill_slots(slots, mol_list, templates, CellList(side, MIN_DISTANCE), rng, step,
+                                         progress=True)
+    if leftover:
+        raise PlacementError(f'Only placed {len(placed)} / {n_mols} molecules: the density is too high for this '
+                             f'grid generation method (lower it or raise SPARE_SLOTS).')
+    print(f"Placed {len(placed)} molecules successfully with NO OVERLAPS.")
+    return Atoms(numbers=np.concatenate([protos[k].numbers for k, _ in placed]),
+                 positions=np.concatenate([p for _, p in placed]),
+                 pbc=True, cell=[side, side, side])
+
+
+def cached_box(composition, density=None, side=None, seed=None, workers=WORKERS, cache_dir=CACHE_DIR):
+    """build_box() through the cache: (atoms, path of the cached .xyz, True on a cache hit). Boxes are built only on a miss."""
+    params = build_params(composition, density, side, seed, workers)
+    path = os.path.join(cache_dir, f'box_{box_key(params)}.xyz')
+    if os.path.exists(path):
+        print(f'Cache hit: {path}')
+        return read(path), path, True
+    print(f'Cache miss: building {os.path.basename(path)}')
+    params = with_seed(params)    # The key keeps seed None, the sidecar the seed actually used.
+    atoms = _build(params)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Written under temporary names and renamed, so concurrent scans never read a partial box.
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp + '.json', 'w') as f:
+        json.dump(params, f, indent=1, sort_keys=True)
+    write(tmp, atoms, format='extxyz')
+    os.replace(tmp + '.json', path[:-4] + '.json')
+    os.replace(tmp, path)
+    print(f'Cached as {path}')
+    return atoms, path, False
+
+
+def parse_composition(items):
+    """['water=1000', 'acetic=100'] -> {'water': 1000, 'acetic': 100}"""
+    composition = {}
+    for item in items:
+        name, _, n = item.partition('=')
+        composition[name] = int(n)
+    return composition
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a periodic box of a molecular mixture (cached by parameters).')
+    parser.add_argument('--composition', nargs='+', default=[f'{k}={v}' for k, v in COMPOSITION.items()],
+                        help=f'name=count pairs, names from {list(MOLECULES)}.')
+    size = parser.add_mutually_exclusive_group()
+    size.add_argument('--density', type=float, help='Target density in g/mL (sets the box side).')
+    size.add_argument('--side', type=float, help=f'Box side in A (default {SIDE_LENGTH} if no density).')
+    parser.add_argument('--seed', type=int, default=SEED, help='Random seed (if not given, one is drawn and reported; cached boxes reuse it).')
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--output', default=FILENAME)
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--no-cache', action='store_true', help='Always build, and do not store the box.')
+    args = parser.parse_args()
 
-atoms = Atoms(pbc=True, cell=[SIDE_LENGTH, SIDE_LENGTH, SIDE_LENGTH])
-
-mol_list = []
-print("Building molecule list...")
-
-# WATER
-for _ in range(N_WATER):
-    mol_list.append(molecule('H2O'))
-
-# Try ASE standard first, fallback to manual if missing
-try:
-    proto_acetic = molecule('CH3COOH')
-except:
-    proto_acetic = build_acetic_acid()
-
-for _ in range(N_ACETIC):
-    mol_list.append(proto_acetic.copy())
-
-proto_imidazole = build_imidazole()
-
-for _ in range(N_IMIDAZOLE):
-    mol_list.append(proto_imidazole.copy())
-
-# Shuffle for random mixture
-random.shuffle(mol_list)
-
-n_grid = 11  # 11x11x11 = 1331 slots
-step = SIDE_LENGTH / n_grid
-offset = step / 2.0
-
-print("Placing molecules on 11x11x11 grid with SAFETY CHECK...")
-count = 0
-
-for x in range(n_grid):
-    for y in range(n_grid):
-        for z in range(n_grid):
-            if count >= len(mol_list): break
-            
-            mol_base = mol_list[count]
-            
-            # Try up to 500 rotations to find a non-overlapping configuration
-            # NECESSARY because grid step (3.38 A) < Mol Size (~4.5 A)
-            placed_safely = False
-            
-            for attempt in range(500):
-                mol = mol_base.copy()
-                mol.center() # Reset to local origin
-                
-                # Rotate
-                mol.rotate(np.random.rand() * 360, 'x')
-                mol.rotate(np.random.rand() * 360, 'y')
-                mol.rotate(np.random.rand() * 360, 'z')
-                
-                # Translate to Grid + Jitter.
-                jitter = (np.random.rand(3) - 0.5) * 0.4
-                pos = [x*step + offset, y*step + offset, z*step + offset]
-                mol.translate(pos + jitter)
-                
-                # CHECK OVERLAPS:
-                # If this is the first molecule, it's always safe.
-                if len(atoms) == 0:
-                    placed_safely = True
-                    atoms.extend(mol)
-                    break
-                
-                # Calculate distances to ALL existing atoms using PBC.
-                # Only need the distance array (index 1 from get_distances).
-                dists = get_distances(mol.get_positions(), atoms.get_positions(), 
-                                      cell=atoms.cell, pbc=atoms.pbc)[1]
-                
-                # If the smallest distance is safe, place it.
-                if np.min(dists) > MIN_DISTANCE:
-                    placed_safely = True
-                    atoms.extend(mol)
-                    break
-            
-            if placed_safely:
-                count += 1
-                if count % 100 == 0:
-                    print(f"Placed {count} molecules...")
-            else:
-                # If we fail 500 times, the grid is too tight here.
-                # We skip this grid slot and hope the next one works (we have ~130 spares).
-                print(f"Warning: Grid slot ({x},{y},{z}) too crowded. Skipping.")
-                # We do NOT increment count, so we try this molecule again in the next slot.
-
-            
-        if count >= len(mol_list): break
-    if count >= len(mol_list): break
-
-if count < len(mol_list):
-    print(f"CRITICAL WARNING: Only placed {count} / {len(mol_list)} molecules.")
-    print("The density is too high for this grid generation method.")
-    exit(1)  
-else:
-    print(f"Placed {count} molecules successfully with NO OVERLAPS.")
-    write(FILENAME, atoms)
-    print(f"Saved to {FILENAME}")
-    
+    composition = parse_composition(args.composition)
+    side = SIDE_LENGTH if args.density is None and args.side is None else args.side
+    try:
+        if args.no_cache:
+            atoms = build_box(composition, args.density, side, args.seed, args.workers)
+        else:
+            atoms, _, _ = cached_box(composition, args.density, side, args.seed, args.workers, args.cache_dir)
+    except PlacementError as e:
+        print(f'CRITICAL WARNING: {e}')
+        raise SystemExit(1)
+    write(args.output, atoms)
+    print(f"Saved to {args.output}")